@@ -0,0 +1,189 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# kate: space-indent on; indent-width 4; replace-tabs on;
+
+"""
+ *  Copyright © 2009-2010, Michael "Svedrin" Ziegler <diese-addy@funzt-halt.net>
+ *
+ *  Mumble-Django is free software; you can redistribute it and/or modify
+ *  it under the terms of the GNU General Public License as published by
+ *  the Free Software Foundation; either version 2 of the License, or
+ *  (at your option) any later version.
+ *
+ *  This package is distributed in the hope that it will be useful,
+ *  but WITHOUT ANY WARRANTY; without even the implied warranty of
+ *  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ *  GNU General Public License for more details.
+
+ Runs flaskcvp against benchmarks/fakemurmur.py and reports requests per
+ second, p50/p99 latency and flaskcvp's memory use for the CVP endpoints.
+
+    python benchmarks/bench_cvp.py --servers 4 --users 2000 --latency 0.005
+
+ Arguments after "--" are passed on to flaskcvp, e.g. "-- --cache-ttl 0".
+"""
+
+import os
+import sys
+import argparse
+import threading
+import subprocess
+
+from http.client import HTTPConnection
+from time        import monotonic, sleep
+
+ROOT  = os.path.join( os.path.dirname( os.path.abspath( __file__ ) ), ".." )
+FAKE  = os.path.join( ROOT, "benchmarks", "fakemurmur.py" )
+CVP   = os.path.join( ROOT, "flaskcvp.py" )
+
+ENDPOINTS = [
+    "/",
+    "/1",
+    "/1?channel_fields=id,name,parent&user_fields=name,session",
+    "/1?depth=1",
+    "/1/delta?since=0",
+    "/1/channel/0",
+    "/1/user?name=user1",
+    "/all",
+    "/search?q=user1",
+    ]
+
+
+def memory( pid ):
+    """ Current and peak resident set size of a process in MiB, from /proc. """
+    sizes = {}
+    try:
+        with open( "/proc/%d/status" % pid ) as fd:
+            for line in fd:
+                if line.startswith( ( "VmRSS:", "VmHWM:" ) ):
+                    name, value = line.split( ":" )
+                    sizes[name] = int( value.split()[0] ) / 1024.
+    except IOError:
+        return None, None
+    return sizes.get( "VmRSS" ), sizes.get( "VmHWM" )
+
+
+def percentile( values, share ):
+    if not values:
+        return float( "nan" )
+    return values[ min( len(values) - 1, int( len(values) * share ) ) ]
+
+
+def waitReady( port, timeout ):
+    until = monotonic() + timeout
+    while monotonic() < until:
+        try:
+            conn = HTTPConnection( "127.0.0.1", port, timeout=1 )
+            conn.request( "GET", "/ready" )
+            if conn.getresponse().status == 200:
+                return True
+        except OSError:
+            pass
+        sleep( .2 )
+    return False
+
+
+def load( port, path, concurrency, duration ):
+    """ Request `path` from `concurrency` threads for `duration` seconds.
+        Returns the sorted latencies of good answers and the number of errors.
+    """
+    latencies = []
+    errors    = [0]
+    lock      = threading.Lock()
+    until     = monotonic() + duration
+
+    def worker():
+        mine = []
+        failed = 0
+        conn = HTTPConnection( "127.0.0.1", port, timeout=30 )
+        while monotonic() < until:
+            started = monotonic()
+            try:
+                conn.request( "GET", path, headers={ "Accept-Encoding": "gzip" } )
+                response = conn.getresponse()
+                response.read()
+            except OSError:
+                failed += 1
+                conn.close()
+                conn = HTTPConnection( "127.0.0.1", port, timeout=30 )
+                continue
+            if response.status == 200:
+                mine.append( monotonic() - started )
+            else:
+                failed += 1
+        conn.close()
+        with lock:
+            latencies.extend( mine )
+            errors[0] += failed
+
+    threads = [ threading.Thread( target=worker ) for _ in range( concurrency ) ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return sorted( latencies ), errors[0]
+
+
+def main():
+    argv = sys.argv[1:]
+    cvp_args = []
+    if "--" in argv:
+        cvp_args = argv[ argv.index( "--" ) + 1: ]
+        argv     = argv[ :argv.index( "--" ) ]
+
+    parser = argparse.ArgumentParser( description="Benchmark flaskcvp against a fake Murmur." )
+    parser.add_argument( "-s", "--slice", default=os.path.join( ROOT, "slices", "MumbleServerv1.5.735.ice" ) )
+    parser.add_argument( "--ice-port",    type=int, default=16502 )
+    parser.add_argument( "--http-port",   type=int, default=15000 )
+    parser.add_argument( "--servers",     type=int, default=2 )
+    parser.add_argument( "--channels",    type=int, default=100 )
+    parser.add_argument( "--users",       type=int, default=1000 )
+    parser.add_argument( "--comment-size", type=int, default=128 )
+    parser.add_argument( "--latency",     type=float, default=0.0 )
+    parser.add_argument( "--jitter",      type=float, default=0.0 )
+    parser.add_argument( "--fail-rate",   type=float, default=0.0 )
+    parser.add_argument( "--hang-rate",   type=float, default=0.0 )
+    parser.add_argument( "-c", "--concurrency", type=int, default=8 )
+    parser.add_argument( "-d", "--duration",    type=float, default=5.0, help="seconds per endpoint" )
+    parser.add_argument( "-e", "--endpoint", action="append", dest="endpoints",
+        help="endpoint to benchmark, may be given more than once (default: all)" )
+    args = parser.parse_args( argv )
+
+    endpoint = "tcp -h 127.0.0.1 -p %d" % args.ice_port
+    fake = subprocess.Popen( [ sys.executable, FAKE, "-s", args.slice, "-e", endpoint,
+        "--servers", str(args.servers), "--channels", str(args.channels), "--users", str(args.users),
+        "--comment-size", str(args.comment_size), "--latency", str(args.latency), "--jitter", str(args.jitter),
+        "--fail-rate", str(args.fail_rate), "--hang-rate", str(args.hang_rate) ] )
+    cvp = subprocess.Popen( [ sys.executable, CVP, "-c", "Meta:" + endpoint, "-s", args.slice,
+        "-H", "127.0.0.1", "-p", str(args.http_port) ] + cvp_args,
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL )
+
+    try:
+        if not waitReady( args.http_port, 30 ):
+            print( "flaskcvp did not become ready." )
+            return 1
+
+        print( "%d servers, %d channels, %d users each, %d byte comments, %.1f ms latency, %d clients\n" % (
+            args.servers, args.channels, args.users, args.comment_size, args.latency * 1000, args.concurrency ) )
+        print( "%-60s %9s %9s %9s %7s %9s" % ( "endpoint", "req/s", "p50 ms", "p99 ms", "errors", "RSS MiB" ) )
+        for path in args.endpoints or ENDPOINTS:
+            latencies, errors = load( args.http_port, path, args.concurrency, args.duration )
+            rss, peak = memory( cvp.pid )
+            print( "%-60s %9.1f %9.2f %9.2f %7d %9.1f" % (
+                path, len(latencies) / args.duration,
+                percentile( latencies, .50 ) * 1000, percentile( latencies, .99 ) * 1000,
+                errors, rss or 0 ) )
+
+        rss, peak = memory( cvp.pid )
+        if peak is not None:
+            print( "\nflaskcvp peak RSS: %.1f MiB" % peak )
+    finally:
+        cvp.terminate()
+        fake.terminate()
+        cvp.wait()
+        fake.wait()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit( main() )
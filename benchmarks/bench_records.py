@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# kate: space-indent on; indent-width 4; replace-tabs on;
+
+"""
+ *  Copyright © 2009-2010, Michael "Svedrin" Ziegler <diese-addy@funzt-halt.net>
+ *
+ *  Mumble-Django is free software; you can redistribute it and/or modify
+ *  it under the terms of the GNU General Public License as published by
+ *  the Free Software Foundation; either version 2 of the License, or
+ *  (at your option) any later version.
+ *
+ *  This package is distributed in the hope that it will be useful,
+ *  but WITHOUT ANY WARRANTY; without even the implied warranty of
+ *  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ *  GNU General Public License for more details.
+
+ Compares ObjectInfo against RegistrationInfo for the result of
+ getRegisteredPlayers on a server with many registered users: memory held by
+ the records and the time it takes to create them.
+
+    python benchmarks/bench_records.py [count]
+"""
+
+import os
+import sys
+import timeit
+import tracemalloc
+
+sys.path.insert( 0, os.path.join( os.path.dirname( os.path.abspath( __file__ ) ), ".." ) )
+
+from mumble.utils import ObjectInfo, RegistrationInfo
+
+
+def build( cls, names ):
+    """ What getRegisteredPlayers does with the users it got from Murmur. """
+    ret = {}
+    for userid, name in enumerate( names ):
+        ret[userid] = cls( userid=userid, name=name, email='', pw='' )
+    return ret
+
+
+def measure( cls, names ):
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    records = build( cls, names )
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del records
+    elapsed = min( timeit.repeat( lambda: build( cls, names ), number=1, repeat=5 ) )
+    return after - before, elapsed
+
+
+if __name__ == '__main__':
+    count = int( sys.argv[1] ) if len(sys.argv) > 1 else 100000
+    names = [ "user%d" % idx for idx in range( count ) ]
+
+    sample = RegistrationInfo( userid=1, name="x", email='', pw='' )
+    assert sample.name == sample['name'] == "x"
+    assert 'pw' in sample and 'comment' not in sample
+
+    print( "%d registered users" % count )
+    for cls in ( ObjectInfo, RegistrationInfo ):
+        size, elapsed = measure( cls, names )
+        print( "%-17s %8.1f MiB  %6.1f bytes/user  %7.1f ms" % (
+            cls.__name__, size / 1048576., size / float(count), elapsed * 1000 ) )
@@ -0,0 +1,180 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# kate: space-indent on; indent-width 4; replace-tabs on;
+
+"""
+ *  Copyright © 2009-2010, Michael "Svedrin" Ziegler <diese-addy@funzt-halt.net>
+ *
+ *  Mumble-Django is free software; you can redistribute it and/or modify
+ *  it under the terms of the GNU General Public License as published by
+ *  the Free Software Foundation; either version 2 of the License, or
+ *  (at your option) any later version.
+ *
+ *  This package is distributed in the hope that it will be useful,
+ *  but WITHOUT ANY WARRANTY; without even the implied warranty of
+ *  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ *  GNU General Public License for more details.
+
+ Times the tree serialization path on replayed trees of increasing size:
+ encoding a tree, building and compressing a snapshot and, with --http, a
+ GET /<srv_id> through flaskcvp with a "replay:" connstring.
+
+    python benchmarks/bench_serialize.py [--recording FILE] [--http]
+    python benchmarks/bench_serialize.py --save base.json
+    python benchmarks/bench_serialize.py --compare base.json
+
+ Without --recording, a recording of synthetic servers is made first, with
+ server N holding the Nth size. To benchmark real trees, record them with
+
+    from mumble.mctl import MumbleCtlBase
+    from mumble.MumbleCtlReplay import record
+    record( MumbleCtlBase.connect( "Meta:tcp -h 127.0.0.1 -p 6502" ), "live.rec" )
+
+ --compare exits with 1 if a case's median got slower than --tolerance.
+"""
+
+import os
+import sys
+import json
+import random
+import argparse
+import tempfile
+
+from statistics import mean, median, stdev
+from time       import perf_counter
+
+sys.path.insert( 0, os.path.join( os.path.dirname( os.path.abspath( __file__ ) ), ".." ) )
+
+from mumble.mctl            import MumbleCtlBase
+from mumble.MumbleCtlReplay import FORMAT_VERSION, save
+
+from cvp.serialize import DEFAULT_ENCODER
+from cvp.snapshot  import TreeSnapshot
+
+# (channels, users) per synthetic server
+SIZES = [ ( 10, 20 ), ( 50, 200 ), ( 200, 1000 ), ( 500, 5000 ), ( 1000, 20000 ) ]
+
+
+def syntheticTree( channels, users, comment_size=64, seed=0 ):
+    """ A random tree as MumbleCtlReplay stores it, see plainTree. """
+    rnd = random.Random( seed )
+    nodes = [ ( { "id": 0, "name": "Root", "parent": -1, "links": [], "description": "",
+                  "temporary": False, "position": 0 }, [], -1 ) ]
+    for cid in range( 1, channels ):
+        parent = rnd.randrange( len(nodes) )
+        nodes.append( ( { "id": cid, "name": "Channel %d" % cid, "parent": nodes[parent][0]["id"], "links": [],
+                          "description": "Description of channel %d" % cid, "temporary": False, "position": cid },
+                        [], parent ) )
+    for session in range( 1, users + 1 ):
+        node = rnd.choice( nodes )
+        node[1].append( {
+            "session": session, "userid": session if rnd.random() < 0.5 else -1, "mute": False, "deaf": False,
+            "suppress": False, "prioritySpeaker": False, "selfMute": rnd.random() < 0.2,
+            "selfDeaf": rnd.random() < 0.1, "recording": False, "channel": node[0]["id"],
+            "name": "user%d" % session, "onlinesecs": rnd.randint( 0, 86400 ),
+            "bytespersec": rnd.randint( 0, 8000 ), "comment": "x" * comment_size,
+            "idlesecs": rnd.randint( 0, 3600 ),
+            } )
+    return nodes
+
+
+def makeRecording( path ):
+    recording = { "format": FORMAT_VERSION, "servers": [], "trees": {}, "conf": {} }
+    for srvid, ( channels, users ) in enumerate( SIZES, 1 ):
+        recording["servers"].append( srvid )
+        recording["trees"][srvid] = syntheticTree( channels, users, seed=srvid )
+        recording["conf"][srvid]  = { "registername": "%d channels, %d users" % ( channels, users ) }
+    save( path, recording )
+
+
+def bench( func, min_time, min_rounds ):
+    """ Time func() until it ran at least min_time seconds and min_rounds times. """
+    times = []
+    while sum( times ) < min_time or len(times) < min_rounds:
+        started = perf_counter()
+        func()
+        times.append( perf_counter() - started )
+    return times
+
+
+def cases( ctl, http ):
+    """ (name, func) for every benchmark case. """
+    if http:
+        import flaskcvp
+        client = flaskcvp.app.test_client()
+
+    for srvid in ctl.getBootedServers():
+        tree = ctl.getTree( srvid )
+        name = ctl.getConf( srvid, "registername" )
+        label = "%d:%s" % ( srvid, name )
+
+        yield "encode %s" % label, lambda tree=tree: DEFAULT_ENCODER.encode( tree )
+        yield "snapshot+gzip %s" % label, lambda srvid=srvid, name=name, tree=tree: \
+            TreeSnapshot( srvid, name, tree ).encoded( "gzip" )
+        if http:
+            yield "GET /%d %s" % ( srvid, name ), lambda srvid=srvid: \
+                client.get( "/%d" % srvid, headers={ "Accept-Encoding": "gzip" } ).get_data()
+
+
+def main():
+    parser = argparse.ArgumentParser( description="Benchmark tree serialization on replayed trees." )
+    parser.add_argument( "-r", "--recording", help="recording to replay (default: synthetic trees)" )
+    parser.add_argument( "--http", action="store_true", help="also time GET /<srv_id> through flaskcvp" )
+    parser.add_argument( "--min-time",   type=float, default=1.0, help="seconds to run each case at least" )
+    parser.add_argument( "--min-rounds", type=int,   default=5,   help="rounds to run each case at least" )
+    parser.add_argument( "--save",    help="write the results to this JSON file" )
+    parser.add_argument( "--compare", help="compare the medians against a file written by --save" )
+    parser.add_argument( "--tolerance", type=float, default=0.10, help="slowdown allowed by --compare (0.10 = 10%%)" )
+    args = parser.parse_args()
+
+    path = args.recording
+    if path is None:
+        fd, path = tempfile.mkstemp( suffix=".rec" )
+        os.close( fd )
+        makeRecording( path )
+
+    connstring = "replay:" + path
+    if args.http:
+        # flaskcvp connects when it's imported; every request should build its snapshot.
+        os.environ["MUMBLE_CONNSTRING"] = connstring
+        os.environ["FLASKCVP_CACHE_TTL"] = "0"
+    ctl = MumbleCtlBase.connect( connstring )
+
+    results = {}
+    print( "%-44s %7s %10s %10s %10s %10s" % ( "case", "rounds", "min ms", "median ms", "mean ms", "stddev ms" ) )
+    try:
+        for name, func in cases( ctl, args.http ):
+            times = bench( func, args.min_time, args.min_rounds )
+            results[name] = { "min": min( times ), "median": median( times ), "mean": mean( times ),
+                              "stddev": stdev( times ) if len(times) > 1 else 0.0, "rounds": len(times) }
+            print( "%-44s %7d %10.3f %10.3f %10.3f %10.3f" % ( name, len(times),
+                min( times ) * 1000, median( times ) * 1000, mean( times ) * 1000, results[name]["stddev"] * 1000 ) )
+    finally:
+        if args.recording is None:
+            os.unlink( path )
+
+    if args.save:
+        with open( args.save, "w" ) as fd:
+            json.dump( results, fd, indent=2, sort_keys=True )
+
+    if args.compare:
+        with open( args.compare ) as fd:
+            baseline = json.load( fd )
+        regressed = False
+        print()
+        for name, result in results.items():
+            if name not in baseline:
+                continue
+            change = result["median"] / baseline[name]["median"] - 1
+            flag = ""
+            if change > args.tolerance:
+                flag = "  REGRESSION"
+                regressed = True
+            print( "%-44s %+7.1f%%%s" % ( name, change * 100, flag ) )
+        if regressed:
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit( main() )
@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# kate: space-indent on; indent-width 4; replace-tabs on;
+
+"""
+ *  Copyright © 2009-2010, Michael "Svedrin" Ziegler <diese-addy@funzt-halt.net>
+ *
+ *  Mumble-Django is free software; you can redistribute it and/or modify
+ *  it under the terms of the GNU General Public License as published by
+ *  the Free Software Foundation; either version 2 of the License, or
+ *  (at your option) any later version.
+ *
+ *  This package is distributed in the hope that it will be useful,
+ *  but WITHOUT ANY WARRANTY; without even the implied warranty of
+ *  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ *  GNU General Public License for more details.
+
+ Compares mumble.texture against the per-pixel loops the ctl backends used
+ before, for decoding and encoding one 600x60 texture.
+
+    python benchmarks/bench_texture.py
+"""
+
+import os
+import sys
+import timeit
+
+from struct import pack, unpack
+from zlib   import compress, decompress
+
+sys.path.insert( 0, os.path.join( os.path.dirname( os.path.abspath( __file__ ) ), ".." ) )
+
+from mumble.texture import swapRedBlue, qCompress, qUncompress
+
+
+def old_decode( texture ):
+    """ What MumbleCtlDbus_118.getTexture did before the image was created. """
+    bytestr = b""
+    for byte in texture[4:]:
+        bytestr += pack( "B", int(byte) )
+    decompressed = decompress( bytestr )
+    imgdata = b""
+    for idx in range( 0, len(decompressed), 4 ):
+        bgra = unpack( "4B", decompressed[idx:idx+4] )
+        imgdata += pack( "4B", bgra[2], bgra[1], bgra[0], bgra[3] )
+    return imgdata
+
+
+def old_encode( rgba ):
+    """ What setTexture did with the pixels of the converted image. """
+    bgrastring = b""
+    for idx in range( 0, len(rgba), 4 ):
+        bgrastring += pack( "4B", rgba[idx+2], rgba[idx+1], rgba[idx], rgba[idx+3] )
+    return pack( ">L", len(bgrastring) ) + compress( bgrastring )
+
+
+def new_decode( texture ):
+    return swapRedBlue( qUncompress( bytes( texture ) ) )
+
+
+def new_encode( rgba ):
+    return qCompress( swapRedBlue( rgba ) )
+
+
+def report( name, old, new, number ):
+    told = min( timeit.repeat( old, number=number, repeat=3 ) ) / number
+    tnew = min( timeit.repeat( new, number=number, repeat=3 ) ) / number
+    print( "%-7s old %8.2f ms   new %8.3f ms   speedup %6.0fx" % ( name, told * 1000, tnew * 1000, told / tnew ) )
+
+
+if __name__ == '__main__':
+    rgba    = os.urandom( 600 * 60 * 4 )
+    texture = list( qCompress( swapRedBlue( rgba ) ) )  # DBus hands out a list of bytes
+
+    assert old_decode( texture ) == new_decode( texture ) == rgba
+    assert old_encode( rgba ) == new_encode( rgba )
+
+    report( "decode", lambda: old_decode( texture ), lambda: new_decode( texture ), 3 )
+    report( "encode", lambda: old_encode( rgba ),    lambda: new_encode( rgba ),    3 )
@@ -0,0 +1,330 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# kate: space-indent on; indent-width 4; replace-tabs on;
+
+"""
+ *  Copyright © 2009-2010, Michael "Svedrin" Ziegler <diese-addy@funzt-halt.net>
+ *
+ *  Mumble-Django is free software; you can redistribute it and/or modify
+ *  it under the terms of the GNU General Public License as published by
+ *  the Free Software Foundation; either version 2 of the License, or
+ *  (at your option) any later version.
+ *
+ *  This package is distributed in the hope that it will be useful,
+ *  but WITHOUT ANY WARRANTY; without even the implied warranty of
+ *  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ *  GNU General Public License for more details.
+
+ A fake Murmur for benchmarks: hosts Meta and Server objects implementing
+ the read side of the Ice interface (enough for flaskcvp), serving synthetic
+ trees of configurable size, with injectable latency and faults.
+
+ Works with slices/MumbleServerv1.5.735.ice as well as the 1.3 and 1.4
+ Murmur slices:
+
+    python benchmarks/fakemurmur.py -s slices/MumbleServerv1.5.735.ice \\
+        --servers 4 --channels 200 --users 2000 --latency 0.005
+"""
+
+import os
+import re
+import sys
+import heapq
+import random
+import argparse
+import threading
+
+from time import monotonic
+
+sys.path.insert( 0, os.path.join( os.path.dirname( os.path.abspath( __file__ ) ), ".." ) )
+
+import Ice
+
+from mumble.MumbleCtlIce import loadSlice
+
+
+def loadSliceModule( slicefile ):
+    """ Load the slice and return its module (MumbleServer or Murmur) and text. """
+    loadSlice( slicefile )
+    with open( slicefile ) as fd:
+        slicetext = fd.read()
+    module = re.search( r"^\s*module\s+(\w+)", slicetext, re.M ).group( 1 )
+    return __import__( module ), slicetext
+
+
+def sliceVersion( slicefile ):
+    """ Guess the Murmur version a slice belongs to from its file name. """
+    match = re.search( r"(\d+)\.(\d+)(?:\.(\d+))?\.ice$", slicefile )
+    if match is None:
+        return ( 1, 5, 0 )
+    return tuple( int( part or 0 ) for part in match.groups() )
+
+
+def buildTree( slicemod, srvid, channels, users, comment_size, seed=None ):
+    """ A random Tree with the given number of channels and users. """
+    rnd = random.Random( seed if seed is not None else srvid )
+
+    def channel( cid, parent ):
+        return slicemod.Channel( id=cid, name="Channel %d" % cid, parent=parent, links=[],
+                                 description="Description of channel %d" % cid,
+                                 temporary=False, position=cid )
+
+    nodes = [ slicemod.Tree( channel( 0, -1 ), [], [] ) ]
+    for cid in range( 1, channels ):
+        parent = rnd.choice( nodes )
+        node = slicemod.Tree( channel( cid, parent.c.id ), [], [] )
+        parent.children.append( node )
+        nodes.append( node )
+
+    for session in range( 1, users + 1 ):
+        node = rnd.choice( nodes )
+        node.users.append( slicemod.User(
+            session=session, userid=session if rnd.random() < 0.5 else -1,
+            mute=False, deaf=False, suppress=False, prioritySpeaker=False,
+            selfMute=rnd.random() < 0.2, selfDeaf=rnd.random() < 0.1, recording=False,
+            channel=node.c.id, name="user%d" % session,
+            onlinesecs=rnd.randint( 0, 86400 ), bytespersec=rnd.randint( 0, 8000 ),
+            comment="x" * comment_size, idlesecs=rnd.randint( 0, 3600 ),
+            ) )
+
+    return nodes[0]
+
+
+class Delayer(object):
+    """ Completes futures after a delay, from one thread, so injected latency
+        doesn't hold up Ice's dispatch threads.
+    """
+
+    def __init__( self ):
+        self.cond  = threading.Condition()
+        self.queue = []
+        self.seq   = 0
+        threading.Thread( target=self._run, daemon=True ).start()
+
+    def later( self, delay, func ):
+        with self.cond:
+            self.seq += 1
+            heapq.heappush( self.queue, ( monotonic() + delay, self.seq, func ) )
+            self.cond.notify()
+
+    def _run( self ):
+        while True:
+            with self.cond:
+                while not self.queue or self.queue[0][0] > monotonic():
+                    self.cond.wait( self.queue[0][0] - monotonic() if self.queue else None )
+                due, seq, func = heapq.heappop( self.queue )
+            func()
+
+
+class Faults(object):
+    """ Latency and failures to add to every call.
+
+        latency:   seconds every call takes, plus up to `jitter` at random
+        fail_rate: share of calls failing with ServerBootedException
+        hang_rate: share of calls that never get an answer
+    """
+
+    def __init__( self, slicemod, latency=0.0, jitter=0.0, fail_rate=0.0, hang_rate=0.0 ):
+        self.slicemod  = slicemod
+        self.latency   = latency
+        self.jitter    = jitter
+        self.fail_rate = fail_rate
+        self.hang_rate = hang_rate
+        self.delayer   = Delayer()
+
+    def reply( self, func, *args ):
+        """ Return an Ice.Future for func(*args), with faults applied. """
+        future = Ice.Future()
+        if self.hang_rate and random.random() < self.hang_rate:
+            return future
+
+        def finish():
+            if self.fail_rate and random.random() < self.fail_rate:
+                future.set_exception( self.slicemod.ServerBootedException() )
+                return
+            try:
+                future.set_result( func( *args ) )
+            except Exception as err:
+                future.set_exception( err )
+
+        delay = self.latency + ( random.uniform( 0, self.jitter ) if self.jitter else 0 )
+        if delay > 0:
+            self.delayer.later( delay, finish )
+        else:
+            finish()
+        return future
+
+
+def makeServants( slicemod, slicetext, version, faults, secret ):
+
+    def checkSecret( current ):
+        if secret and current.ctx.get( "secret" ) != secret:
+            raise slicemod.InvalidSecretException()
+
+    class FakeServer( slicemod.Server ):
+        def __init__( self, srvid, tree ):
+            self.srvid = srvid
+            self.tree  = tree
+            self.conf  = { "registername": "Fake server %d" % srvid, "port": str( 64738 + srvid ) }
+
+        def _users( self ):
+            users = {}
+            stack = [self.tree]
+            while stack:
+                node = stack.pop()
+                for user in node.users:
+                    users[user.session] = user
+                stack.extend( node.children )
+            return users
+
+        def _channels( self ):
+            channels = {}
+            stack = [self.tree]
+            while stack:
+                node = stack.pop()
+                channels[node.c.id] = node.c
+                stack.extend( node.children )
+            return channels
+
+        def id( self, current=None ):
+            checkSecret( current )
+            return faults.reply( lambda: self.srvid )
+
+        def isRunning( self, current=None ):
+            checkSecret( current )
+            return faults.reply( lambda: True )
+
+        def getConf( self, key, current=None ):
+            checkSecret( current )
+            return faults.reply( self.conf.get, key, "" )
+
+        def getAllConf( self, current=None ):
+            checkSecret( current )
+            return faults.reply( dict, self.conf )
+
+        def getTree( self, current=None ):
+            checkSecret( current )
+            return faults.reply( lambda: self.tree )
+
+        def getUsers( self, current=None ):
+            checkSecret( current )
+            return faults.reply( self._users )
+
+        def getChannels( self, current=None ):
+            checkSecret( current )
+            return faults.reply( self._channels )
+
+        def getTexture( self, userid, current=None ):
+            checkSecret( current )
+            return faults.reply( bytes )
+
+        def getRegisteredUsers( self, filter, current=None ):
+            checkSecret( current )
+            return faults.reply( lambda: dict(
+                ( user.userid, user.name ) for user in self._users().values()
+                if user.userid >= 0 and filter in user.name ) )
+
+        def addCallback( self, cb, current=None ):
+            checkSecret( current )
+
+        def removeCallback( self, cb, current=None ):
+            checkSecret( current )
+
+    class FakeMeta( slicemod.Meta ):
+        def __init__( self, servers ):
+            self.servers = servers
+            self.started = monotonic()
+
+        def getServer( self, srvid, current=None ):
+            checkSecret( current )
+            return faults.reply( self.servers.get, srvid )
+
+        def getBootedServers( self, current=None ):
+            checkSecret( current )
+            return faults.reply( lambda: list( self.servers.values() ) )
+
+        def getAllServers( self, current=None ):
+            checkSecret( current )
+            return faults.reply( lambda: list( self.servers.values() ) )
+
+        def getDefaultConf( self, current=None ):
+            checkSecret( current )
+            return {}
+
+        def getVersion( self, current=None ):
+            return version + ( ".".join( str(part) for part in version ), )
+
+        def getUptime( self, current=None ):
+            return int( monotonic() - self.started )
+
+        def getSlice( self, current=None ):
+            return slicetext
+
+        def addCallback( self, cb, current=None ):
+            checkSecret( current )
+
+        def removeCallback( self, cb, current=None ):
+            checkSecret( current )
+
+    return FakeServer, FakeMeta
+
+
+class FakeMurmur(object):
+    """ Runs the fake servers on an object adapter of their own communicator. """
+
+    def __init__( self, slicefile, endpoint="tcp -h 127.0.0.1 -p 6502", servers=1, channels=50,
+                  users=200, comment_size=0, latency=0.0, jitter=0.0, fail_rate=0.0, hang_rate=0.0,
+                  secret=None ):
+        slicemod, slicetext = loadSliceModule( slicefile )
+        faults = Faults( slicemod, latency, jitter, fail_rate, hang_rate )
+        FakeServer, FakeMeta = makeServants( slicemod, slicetext, sliceVersion( slicefile ), faults, secret )
+
+        props = Ice.createProperties( [] )
+        props.setProperty( "Ice.ThreadPool.Server.Size", "4" )
+        props.setProperty( "Ice.MessageSizeMax", "65535" )
+        idd = Ice.InitializationData()
+        idd.properties = props
+        self.communicator = Ice.initialize( idd )
+        self.adapter = self.communicator.createObjectAdapterWithEndpoints( "FakeMurmur", endpoint )
+
+        proxies = {}
+        for srvid in range( 1, servers + 1 ):
+            servant = FakeServer( srvid, buildTree( slicemod, srvid, channels, users, comment_size ) )
+            proxies[srvid] = slicemod.ServerPrx.uncheckedCast(
+                self.adapter.add( servant, Ice.stringToIdentity( "s/%d" % srvid ) ) )
+        self.adapter.add( FakeMeta( proxies ), Ice.stringToIdentity( "Meta" ) )
+        self.adapter.activate()
+
+    def wait( self ):
+        self.communicator.waitForShutdown()
+
+    def close( self ):
+        self.communicator.destroy()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser( description="Run a fake Murmur serving synthetic trees over Ice." )
+    parser.add_argument( "-s", "--slice", default="slices/MumbleServerv1.5.735.ice",
+        help="slice file to implement (1.5, or the 1.3/1.4 Murmur slices)" )
+    parser.add_argument( "-e", "--endpoint", default="tcp -h 127.0.0.1 -p 6502" )
+    parser.add_argument( "--servers",   type=int, default=1,   help="number of virtual servers" )
+    parser.add_argument( "--channels",  type=int, default=50,  help="channels per server" )
+    parser.add_argument( "--users",     type=int, default=200, help="users per server" )
+    parser.add_argument( "--comment-size", type=int, default=0, help="length of every user's comment" )
+    parser.add_argument( "--latency",   type=float, default=0.0, help="seconds added to every call" )
+    parser.add_argument( "--jitter",    type=float, default=0.0, help="up to this many seconds added at random" )
+    parser.add_argument( "--fail-rate", type=float, default=0.0, help="share of calls that fail with ServerBootedException" )
+    parser.add_argument( "--hang-rate", type=float, default=0.0, help="share of calls that never get an answer" )
+    parser.add_argument( "--secret", default=None, help="Ice secret clients must send" )
+    args = parser.parse_args()
+
+    murmur = FakeMurmur( args.slice, args.endpoint, args.servers, args.channels, args.users,
+                         args.comment_size, args.latency, args.jitter, args.fail_rate, args.hang_rate,
+                         args.secret )
+    print( "Fake Murmur listening on %s" % args.endpoint )
+    try:
+        murmur.wait()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        murmur.close()
@@ -0,0 +1,176 @@
+# -*- coding: utf-8 -*-
+# kate: space-indent on; indent-width 4; replace-tabs on;
+
+"""
+ *  Copyright © 2009-2010, Michael "Svedrin" Ziegler <diese-addy@funzt-halt.net>
+ *
+ *  Mumble-Django is free software; you can redistribute it and/or modify
+ *  it under the terms of the GNU General Public License as published by
+ *  the Free Software Foundation; either version 2 of the License, or
+ *  (at your option) any later version.
+ *
+ *  This package is distributed in the hope that it will be useful,
+ *  but WITHOUT ANY WARRANTY; without even the implied warranty of
+ *  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ *  GNU General Public License for more details.
+"""
+
+import threading
+
+from functools import wraps
+from time      import monotonic, sleep
+
+CLOSED    = "closed"
+OPEN      = "open"
+HALF_OPEN = "half-open"
+
+
+class CircuitOpen(Exception):
+    """ Raised instead of calling a server whose circuit is open. """
+
+    def __init__( self, key, retry_after ):
+        Exception.__init__( self, "Server %s is failing, not calling it for %.0f seconds." % ( key, retry_after ) )
+        self.key = key
+        self.retry_after = retry_after
+
+
+class _Circuit(object):
+    def __init__( self ):
+        self.state    = CLOSED
+        self.failures = 0
+        self.opened   = None
+        self.trial    = False
+        self.asked    = 0
+        # the thread probing this circuit, if any
+        self.thread   = None
+
+
+class CircuitBreaker(object):
+    """ Stops calling a server after `threshold` consecutive failures.
+
+        While a server's circuit is open, calls fail right away with
+        CircuitOpen. A background thread waits `reset_timeout` seconds, lets
+        one trial call through by calling `probe(key)`, and closes the circuit
+        if that succeeds or waits again if it fails, so requests are not held
+        up by trial calls to a sick server. Without a probe, or if nobody
+        asked for the key since the circuit opened, the thread stops and the
+        next call is the trial.
+
+        Errors for which `isFailure(err)` is false (e.g. "no such server")
+        neither count as failures nor as successes. Only circuits that are
+        not closed are kept, at most `max_circuits` of them.
+    """
+
+    def __init__( self, threshold, reset_timeout, probe=None, isFailure=None, max_circuits=1024 ):
+        self.threshold     = threshold
+        self.reset_timeout = reset_timeout
+        self.probe         = probe
+        self.isFailure     = isFailure or ( lambda err: True )
+        self.max_circuits  = max_circuits
+        self.lock          = threading.Lock()
+        self.circuits      = {}
+        self.rejected      = 0
+
+    def _circuit( self, key ):
+        circuit = self.circuits.get( key )
+        if circuit is None:
+            circuit = self.circuits[key] = _Circuit()
+        return circuit
+
+    def call( self, key, func, *args, **kwargs ):
+        with self.lock:
+            circuit = self.circuits.get( key )
+            if circuit is not None:
+                if threading.current_thread() is not circuit.thread:
+                    circuit.asked = monotonic()
+                if circuit.state == OPEN or ( circuit.state == HALF_OPEN and circuit.trial ):
+                    self.rejected += 1
+                    raise CircuitOpen( key, max( 0, circuit.opened + self.reset_timeout - monotonic() ) )
+                if circuit.state == HALF_OPEN:
+                    circuit.trial = True
+
+        try:
+            result = func( *args, **kwargs )
+        except Exception as err:
+            if self.isFailure( err ):
+                self._failed( key )
+            else:
+                self._ignored( key )
+            raise
+        self._succeeded( key )
+        return result
+
+    def wrap( self, func ):
+        """ Decorate a function whose first argument is the key. """
+        @wraps( func )
+        def wrapper( key, *args, **kwargs ):
+            return self.call( key, func, key, *args, **kwargs )
+        return wrapper
+
+    def _succeeded( self, key ):
+        with self.lock:
+            circuit = self.circuits.get( key )
+            if circuit is not None and circuit.state != OPEN:
+                # closed circuits are forgotten; a running probe thread sees that and quits
+                del self.circuits[key]
+
+    def _ignored( self, key ):
+        with self.lock:
+            circuit = self.circuits.get( key )
+            if circuit is not None:
+                circuit.trial = False
+
+    def _open( self, circuit, key ):
+        circuit.state  = OPEN
+        circuit.opened = monotonic()
+        if circuit.thread is None:
+            circuit.thread = threading.Thread( target=self._recover, args=( key, circuit ), daemon=True )
+            circuit.thread.start()
+
+    def _failed( self, key ):
+        with self.lock:
+            circuit = self.circuits.get( key )
+            if circuit is None:
+                if len(self.circuits) >= self.max_circuits:
+                    self._dropClosed()
+                    if len(self.circuits) >= self.max_circuits:
+                        return
+                circuit = self._circuit( key )
+            circuit.failures += 1
+            circuit.trial = False
+            if circuit.state == HALF_OPEN:
+                self._open( circuit, key )
+            elif circuit.state == CLOSED and circuit.failures >= self.threshold:
+                self._open( circuit, key )
+
+    def _dropClosed( self ):
+        """ Forget circuits that have failures but are not open. """
+        for key, circuit in list( self.circuits.items() ):
+            if circuit.state == CLOSED:
+                del self.circuits[key]
+
+    def _recover( self, key, circuit ):
+        """ Probe an open circuit until it closes again, or nobody asks for it. """
+        while True:
+            sleep( self.reset_timeout )
+            with self.lock:
+                if self.circuits.get( key ) is not circuit or circuit.state == CLOSED:
+                    circuit.thread = None
+                    return
+                circuit.state = HALF_OPEN
+                if self.probe is None or circuit.asked < circuit.opened:
+                    # let the next request try, and start probing again if it fails.
+                    circuit.thread = None
+                    return
+            try:
+                self.probe( key )
+            except Exception:
+                pass
+
+    def stats( self ):
+        with self.lock:
+            return {
+                'rejected': self.rejected,
+                'open': dict( ( str(key), circuit.failures ) for ( key, circuit ) in self.circuits.items()
+                              if circuit.state != CLOSED ),
+                }
@@ -0,0 +1,142 @@
+# -*- coding: utf-8 -*-
+# kate: space-indent on; indent-width 4; replace-tabs on;
+
+"""
+ *  Copyright © 2009-2010, Michael "Svedrin" Ziegler <diese-addy@funzt-halt.net>
+ *
+ *  Mumble-Django is free software; you can redistribute it and/or modify
+ *  it under the terms of the GNU General Public License as published by
+ *  the Free Software Foundation; either version 2 of the License, or
+ *  (at your option) any later version.
+ *
+ *  This package is distributed in the hope that it will be useful,
+ *  but WITHOUT ANY WARRANTY; without even the implied warranty of
+ *  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ *  GNU General Public License for more details.
+"""
+
+import threading
+
+
+class _Flight(object):
+    """ A fetch in progress, which any number of readers can wait for. """
+
+    def __init__( self ):
+        self.done   = threading.Event()
+        self.result = None
+        self.error  = None
+
+    def wait( self ):
+        self.done.wait()
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+
+class SnapshotCache(object):
+    """ Caches one Snapshot per key (usually a server ID) for `ttl` seconds.
+
+        Only one fetch per key runs at any time; readers arriving while it
+        runs wait for it and share its result. With `stale_while_revalidate`,
+        an expired snapshot is returned right away while a background thread
+        fetches the next one, so readers only ever block for the first fetch.
+
+        Snapshots older than `max_stale` seconds are not served stale; readers
+        wait for a fresh one instead, so a fetch that keeps failing in the
+        background surfaces its error. Fetch errors for which isGone(err) is
+        true drop the cached snapshot right away.
+    """
+
+    def __init__( self, fetch, ttl, stale_while_revalidate=False, max_stale=None, isGone=None ):
+        self.fetch    = fetch
+        self.ttl      = ttl
+        self.swr      = stale_while_revalidate
+        self.max_stale = max_stale
+        self.isGone   = isGone
+        self.lock     = threading.Lock()
+        self.entries  = {}
+        self.inflight = {}
+
+        self.hits      = 0
+        self.misses    = 0
+        self.stale     = 0
+        self.coalesced = 0
+        self.errors    = 0
+
+    def get( self, key ):
+        """ Return a snapshot for `key`, fetching it if necessary. """
+        with self.lock:
+            snap = self.entries.get( key )
+            if snap is not None and snap.age < self.ttl:
+                self.hits += 1
+                return snap
+
+            flight = self.inflight.get( key )
+
+            if snap is not None and self.swr and self._servable( snap ):
+                self.stale += 1
+                if flight is None:
+                    flight = self.inflight[key] = _Flight()
+                    threading.Thread( target=self._run, args=( key, flight ), daemon=True ).start()
+                return snap
+
+            if flight is not None:
+                self.coalesced += 1
+                leader = False
+            else:
+                self.misses += 1
+                flight = self.inflight[key] = _Flight()
+                leader = True
+
+        if leader:
+            self._run( key, flight )
+        return flight.wait()
+
+    def _run( self, key, flight ):
+        try:
+            flight.result = self.fetch( key )
+        except Exception as err:
+            flight.error = err
+        with self.lock:
+            if flight.error is None:
+                self.entries[key] = flight.result
+            else:
+                self.errors += 1
+                if self.isGone is not None and self.isGone( flight.error ):
+                    self.entries.pop( key, None )
+            del self.inflight[key]
+        flight.done.set()
+
+    def _servable( self, snap ):
+        return self.max_stale is None or snap.age < self.max_stale
+
+    def peek( self, key ):
+        """ Return the cached snapshot for `key` even if it expired, or None
+            if there is none or it is older than `max_stale`.
+        """
+        with self.lock:
+            snap = self.entries.get( key )
+        if snap is not None and self._servable( snap ):
+            return snap
+        return None
+
+    def invalidate( self, key=None ):
+        """ Drop the snapshot for `key`, or all of them. """
+        with self.lock:
+            if key is None:
+                self.entries.clear()
+            else:
+                self.entries.pop( key, None )
+
+    def stats( self ):
+        """ Counters for tuning the TTL. """
+        with self.lock:
+            return {
+                'ttl':       self.ttl,
+                'entries':   len(self.entries),
+                'hits':      self.hits,
+                'misses':    self.misses,
+                'stale':     self.stale,
+                'coalesced': self.coalesced,
+                'errors':    self.errors,
+                }
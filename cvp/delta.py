@@ -0,0 +1,224 @@
+# -*- coding: utf-8 -*-
+# kate: space-indent on; indent-width 4; replace-tabs on;
+
+"""
+ *  Copyright © 2009-2010, Michael "Svedrin" Ziegler <diese-addy@funzt-halt.net>
+ *
+ *  Mumble-Django is free software; you can redistribute it and/or modify
+ *  it under the terms of the GNU General Public License as published by
+ *  the Free Software Foundation; either version 2 of the License, or
+ *  (at your option) any later version.
+ *
+ *  This package is distributed in the hope that it will be useful,
+ *  but WITHOUT ANY WARRANTY; without even the implied warranty of
+ *  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ *  GNU General Public License for more details.
+"""
+
+import threading
+
+from collections import deque
+from time        import time
+
+
+def userChanged( old, new ):
+    """ Check if a user's state differs in a way worth reporting.
+
+        idlesecs grows every second, so it only counts when it went down,
+        i.e. when the user spoke.
+    """
+    for key in new:
+        if key == 'idlesecs':
+            if new[key] < old.get( key, 0 ):
+                return True
+        elif old.get( key ) != new[key]:
+            return True
+    return False
+
+
+def diff( old, new ):
+    """ Compare two flattened trees, see TreeEncoder.flatten.
+
+        Returns a list of (event, state) pairs, with events named after the
+        ServerCallback methods Murmur would have called for the change.
+    """
+    oldchans, oldusers = old
+    newchans, newusers = new
+
+    events = []
+    for cid, chan in newchans.items():
+        if cid not in oldchans:
+            events.append( ( "channelCreated", chan ) )
+        elif oldchans[cid] != chan:
+            events.append( ( "channelStateChanged", chan ) )
+
+    for session, user in newusers.items():
+        if session not in oldusers:
+            events.append( ( "userConnected", user ) )
+        elif userChanged( oldusers[session], user ):
+            events.append( ( "userStateChanged", user ) )
+
+    for session, user in oldusers.items():
+        if session not in newusers:
+            events.append( ( "userDisconnected", user ) )
+
+    for cid, chan in oldchans.items():
+        if cid not in newchans:
+            events.append( ( "channelRemoved", chan ) )
+
+    return events
+
+
+# How changes() groups the events diff() reports
+GROUPS = {
+    'channelCreated':      ( 'channels', 'added' ),
+    'channelStateChanged': ( 'channels', 'changed' ),
+    'channelRemoved':      ( 'channels', 'removed' ),
+    'userConnected':       ( 'users',    'added' ),
+    'userStateChanged':    ( 'users',    'changed' ),
+    'userDisconnected':    ( 'users',    'removed' ),
+    }
+
+
+def emptyChanges():
+    return {
+        'channels': { 'added': [], 'removed': [], 'changed': [] },
+        'users':    { 'added': [], 'removed': [], 'changed': [] },
+        }
+
+
+def identify( kind, state ):
+    return state['id'] if kind == 'channels' else state['session']
+
+
+def changes( old, new ):
+    """ Compare two flattened trees like diff, but group the result the way
+        the delta endpoint reports it: added, removed and changed channels
+        and users. Removed ones are given by ID and session.
+    """
+    result = emptyChanges()
+    for event, state in diff( old, new ):
+        kind, change = GROUPS[event]
+        if change == 'removed':
+            state = identify( kind, state )
+        result[kind][change].append( state )
+    return result
+
+
+def squash( steps, flat ):
+    """ Combine the events of consecutive diffs into what changes() reports
+        for the first and last tree. `flat` is the last flattened tree; the
+        states of added and changed channels and users are taken from it.
+
+        Unlike changes(), this reports something that changed and then
+        changed back as changed.
+    """
+    channels, users = flat
+    existed = {}
+    for events in steps:
+        for event, state in events:
+            kind, change = GROUPS[event]
+            key = ( kind, identify( kind, state ) )
+            # the first event tells whether it was there to begin with
+            if key not in existed:
+                existed[key] = change != 'added'
+
+    result = emptyChanges()
+    for ( kind, ident ), before in existed.items():
+        state = ( channels if kind == 'channels' else users ).get( ident )
+        if state is None:
+            if before:
+                result[kind]['removed'].append( ident )
+        else:
+            result[kind]['changed' if before else 'added'].append( state )
+    return result
+
+
+class Version(object):
+    """ What SnapshotHistory keeps of a superseded snapshot: the events that
+        led to it from the version before.
+    """
+
+    __slots__ = ( "version", "name", "events" )
+
+    def __init__( self, version, name, events ):
+        self.version = version
+        self.name    = name
+        self.events  = events
+
+
+class SnapshotHistory(object):
+    """ Numbers each server's distinct snapshots and keeps the last `size`.
+
+        Only the latest snapshot of each server is kept whole; for the others
+        the ring holds a Version with the events diff() found between it and
+        its predecessor, so superseded snapshots (with their bodies, encodings
+        and projections) are freed as soon as no cache or request uses them
+        anymore, and a version costs no more than what changed in it.
+
+        Snapshots that only differ in what diff() ignores, i.e. growing idle
+        times, keep the version of the last one.
+
+        Versions only grow: they start at the current time in milliseconds,
+        so they also keep growing across restarts.
+    """
+
+    def __init__( self, size ):
+        self.size   = size
+        self.lock   = threading.Lock()
+        self.rings  = {}
+        self.latest = {}
+        self.base   = int( time() * 1000 )
+
+    @staticmethod
+    def _compare( last, snap ):
+        """ None if `snap` is identical to `last`, else the events that lead
+            from one to the other.
+        """
+        if last.name == snap.name and last.root == snap.root:
+            return None
+        return diff( last.flat, snap.flat )
+
+    def record( self, srv_id, snap ):
+        """ Assign the snapshot a version and remember it.
+
+            If nothing changed since the last snapshot, the last one is
+            confirmed and returned instead, so its serialized bodies are reused.
+        """
+        # serialize, flatten and compare outside of the lock
+        last = self.latest.get( srv_id )
+        events = self._compare( last, snap ) if last is not None else None
+        snap.flat
+        with self.lock:
+            if self.latest.get( srv_id ) is not last:
+                # recorded by someone else in the meantime
+                last = self.latest.get( srv_id )
+                events = self._compare( last, snap ) if last is not None else None
+
+            if last is None:
+                snap.version = self.base
+                self.rings[srv_id] = deque( [ Version( snap.version, snap.name, () ) ], maxlen=self.size )
+            elif events is None:
+                last.created = snap.created
+                return last
+            elif not events and last.name == snap.name:
+                snap.version = last.version
+            else:
+                snap.version = last.version + 1
+                self.rings[srv_id].append( Version( snap.version, snap.name, events ) )
+            self.latest[srv_id] = snap
+            return snap
+
+    def since( self, srv_id, version, snap ):
+        """ What changed from `version` to `snap` in the format of changes(),
+            or None if that version is unknown or no longer kept.
+        """
+        with self.lock:
+            ring = list( self.rings.get( srv_id, () ) )
+        versions = [ entry.version for entry in ring ]
+        if version not in versions or snap.version not in versions:
+            return None
+        first, last = versions.index( version ), versions.index( snap.version )
+        if first > last:
+            return None
+        return squash( [ entry.events for entry in ring[first + 1:last + 1] ], snap.flat )
@@ -0,0 +1,153 @@
+# -*- coding: utf-8 -*-
+# kate: space-indent on; indent-width 4; replace-tabs on;
+
+"""
+ *  Copyright © 2009-2010, Michael "Svedrin" Ziegler <diese-addy@funzt-halt.net>
+ *
+ *  Mumble-Django is free software; you can redistribute it and/or modify
+ *  it under the terms of the GNU General Public License as published by
+ *  the Free Software Foundation; either version 2 of the License, or
+ *  (at your option) any later version.
+ *
+ *  This package is distributed in the hope that it will be useful,
+ *  but WITHOUT ANY WARRANTY; without even the implied warranty of
+ *  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ *  GNU General Public License for more details.
+"""
+
+import json
+import threading
+
+from collections import deque
+from time        import sleep
+
+from .delta import diff
+
+
+def sseMessage( event, data ):
+    """ Encode one Server-Sent Events message. `data` is JSON as bytes. """
+    return b"".join([ b"event: ", event.encode( "utf-8" ), b"\ndata: ", data, b"\n\n" ])
+
+
+class Subscriber(object):
+    """ One HTTP client's queue of encoded messages.
+
+        A client that falls `maxlen` messages behind is evicted: its queue is
+        dropped and it is told to reconnect, which gets it a fresh full tree.
+    """
+
+    def __init__( self, maxlen ):
+        self.maxlen  = maxlen
+        self.queue   = deque()
+        self.cond    = threading.Condition()
+        self.evicted = False
+
+    def push( self, message ):
+        with self.cond:
+            if self.evicted:
+                return
+            if len(self.queue) >= self.maxlen:
+                self.evicted = True
+                self.queue.clear()
+            else:
+                self.queue.append( message )
+            self.cond.notify()
+
+    def next( self, timeout ):
+        """ Wait for the next message. Returns None on timeout, and raises
+            EOFError once this subscriber has been evicted.
+        """
+        with self.cond:
+            if not self.queue and not self.evicted:
+                self.cond.wait( timeout )
+            if self.evicted:
+                raise EOFError( "Subscriber fell too far behind." )
+            if self.queue:
+                return self.queue.popleft()
+            return None
+
+
+class ServerFeed(object):
+    """ The single upstream subscription for one server.
+
+        A thread takes snapshots from the cache every `interval` seconds,
+        diffs each new one against the last and fans the resulting events
+        out to all subscribers. Each message is encoded only once.
+    """
+
+    def __init__( self, srv_id, snapshot ):
+        self.srv_id      = srv_id
+        self.lock        = threading.Lock()
+        self.last        = snapshot
+        self.subscribers = set()
+
+    def add( self, sub ):
+        with self.lock:
+            sub.push( sseMessage( "tree", self.last.body ) )
+            self.subscribers.add( sub )
+
+    def remove( self, sub ):
+        with self.lock:
+            self.subscribers.discard( sub )
+
+    def update( self, snapshot ):
+        """ Publish the changes between the last snapshot and this one. """
+        with self.lock:
+            if snapshot is self.last or snapshot.etag == self.last.etag:
+                return
+            messages = [ sseMessage( event, json.dumps( state, sort_keys=True, separators=(',', ':') ).encode( "utf-8" ) )
+                         for ( event, state ) in diff( self.last.flat, snapshot.flat ) ]
+            self.last = snapshot
+            for sub in list(self.subscribers):
+                for message in messages:
+                    sub.push( message )
+                if sub.evicted:
+                    self.subscribers.discard( sub )
+
+
+class EventHub(object):
+    """ Hands out subscriptions to per-server feeds, running a polling thread
+        for every server that has at least one subscriber.
+    """
+
+    def __init__( self, cache, interval, maxlen ):
+        self.cache    = cache
+        self.interval = interval
+        self.maxlen   = maxlen
+        self.lock     = threading.Lock()
+        self.feeds    = {}
+
+    def subscribe( self, srv_id ):
+        """ Return a Subscriber whose first message is the current full tree. """
+        snapshot = self.cache.get( srv_id )
+        sub = Subscriber( self.maxlen )
+        with self.lock:
+            feed = self.feeds.get( srv_id )
+            if feed is None:
+                feed = self.feeds[srv_id] = ServerFeed( srv_id, snapshot )
+                threading.Thread( target=self._poll, args=( feed, ), daemon=True ).start()
+            feed.add( sub )
+        return sub
+
+    def unsubscribe( self, srv_id, sub ):
+        with self.lock:
+            feed = self.feeds.get( srv_id )
+        if feed is not None:
+            feed.remove( sub )
+
+    def _poll( self, feed ):
+        while True:
+            sleep( self.interval )
+            with self.lock:
+                if not feed.subscribers:
+                    del self.feeds[feed.srv_id]
+                    return
+            try:
+                feed.update( self.cache.get( feed.srv_id ) )
+            except Exception:
+                # keep the subscribers; the next round will try again.
+                pass
+
+    def stats( self ):
+        with self.lock:
+            return dict( ( srv_id, len(feed.subscribers) ) for ( srv_id, feed ) in self.feeds.items() )
@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+# kate: space-indent on; indent-width 4; replace-tabs on;
+
+"""
+ *  Copyright © 2009-2010, Michael "Svedrin" Ziegler <diese-addy@funzt-halt.net>
+ *
+ *  Mumble-Django is free software; you can redistribute it and/or modify
+ *  it under the terms of the GNU General Public License as published by
+ *  the Free Software Foundation; either version 2 of the License, or
+ *  (at your option) any later version.
+ *
+ *  This package is distributed in the hope that it will be useful,
+ *  but WITHOUT ANY WARRANTY; without even the implied warranty of
+ *  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ *  GNU General Public License for more details.
+"""
+
+
+class TreeIndex(object):
+    """ Hash indexes over one Ice Tree, for looking up single channels and
+        users without walking the tree.
+
+        channels: channel ID -> tree node (c, children, users)
+        users:    session -> user state
+        names:    lowercase user name -> [sessions]
+        paths:    channel ID -> IDs of the channels from the root down to it
+    """
+
+    def __init__( self, tree ):
+        self.channels = {}
+        self.users    = {}
+        self.names    = {}
+        self.paths    = {}
+
+        stack = [( tree, () )]
+        while stack:
+            node, parents = stack.pop()
+            path = parents + ( node.c.id, )
+            self.channels[node.c.id] = node
+            self.paths[node.c.id]    = path
+            for user in node.users:
+                self.users[user.session] = user
+                self.names.setdefault( user.name.lower(), [] ).append( user.session )
+            for child in node.children:
+                stack.append( ( child, path ) )
+
+        for sessions in self.names.values():
+            sessions.sort()
+
+    def pathNames( self, channel_id ):
+        """ [{id, name}] of the channels from the root down to the given one. """
+        return [ { 'id': cid, 'name': self.channels[cid].c.name } for cid in self.paths[channel_id] ]
+
+    def usersNamed( self, name ):
+        """ Users whose name equals `name`, ignoring case. """
+        return [ self.users[session] for session in self.names.get( name.lower(), () ) ]
@@ -0,0 +1,200 @@
+# -*- coding: utf-8 -*-
+# kate: space-indent on; indent-width 4; replace-tabs on;
+
+"""
+ *  Copyright © 2009-2010, Michael "Svedrin" Ziegler <diese-addy@funzt-halt.net>
+ *
+ *  Mumble-Django is free software; you can redistribute it and/or modify
+ *  it under the terms of the GNU General Public License as published by
+ *  the Free Software Foundation; either version 2 of the License, or
+ *  (at your option) any later version.
+ *
+ *  This package is distributed in the hope that it will be useful,
+ *  but WITHOUT ANY WARRANTY; without even the implied warranty of
+ *  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ *  GNU General Public License for more details.
+
+ Counters and histograms in the Prometheus text format.
+
+ Every thread records into a shard of its own, so recording takes no lock;
+ shards are only summed up when the metrics are scraped. When a thread ends,
+ its shard is merged into the totals, so short-lived request threads don't
+ make scrapes slower over time.
+"""
+
+import threading
+import weakref
+
+from bisect import bisect_left
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+LATENCY_BUCKETS = ( .001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10 )
+SIZE_BUCKETS    = ( 256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304 )
+
+
+def formatLabels( names, values ):
+    if not names:
+        return ""
+    return "{%s}" % ",".join(
+        '%s="%s"' % ( name, str(value).replace( "\\", "\\\\" ).replace( '"', '\\"' ).replace( "\n", "\\n" ) )
+        for ( name, value ) in zip( names, values ) )
+
+
+def formatValue( value ):
+    if value == float( "inf" ):
+        return "+Inf"
+    if isinstance( value, float ) and value.is_integer():
+        return str( int(value) )
+    return repr( value )
+
+
+class _Shard(object):
+    __slots__ = ( "values", "__weakref__" )
+
+    def __init__( self ):
+        self.values = {}
+
+
+class _Sharded(object):
+    """ Base for metrics whose values are kept per thread. """
+
+    def __init__( self, name, help, labelnames ):
+        self.name       = name
+        self.help       = help
+        self.labelnames = tuple( labelnames )
+        self.local      = threading.local()
+        # reentrant, as a shard may be retired by garbage collection during collect()
+        self.lock       = threading.RLock()
+        # the values of live shards by id() of their shard; the dicts can't
+        # identify shards themselves, as two threads may hold equal ones
+        self.shards     = {}
+        self.retired    = {}
+
+    def _values( self ):
+        """ The calling thread's {labels: value} dict. """
+        try:
+            return self.local.shard.values
+        except AttributeError:
+            shard = self.local.shard = _Shard()
+            with self.lock:
+                self.shards[id(shard)] = shard.values
+            weakref.finalize( shard, self._retire, id(shard) )
+            return shard.values
+
+    def _retire( self, shard_id ):
+        with self.lock:
+            values = self.shards.pop( shard_id, None )
+            if values is not None:
+                self._merge( self.retired, values )
+
+    def collect( self ):
+        """ Return {labels: value} summed over all threads. """
+        with self.lock:
+            total = {}
+            self._merge( total, self.retired )
+            for values in list( self.shards.values() ):
+                self._merge( total, values )
+        return total
+
+
+class Counter(_Sharded):
+    type = "counter"
+
+    def inc( self, labels=(), amount=1 ):
+        values = self._values()
+        values[labels] = values.get( labels, 0 ) + amount
+
+    @staticmethod
+    def _merge( total, values ):
+        for labels, value in list( values.items() ):
+            total[labels] = total.get( labels, 0 ) + value
+
+    def render( self ):
+        return [ "%s%s %s" % ( self.name, formatLabels( self.labelnames, labels ), formatValue( value ) )
+                 for ( labels, value ) in sorted( self.collect().items() ) ]
+
+
+class Histogram(_Sharded):
+    type = "histogram"
+
+    def __init__( self, name, help, labelnames, buckets=LATENCY_BUCKETS ):
+        _Sharded.__init__( self, name, help, labelnames )
+        self.buckets = tuple( buckets )
+
+    def observe( self, labels, value ):
+        values = self._values()
+        counts = values.get( labels )
+        if counts is None:
+            # one count per bucket plus +Inf, then the sum
+            counts = values[labels] = [0] * ( len(self.buckets) + 1 ) + [0.0]
+        counts[ bisect_left( self.buckets, value ) ] += 1
+        counts[-1] += value
+
+    @staticmethod
+    def _merge( total, values ):
+        for labels, counts in list( values.items() ):
+            counts = list( counts )
+            if labels in total:
+                total[labels] = [ a + b for ( a, b ) in zip( total[labels], counts ) ]
+            else:
+                total[labels] = counts
+
+    def render( self ):
+        names = self.labelnames + ( "le", )
+        lines = []
+        for labels, counts in sorted( self.collect().items() ):
+            cumulative = 0
+            for bound, count in zip( self.buckets + ( float( "inf" ), ), counts ):
+                cumulative += count
+                lines.append( "%s_bucket%s %d" % ( self.name, formatLabels( names, labels + ( formatValue( bound ), ) ), cumulative ) )
+            lines.append( "%s_sum%s %s"   % ( self.name, formatLabels( self.labelnames, labels ), formatValue( counts[-1] ) ) )
+            lines.append( "%s_count%s %d" % ( self.name, formatLabels( self.labelnames, labels ), cumulative ) )
+        return lines
+
+
+class Collected(object):
+    """ A metric read from elsewhere at scrape time; `func` returns {labels: value}. """
+
+    def __init__( self, name, help, labelnames, type, func ):
+        self.name       = name
+        self.help       = help
+        self.labelnames = tuple( labelnames )
+        self.type       = type
+        self.func       = func
+
+    def render( self ):
+        return [ "%s%s %s" % ( self.name, formatLabels( self.labelnames, labels ), formatValue( value ) )
+                 for ( labels, value ) in sorted( self.func().items() ) ]
+
+
+class Registry(object):
+    def __init__( self ):
+        self.metrics = []
+
+    def _add( self, metric ):
+        self.metrics.append( metric )
+        return metric
+
+    def counter( self, name, help, labelnames=() ):
+        return self._add( Counter( name, help, labelnames ) )
+
+    def histogram( self, name, help, labelnames=(), buckets=LATENCY_BUCKETS ):
+        return self._add( Histogram( name, help, labelnames, buckets ) )
+
+    def collected( self, name, help, labelnames, type, func ):
+        return self._add( Collected( name, help, labelnames, type, func ) )
+
+    def render( self ):
+        """ All metrics in the Prometheus text format, as bytes. """
+        lines = []
+        for metric in self.metrics:
+            try:
+                samples = metric.render()
+            except Exception:
+                # one broken source must not break the scrape.
+                continue
+            lines.append( "# HELP %s %s" % ( metric.name, metric.help ) )
+            lines.append( "# TYPE %s %s" % ( metric.name, metric.type ) )
+            lines.extend( samples )
+        return ( "\n".join( lines ) + "\n" ).encode( "utf-8" )
@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+# kate: space-indent on; indent-width 4; replace-tabs on;
+
+"""
+ *  Copyright © 2009-2010, Michael "Svedrin" Ziegler <diese-addy@funzt-halt.net>
+ *
+ *  Mumble-Django is free software; you can redistribute it and/or modify
+ *  it under the terms of the GNU General Public License as published by
+ *  the Free Software Foundation; either version 2 of the License, or
+ *  (at your option) any later version.
+ *
+ *  This package is distributed in the hope that it will be useful,
+ *  but WITHOUT ANY WARRANTY; without even the implied warranty of
+ *  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ *  GNU General Public License for more details.
+"""
+
+import threading
+
+from bisect import bisect_left, insort
+from time   import monotonic, sleep
+
+
+def userEntries( srv_id, snap ):
+    """ Search entries for the users in a tree snapshot:
+        (lowercase name, server ID, session, name, userid, channel path names).
+    """
+    index = snap.index
+    return set(
+        ( user.name.lower(), srv_id, user.session, user.name, user.userid,
+          tuple( index.channels[cid].c.name for cid in index.paths[user.channel] ) )
+        for user in index.users.values()
+        )
+
+
+class UserSearch(object):
+    """ Index of the users online on all booted servers, sorted by lowercase
+        name so prefixes can be found by bisection.
+
+        A thread refreshes it every `interval` seconds from the tree snapshots.
+        Only servers whose snapshot version changed are looked at, and only
+        their added and removed users are touched in the sorted list. The
+        thread is started on the first search.
+    """
+
+    def __init__( self, getServers, getTree, interval ):
+        self.getServers = getServers
+        self.getTree    = getTree
+        self.interval   = interval
+        self.lock       = threading.Lock()
+        self.entries    = []
+        self.servers    = {}
+        self.refreshed  = None
+        self.errors     = 0
+        self.thread     = None
+        self.startlock  = threading.Lock()
+
+    def _update( self, srv_id, entries ):
+        old = self.servers.get( srv_id, ( None, set() ) )[1]
+        with self.lock:
+            for entry in old - entries:
+                del self.entries[ bisect_left( self.entries, entry ) ]
+            for entry in entries - old:
+                insort( self.entries, entry )
+
+    def refresh( self ):
+        srv_ids = set( self.getServers() )
+
+        for srv_id in set( self.servers ) - srv_ids:
+            self._update( srv_id, set() )
+            del self.servers[srv_id]
+
+        for srv_id in srv_ids:
+            try:
+                snap = self.getTree( srv_id )
+            except Exception:
+                # keep what we know about this server until it answers again.
+                self.errors += 1
+                continue
+            if srv_id in self.servers and self.servers[srv_id][0] == snap.version:
+                continue
+            entries = userEntries( srv_id, snap )
+            self._update( srv_id, entries )
+            self.servers[srv_id] = ( snap.version, entries )
+
+        self.refreshed = monotonic()
+
+    def _run( self ):
+        while True:
+            sleep( self.interval )
+            try:
+                self.refresh()
+            except Exception:
+                self.errors += 1
+
+    def start( self ):
+        """ Fill the index and start refreshing it. Concurrent callers wait for the first fill. """
+        with self.startlock:
+            if self.thread is None:
+                self.refresh()
+                self.thread = threading.Thread( target=self._run, daemon=True )
+                self.thread.start()
+
+    def search( self, query, limit ):
+        """ Users whose name starts with `query`, ignoring case, ordered by name. """
+        if self.thread is None:
+            self.start()
+        query = query.lower()
+        result = []
+        with self.lock:
+            idx = bisect_left( self.entries, ( query, ) )
+            while idx < len(self.entries) and len(result) < limit and self.entries[idx][0].startswith( query ):
+                result.append( self.entries[idx] )
+                idx += 1
+        return result
+
+    @property
+    def age( self ):
+        """ Seconds since the last refresh. """
+        if self.refreshed is None:
+            return None
+        return monotonic() - self.refreshed
+
+    def stats( self ):
+        with self.lock:
+            return { 'users': len(self.entries), 'servers': len(self.servers), 'errors': self.errors, 'age': self.age }
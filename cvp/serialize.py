@@ -0,0 +1,166 @@
+# -*- coding: utf-8 -*-
+# kate: space-indent on; indent-width 4; replace-tabs on;
+
+"""
+ *  Copyright © 2009-2010, Michael "Svedrin" Ziegler <diese-addy@funzt-halt.net>
+ *
+ *  Mumble-Django is free software; you can redistribute it and/or modify
+ *  it under the terms of the GNU General Public License as published by
+ *  the Free Software Foundation; either version 2 of the License, or
+ *  (at your option) any later version.
+ *
+ *  This package is distributed in the hope that it will be useful,
+ *  but WITHOUT ANY WARRANTY; without even the implied warranty of
+ *  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ *  GNU General Public License for more details.
+
+ Writes Ice Trees as CVP JSON without building a nested dict first.
+
+ The output is the same as json.dumps( ..., sort_keys=True, separators=(',', ':') )
+ of the dicts flaskcvp used to build, so bodies and ETags do not change.
+"""
+
+import json
+
+from functools    import lru_cache
+from json.encoder import encode_basestring_ascii
+from operator     import attrgetter
+
+CHANNEL_FIELDS = ["id", "name", "parent", "links", "description", "temporary", "position"]
+USER_FIELDS    = ["channel", "deaf", "mute", "name", "selfDeaf", "selfMute",
+                  "session", "suppress", "userid", "idlesecs", "recording", "comment",
+                  "prioritySpeaker"]
+
+_encode = json.JSONEncoder( separators=(',', ':') ).encode
+
+# Fast paths for the types Ice hands out, anything else goes through json.
+CONVERTERS = {
+    str:   encode_basestring_ascii,
+    int:   int.__repr__,
+    bool:  lambda value: "true" if value else "false",
+    }
+
+
+def encodeValue( value ):
+    try:
+        return CONVERTERS[type(value)]( value )
+    except KeyError:
+        return _encode( value )
+
+
+class RecordEncoder(object):
+    """ Writes the given fields of an Ice struct as a JSON object.
+
+        The keys are sorted and the attribute getter and format string are
+        built once, so encoding a record is one attrgetter call and one
+        string formatting.
+    """
+
+    def __init__( self, fields ):
+        self.fields = sorted( fields )
+        if self.fields:
+            getter = attrgetter( *self.fields )
+            self.getter = getter if len(self.fields) > 1 else ( lambda obj: ( getter( obj ), ) )
+        else:
+            self.getter = lambda obj: ()
+        self.template = ",".join( '"%s":%%s' % field for field in self.fields )
+
+    def members( self, obj ):
+        """ The object's members without the surrounding braces. """
+        return self.template % tuple( map( encodeValue, self.getter( obj ) ) )
+
+    def encode( self, obj ):
+        return "{%s}" % self.members( obj )
+
+    def asDict( self, obj ):
+        return dict( zip( self.fields, self.getter( obj ) ) )
+
+
+class TreeEncoder(object):
+    """ Writes an Ice Tree (c, children, users) as nested CVP channels.
+
+        The tree is walked with an explicit stack, so its depth is not bound
+        by the recursion limit, and the JSON is produced in chunks of one
+        channel each. Channels more than `depth` levels below the tree's root
+        are left out, their parents get an empty "channels" list.
+    """
+
+    def __init__( self, channel_fields=CHANNEL_FIELDS, user_fields=USER_FIELDS, depth=None ):
+        self.channel = RecordEncoder( channel_fields )
+        self.user    = RecordEncoder( user_fields )
+        self.depth   = depth
+
+        # "channels" sorts before and "users" after every channel field
+        # that ends up in the output, so those always frame the channel's members.
+        keys = sorted( self.channel.fields + ["channels", "users"] )
+        if keys[0] != "channels" or keys[-1] != "users":
+            raise ValueError( "Channel fields must sort between 'channels' and 'users'." )
+
+    def iterEncode( self, tree ):
+        """ Yield the JSON for the tree in str chunks. """
+        channel = self.channel.members
+        user    = self.user.encode
+        depth   = self.depth
+        stack   = [( tree, 0 )]
+        while stack:
+            item = stack.pop()
+            if isinstance( item, str ):
+                yield item
+                continue
+
+            node, level = item
+            members = channel( node.c )
+            tail = '],%s"users":[%s]}' % ( members + "," if members else "",
+                                           ",".join( [ user( usr ) for usr in node.users ] ) )
+            yield '{"channels":['
+            stack.append( tail )
+            if depth is not None and level >= depth:
+                continue
+            children = node.children
+            for idx in range( len(children) - 1, -1, -1 ):
+                stack.append( ( children[idx], level + 1 ) )
+                if idx:
+                    stack.append( "," )
+
+    def encode( self, tree ):
+        """ The JSON for the tree as bytes. """
+        return "".join( self.iterEncode( tree ) ).encode( "ascii" )
+
+    def flatten( self, tree ):
+        """ Index the tree for delta.diff: ({channel id: channel}, {session: user}),
+            where channels are dicts without their subchannels and users.
+        """
+        channels = {}
+        users    = {}
+        cfields, cget = self.channel.fields, self.channel.getter
+        ufields, uget = self.user.fields,    self.user.getter
+        stack = [tree]
+        while stack:
+            node = stack.pop()
+            channels[node.c.id] = dict( zip( cfields, cget( node.c ) ) )
+            for usr in node.users:
+                users[usr.session] = dict( zip( ufields, uget( usr ) ) )
+            stack.extend( node.children )
+        return channels, users
+
+
+@lru_cache( maxsize=64 )
+def _getEncoder( channel_fields, user_fields, depth ):
+    return TreeEncoder( channel_fields, user_fields, depth )
+
+
+def getEncoder( channel_fields=CHANNEL_FIELDS, user_fields=USER_FIELDS, depth=None ):
+    """ Return the TreeEncoder for this projection, creating it only once.
+
+        Raises ValueError for fields that are not part of CVP documents.
+    """
+    for fields, known in ( ( channel_fields, CHANNEL_FIELDS ), ( user_fields, USER_FIELDS ) ):
+        unknown = set( fields ) - set( known )
+        if unknown:
+            raise ValueError( "Unknown fields: %s" % ", ".join( sorted( unknown ) ) )
+    if depth is not None and depth < 0:
+        raise ValueError( "Depth must not be negative." )
+    return _getEncoder( tuple( sorted( set( channel_fields ) ) ), tuple( sorted( set( user_fields ) ) ), depth )
+
+
+DEFAULT_ENCODER = getEncoder()
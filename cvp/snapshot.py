@@ -0,0 +1,204 @@
+# -*- coding: utf-8 -*-
+# kate: space-indent on; indent-width 4; replace-tabs on;
+
+"""
+ *  Copyright © 2009-2010, Michael "Svedrin" Ziegler <diese-addy@funzt-halt.net>
+ *
+ *  Mumble-Django is free software; you can redistribute it and/or modify
+ *  it under the terms of the GNU General Public License as published by
+ *  the Free Software Foundation; either version 2 of the License, or
+ *  (at your option) any later version.
+ *
+ *  This package is distributed in the hope that it will be useful,
+ *  but WITHOUT ANY WARRANTY; without even the implied warranty of
+ *  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ *  GNU General Public License for more details.
+"""
+
+import re
+import gzip
+import json
+import threading
+
+from hashlib import blake2b
+from time    import monotonic
+
+from .index     import TreeIndex
+from .serialize import DEFAULT_ENCODER, encodeValue
+from .timing    import timed
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+# Every new tree version is compressed on a request thread, so these trade a
+# little size for much less CPU than the libraries' maximum levels.
+LEVELS = { 'br': 5, 'zstd': 6, 'gzip': 6 }
+
+# Content-Encodings we can produce, in order of preference.
+COMPRESSORS = {}
+if brotli is not None:
+    COMPRESSORS['br'] = lambda data: brotli.compress( data, quality=LEVELS['br'] )
+if zstandard is not None:
+    # ZstdCompressor objects must not be shared between threads.
+    COMPRESSORS['zstd'] = lambda data: zstandard.ZstdCompressor( level=LEVELS['zstd'] ).compress( data )
+COMPRESSORS['gzip'] = lambda data: gzip.compress( data, LEVELS['gzip'], mtime=0 )
+
+ENCODINGS = list(COMPRESSORS)
+
+# How many projections of one tree snapshot are kept
+MAX_PROJECTIONS = 32
+
+# Left out of weak entity tags: idlesecs grows every second, which alone
+# doesn't make a tree worth downloading again (see delta.userChanged).
+WEAK_IGNORED = re.compile( rb'"idlesecs":\d+' )
+
+
+class Snapshot(object):
+    """ A CVP document as it was at one point in time.
+
+        Snapshots are shared between requests and must not be modified once
+        they have been handed to a cache.
+    """
+
+    def __init__( self, data, body=None ):
+        self.data    = data
+        self.created = monotonic()
+        self._body   = body
+        self._etag   = None
+        self._weaketag = None
+        self._encoded = {}
+        self._encodelock = threading.Lock()
+        self.version = None
+        self.deltas  = {}
+
+    @property
+    def body( self ):
+        """ The JSON document as bytes, serialized on first use. """
+        if self._body is None:
+            self._body = json.dumps( self.data, sort_keys=True, separators=(',', ':') ).encode( "utf-8" )
+        return self._body
+
+    @property
+    def etag( self ):
+        """ A strong entity tag derived from the body's contents. """
+        if self._etag is None:
+            self._etag = blake2b( self.body, digest_size=16 ).hexdigest()
+        return self._etag
+
+    def encoded( self, encoding ):
+        """ The body compressed with the given Content-Encoding, compressed on first use.
+
+            Concurrent requests for the same encoding wait for the first one
+            instead of compressing the body again.
+        """
+        if encoding is None or encoding == "identity":
+            return self.body
+        encoded = self._encoded.get( encoding )
+        if encoded is None:
+            with self._encodelock:
+                encoded = self._encoded.get( encoding )
+                if encoded is None:
+                    body = self.body
+                    with timed( "compress" ):
+                        encoded = self._encoded[encoding] = COMPRESSORS[encoding]( body )
+        return encoded
+
+    @property
+    def weaketag( self ):
+        """ A weak entity tag, which stays the same while nothing but users'
+            idle times change. Shared by all encodings of the body.
+        """
+        if self._weaketag is None:
+            self._weaketag = blake2b( WEAK_IGNORED.sub( b"", self.body ), digest_size=16 ).hexdigest()
+        return self._weaketag
+
+    @property
+    def age( self ):
+        """ Seconds since this snapshot was taken. """
+        return monotonic() - self.created
+
+
+class TreeSnapshot(Snapshot):
+    """ A server's channel tree, serialized straight from the Ice Tree.
+
+        The body is the same document flaskcvp used to build as a dict:
+        id, name, root, x_connecturl and x_version, the latter assigned by
+        SnapshotHistory.record.
+    """
+
+    def __init__( self, srv_id, name, tree, connecturl=None, encoder=DEFAULT_ENCODER ):
+        Snapshot.__init__( self, None )
+        self.srv_id     = srv_id
+        self.name       = name
+        self.tree       = tree
+        self.connecturl = connecturl
+        self.encoder    = encoder
+        self._root      = None
+        self._flat      = None
+        self._index     = None
+        self.projections = {}
+
+    @property
+    def root( self ):
+        """ The JSON of the channel tree alone. """
+        if self._root is None:
+            with timed( "serialize" ):
+                self._root = self.encoder.encode( self.tree )
+        return self._root
+
+    def _document( self, root ):
+        return b"".join([
+            b'{"id":',            encodeValue( self.srv_id ).encode( "ascii" ),
+            b',"name":',          encodeValue( self.name ).encode( "ascii" ),
+            b',"root":',          root,
+            b',"x_connecturl":',  encodeValue( self.connecturl ).encode( "ascii" ),
+            b',"x_version":',     encodeValue( self.version ).encode( "ascii" ),
+            b'}'])
+
+    @property
+    def body( self ):
+        if self._body is None:
+            self._body = self._document( self.root )
+        return self._body
+
+    @property
+    def index( self ):
+        """ Lookup tables for single channels and users, see TreeIndex. """
+        if self._index is None:
+            self._index = TreeIndex( self.tree )
+        return self._index
+
+    def projection( self, encoder, channel_id=None ):
+        """ The document with the tree written by another encoder (see
+            serialize.getEncoder), optionally starting at the given channel.
+
+            Returned as a Snapshot of its own, so its ETag and compressed
+            variants are cached along with this snapshot. Raises KeyError if
+            there is no such channel.
+        """
+        if encoder is self.encoder and channel_id is None:
+            return self
+        key = ( encoder, channel_id )
+        snap = self.projections.get( key )
+        if snap is None:
+            tree = self.tree if channel_id is None else self.index.channels[channel_id]
+            with timed( "serialize" ):
+                snap = Snapshot( None, self._document( encoder.encode( tree ) ) )
+            if len(self.projections) < MAX_PROJECTIONS:
+                self.projections[key] = snap
+        return snap
+
+    @property
+    def flat( self ):
+        """ The channel tree indexed by channel ID and session, see TreeEncoder.flatten. """
+        if self._flat is None:
+            self._flat = self.encoder.flatten( self.tree )
+        return self._flat
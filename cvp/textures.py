@@ -0,0 +1,166 @@
+# -*- coding: utf-8 -*-
+# kate: space-indent on; indent-width 4; replace-tabs on;
+
+"""
+ *  Copyright © 2009-2010, Michael "Svedrin" Ziegler <diese-addy@funzt-halt.net>
+ *
+ *  Mumble-Django is free software; you can redistribute it and/or modify
+ *  it under the terms of the GNU General Public License as published by
+ *  the Free Software Foundation; either version 2 of the License, or
+ *  (at your option) any later version.
+ *
+ *  This package is distributed in the hope that it will be useful,
+ *  but WITHOUT ANY WARRANTY; without even the implied warranty of
+ *  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ *  GNU General Public License for more details.
+"""
+
+import os
+import re
+import tempfile
+import threading
+
+from collections import OrderedDict
+from hashlib     import blake2b
+from io          import BytesIO
+from os.path     import join
+from time        import monotonic
+
+MIMETYPES = {
+    'png':  'image/png',
+    'webp': 'image/webp',
+    }
+
+# What the cache names its files; nothing else in its directory is touched
+FILENAME = re.compile( r"^[0-9a-f]{32}\.(png|webp)$" )
+
+
+def canEncode( fmt ):
+    """ Check if PIL was built with support for writing this format. """
+    if fmt == 'png':
+        return True
+    from PIL import features
+    return bool( features.check( fmt ) )
+
+
+def normalize( texture, fmt ):
+    """ Re-encode a texture (raw image file bytes or a PIL image) as PNG or WebP.
+
+        Raises ValueError if the texture can't be read.
+    """
+    from PIL import Image
+    buf = BytesIO()
+    try:
+        if isinstance( texture, ( bytes, bytearray ) ):
+            texture = Image.open( BytesIO( texture ) )
+        # images are only decoded here, so truncated ones fail here as well
+        texture.save( buf, fmt.upper() )
+    except OSError as err:
+        raise ValueError( err )
+    return buf.getvalue()
+
+
+class TextureCache(object):
+    """ Size-bounded LRU cache of normalized user textures on disk.
+
+        Files are named after a hash of the texture Murmur returned and the
+        output format, so a texture is only re-encoded when it changed. Which
+        file belongs to which user is remembered for `ttl` seconds or until
+        invalidate() is called; after that the texture is fetched from Murmur
+        again, but the file is reused if its content is the same. Users that
+        have no texture are remembered just as long. Other files in the
+        directory are neither counted nor removed.
+    """
+
+    def __init__( self, directory, max_bytes, ttl ):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.ttl       = ttl
+        self.lock      = threading.Lock()
+        self.files     = OrderedDict()
+        self.size      = 0
+        self.users     = {}
+
+        os.makedirs( directory, exist_ok=True )
+        entries = [ entry for entry in os.scandir( directory )
+                    if FILENAME.match( entry.name ) and entry.is_file() ]
+        for entry in sorted( entries, key=lambda entry: entry.stat().st_mtime ):
+            self.files[entry.name] = entry.stat().st_size
+            self.size += entry.stat().st_size
+        with self.lock:
+            self._evict()
+
+    def _evict( self ):
+        while self.size > self.max_bytes and len(self.files) > 1:
+            name, size = self.files.popitem( last=False )
+            self.size -= size
+            try:
+                os.unlink( join( self.directory, name ) )
+            except OSError:
+                pass
+
+    def _store( self, name, data ):
+        fd, temppath = tempfile.mkstemp( dir=self.directory, prefix="." )
+        with os.fdopen( fd, "wb" ) as out:
+            out.write( data )
+        os.replace( temppath, join( self.directory, name ) )
+        with self.lock:
+            if name not in self.files:
+                self.files[name] = len(data)
+                self.size += len(data)
+            self._evict()
+
+    def get( self, srv_id, userid, fmt, load ):
+        """ Return (path, etag) of the user's texture in the given format.
+
+            `load` is called to fetch the texture from Murmur, but only if the
+            cached mapping for this user is missing or expired. Raises
+            ValueError if the user has no (usable) texture; `load` should
+            raise it as well for users that don't exist.
+        """
+        key = ( srv_id, userid, fmt )
+        with self.lock:
+            entry = self.users.get( key )
+            if entry is not None and monotonic() - entry[1] < self.ttl:
+                if entry[0] is None:
+                    raise ValueError( "No Texture has been set." )
+                if entry[0] in self.files:
+                    self.files.move_to_end( entry[0] )
+                    return join( self.directory, entry[0] ), entry[0].split( "." )[0]
+
+        try:
+            texture = load()
+            if isinstance( texture, ( bytes, bytearray ) ):
+                if len(texture) == 0:
+                    raise ValueError( "No Texture has been set." )
+                digest = blake2b( texture, digest_size=16 )
+            else:
+                digest = blake2b( texture.tobytes(), digest_size=16 )
+            digest.update( fmt.encode( "ascii" ) )
+            etag = digest.hexdigest()
+            name = "%s.%s" % ( etag, fmt )
+
+            with self.lock:
+                cached = name in self.files
+            if not cached:
+                self._store( name, normalize( texture, fmt ) )
+        except ValueError:
+            with self.lock:
+                self.users[key] = ( None, monotonic() )
+            raise
+
+        with self.lock:
+            self.users[key] = ( name, monotonic() )
+            if name in self.files:
+                self.files.move_to_end( name )
+        return join( self.directory, name ), etag
+
+    def invalidate( self, srv_id, userid ):
+        """ Check the user's texture with Murmur again on the next request. """
+        with self.lock:
+            for fmt in MIMETYPES:
+                self.users.pop( ( srv_id, userid, fmt ), None )
+
+    def stats( self ):
+        with self.lock:
+            return { 'files': len(self.files), 'bytes': self.size, 'users': len(self.users) }
@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+# kate: space-indent on; indent-width 4; replace-tabs on;
+
+"""
+ *  Copyright © 2009-2010, Michael "Svedrin" Ziegler <diese-addy@funzt-halt.net>
+ *
+ *  Mumble-Django is free software; you can redistribute it and/or modify
+ *  it under the terms of the GNU General Public License as published by
+ *  the Free Software Foundation; either version 2 of the License, or
+ *  (at your option) any later version.
+ *
+ *  This package is distributed in the hope that it will be useful,
+ *  but WITHOUT ANY WARRANTY; without even the implied warranty of
+ *  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ *  GNU General Public License for more details.
+
+ Per-request breakdown of where the time went: Ice calls, serialization,
+ compression and JSONP wrapping.
+
+ The trace of the current request lives in a context variable, so code deep
+ down (e.g. Snapshot.encoded) can record into it without it being passed
+ around, and threads running a copy of the request's context record into it
+ as well. Without a trace, recording does nothing.
+"""
+
+import json
+import random
+import threading
+
+from contextlib  import contextmanager
+from contextvars import ContextVar
+from time        import monotonic, time
+
+_trace = ContextVar( "cvp_trace", default=None )
+
+
+class RequestTrace(object):
+    """ Counts and total seconds per kind of work done for one request. """
+
+    def __init__( self ):
+        self.started = monotonic()
+        self.lock    = threading.Lock()
+        self.spans   = {}
+
+    def add( self, name, seconds ):
+        with self.lock:
+            span = self.spans.get( name )
+            if span is None:
+                span = self.spans[name] = [0, 0.0]
+            span[0] += 1
+            span[1] += seconds
+
+    @property
+    def elapsed( self ):
+        return monotonic() - self.started
+
+    def serverTiming( self ):
+        """ The breakdown as a Server-Timing header value. """
+        with self.lock:
+            spans = sorted( self.spans.items() )
+        entries = [ '%s;desc="%d";dur=%.2f' % ( name, count, seconds * 1000 ) for ( name, ( count, seconds ) ) in spans ]
+        entries.append( "total;dur=%.2f" % ( self.elapsed * 1000 ) )
+        return ", ".join( entries )
+
+    def asDict( self ):
+        with self.lock:
+            return dict( ( name, { 'count': count, 'ms': round( seconds * 1000, 3 ) } )
+                         for ( name, ( count, seconds ) ) in self.spans.items() )
+
+
+def startTrace():
+    """ Start tracing the current context. Returns the trace and a token for endTrace. """
+    trace = RequestTrace()
+    return trace, _trace.set( trace )
+
+
+def endTrace( token ):
+    _trace.reset( token )
+
+
+def record( name, seconds ):
+    trace = _trace.get()
+    if trace is not None:
+        trace.add( name, seconds )
+
+
+@contextmanager
+def timed( name ):
+    """ Record the time spent in the with block as `name`. """
+    trace = _trace.get()
+    if trace is None:
+        yield
+        return
+    started = monotonic()
+    try:
+        yield
+    finally:
+        trace.add( name, monotonic() - started )
+
+
+class SlowLog(object):
+    """ Appends traces of requests that took at least `threshold` seconds to
+        a file as JSON lines, sampling `sample` (0..1) of them.
+    """
+
+    def __init__( self, path, threshold, sample=1.0 ):
+        self.path      = path
+        self.threshold = threshold
+        self.sample    = sample
+        self.lock      = threading.Lock()
+        self.file      = open( path, "a", buffering=1 )
+
+    def maybeLog( self, trace, **fields ):
+        elapsed = trace.elapsed
+        if elapsed < self.threshold or random.random() >= self.sample:
+            return
+        entry = dict( fields, time=time(), ms=round( elapsed * 1000, 3 ), spans=trace.asDict() )
+        line  = json.dumps( entry, sort_keys=True )
+        with self.lock:
+            self.file.write( line + "\n" )
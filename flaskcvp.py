@@ -16,19 +16,66 @@
  *  GNU General Public License for more details.
 """
 import os
+import json
 import getpass
 import argparse
+import threading
+import contextvars
 
-from flask import Flask, jsonify, request, current_app, render_template, send_from_directory
+from time import monotonic
+
+from concurrent.futures import ThreadPoolExecutor, wait
+from hashlib import blake2b
+
+from flask import Flask, jsonify, request, current_app, render_template, send_from_directory, send_file, abort, g
+from werkzeug.exceptions import HTTPException
 from functools import wraps
 
-from mumble.mctl import MumbleCtlBase
+from mumble.mctl import MumbleCtlBase, DeadlineExceeded, NotConnected, UnknownServer, setDeadline, resetDeadline, timeLeft, isTimeoutError, isMissingServer, addCallObserver
+from cvp.breaker import CircuitBreaker, CircuitOpen
+from cvp.cache import SnapshotCache
+from cvp.delta import SnapshotHistory
+from cvp.events import EventHub, sseMessage
+from cvp.metrics import Registry, CONTENT_TYPE, SIZE_BUCKETS
+from cvp.timing import startTrace, endTrace, record, timed, SlowLog
+from cvp.search import UserSearch
+from cvp.serialize import getEncoder, CHANNEL_FIELDS, USER_FIELDS
+from cvp.snapshot import Snapshot, TreeSnapshot, ENCODINGS
+from cvp.textures import TextureCache, MIMETYPES, canEncode
 
 DEFAULT_CONNSTRING = 'Meta:tcp -h 127.0.0.1 -p 6502'
 DEFAULT_SLICEFILE  = '/usr/share/slice/Murmur.ice'
 DEFAULT_ICESECRET  = None
 DEFAULT_HOST = "127.0.0.1"
 DEFAULT_PORT = 5000
+DEFAULT_CALLBACK_ENDPOINT = None
+DEFAULT_CACHE_TTL = 1.0
+DEFAULT_MAX_STALE = 60.0
+DEFAULT_FETCH_CONCURRENCY = 8
+DEFAULT_FETCH_TIMEOUT = 5.0
+DEFAULT_EVENTS_INTERVAL = 1.0
+DEFAULT_EVENTS_QUEUE = 256
+DEFAULT_HISTORY = 32
+DEFAULT_TEXTURE_CACHE = os.path.join(os.path.expanduser("~"), ".cache", "flaskcvp-textures")
+DEFAULT_TEXTURE_CACHE_SIZE = 64
+DEFAULT_TEXTURE_TTL = 300.0
+DEFAULT_SEARCH_INTERVAL = 5.0
+DEFAULT_BREAKER_THRESHOLD = 5
+DEFAULT_BREAKER_RESET = 10.0
+DEFAULT_ICE_TIMEOUTS = 'default=5,getConf=1,getServer=1,getBootedServers=2,getTree=5'
+DEFAULT_REQUEST_DEADLINE = 10.0
+DEFAULT_TRACE_LOG = None
+DEFAULT_TRACE_THRESHOLD = 0.5
+DEFAULT_TRACE_SAMPLE = 1.0
+
+# Seconds between keepalive comments on idle event streams
+SSE_KEEPALIVE = 15
+
+# Seconds clients may cache user textures before revalidating them
+TEXTURE_MAX_AGE = 86400
+
+# Most users /search returns for one query
+SEARCH_MAX_RESULTS = 50
 
 # Environment variable names
 ENV_CONNSTRING = 'MUMBLE_CONNSTRING'
@@ -36,6 +83,40 @@ ENV_ICESECRET = 'MUMBLE_ICESECRET'
 ENV_SLICE = 'MUMBLE_SLICE'
 ENV_HOST = 'FLASKCVP_HOST'
 ENV_PORT = 'FLASKCVP_PORT'
+ENV_CALLBACK_ENDPOINT = 'FLASKCVP_CALLBACK_ENDPOINT'
+ENV_CACHE_TTL = 'FLASKCVP_CACHE_TTL'
+ENV_STALE_WHILE_REVALIDATE = 'FLASKCVP_STALE_WHILE_REVALIDATE'
+ENV_MAX_STALE = 'FLASKCVP_MAX_STALE'
+ENV_FETCH_CONCURRENCY = 'FLASKCVP_FETCH_CONCURRENCY'
+ENV_FETCH_TIMEOUT = 'FLASKCVP_FETCH_TIMEOUT'
+ENV_EVENTS_INTERVAL = 'FLASKCVP_EVENTS_INTERVAL'
+ENV_EVENTS_QUEUE = 'FLASKCVP_EVENTS_QUEUE'
+ENV_HISTORY = 'FLASKCVP_HISTORY'
+ENV_TEXTURE_CACHE = 'FLASKCVP_TEXTURE_CACHE'
+ENV_TEXTURE_CACHE_SIZE = 'FLASKCVP_TEXTURE_CACHE_SIZE'
+ENV_TEXTURE_TTL = 'FLASKCVP_TEXTURE_TTL'
+ENV_SEARCH_INTERVAL = 'FLASKCVP_SEARCH_INTERVAL'
+ENV_BREAKER_THRESHOLD = 'FLASKCVP_BREAKER_THRESHOLD'
+ENV_BREAKER_RESET = 'FLASKCVP_BREAKER_RESET'
+ENV_ICE_TIMEOUTS = 'MUMBLE_ICE_TIMEOUTS'
+ENV_REQUEST_DEADLINE = 'FLASKCVP_REQUEST_DEADLINE'
+ENV_SERVER_TIMING = 'FLASKCVP_SERVER_TIMING'
+ENV_TRACE_LOG = 'FLASKCVP_TRACE_LOG'
+ENV_TRACE_THRESHOLD = 'FLASKCVP_TRACE_THRESHOLD'
+ENV_TRACE_SAMPLE = 'FLASKCVP_TRACE_SAMPLE'
+
+def envFlag(name):
+    """ True if the environment variable is set to something like 1/yes/true. """
+    return os.environ.get(name, '').lower() in ('1', 'yes', 'true', 'on')
+
+def parseTimeouts(spec):
+    """ Parse 'operation=seconds,...' into a dict. """
+    timeouts = {}
+    for item in spec.split(','):
+        if item.strip():
+            operation, seconds = item.split('=', 1)
+            timeouts[operation.strip()] = float(seconds)
+    return timeouts
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description="""
@@ -68,6 +149,86 @@ using the Flask Python framework and Mumble-Django's MCTL connection library.
         type=int,
         help=f"The port number to bind to. Default is {DEFAULT_PORT}. Can be set with {ENV_PORT} env var.",
         default=int(os.environ.get(ENV_PORT, DEFAULT_PORT)))
+    parser.add_argument("-e", "--callback-endpoint",
+        help="Ice endpoint Murmur can reach us on, e.g. 'tcp -h 172.17.0.3 -p 6503'. If set, trees are "
+             f"kept in memory via Murmur callbacks instead of fetched per request. Can be set with {ENV_CALLBACK_ENDPOINT} env var.",
+        default=os.environ.get(ENV_CALLBACK_ENDPOINT, DEFAULT_CALLBACK_ENDPOINT))
+    parser.add_argument("-t", "--cache-ttl",
+        type=float,
+        help=f"Seconds a server's tree is cached before it is fetched again. Default is {DEFAULT_CACHE_TTL}. Can be set with {ENV_CACHE_TTL} env var.",
+        default=float(os.environ.get(ENV_CACHE_TTL, DEFAULT_CACHE_TTL)))
+    parser.add_argument("-w", "--stale-while-revalidate",
+        help=f"Serve expired trees while a fresh one is fetched in the background. Can be set with {ENV_STALE_WHILE_REVALIDATE} env var.",
+        action="store_true", default=envFlag(ENV_STALE_WHILE_REVALIDATE))
+    parser.add_argument("--max-stale",
+        type=float,
+        help=f"Seconds after which an expired tree is no longer served while Murmur can't be reached. Default is {DEFAULT_MAX_STALE}. Can be set with {ENV_MAX_STALE} env var.",
+        default=float(os.environ.get(ENV_MAX_STALE, DEFAULT_MAX_STALE)))
+    parser.add_argument("--fetch-concurrency",
+        type=int,
+        help=f"How many server trees /all fetches at the same time. Default is {DEFAULT_FETCH_CONCURRENCY}. Can be set with {ENV_FETCH_CONCURRENCY} env var.",
+        default=int(os.environ.get(ENV_FETCH_CONCURRENCY, DEFAULT_FETCH_CONCURRENCY)))
+    parser.add_argument("--fetch-timeout",
+        type=float,
+        help=f"Seconds /all waits for server trees before answering without them. Default is {DEFAULT_FETCH_TIMEOUT}. Can be set with {ENV_FETCH_TIMEOUT} env var.",
+        default=float(os.environ.get(ENV_FETCH_TIMEOUT, DEFAULT_FETCH_TIMEOUT)))
+    parser.add_argument("--events-interval",
+        type=float,
+        help=f"Seconds between checks for changes pushed to event streams. Default is {DEFAULT_EVENTS_INTERVAL}. Can be set with {ENV_EVENTS_INTERVAL} env var.",
+        default=float(os.environ.get(ENV_EVENTS_INTERVAL, DEFAULT_EVENTS_INTERVAL)))
+    parser.add_argument("--events-queue",
+        type=int,
+        help=f"How many events a stream client may fall behind before it is disconnected. Default is {DEFAULT_EVENTS_QUEUE}. Can be set with {ENV_EVENTS_QUEUE} env var.",
+        default=int(os.environ.get(ENV_EVENTS_QUEUE, DEFAULT_EVENTS_QUEUE)))
+    parser.add_argument("--history",
+        type=int,
+        help=f"How many versions of each tree are kept for /<srv_id>/delta. Default is {DEFAULT_HISTORY}. Can be set with {ENV_HISTORY} env var.",
+        default=int(os.environ.get(ENV_HISTORY, DEFAULT_HISTORY)))
+    parser.add_argument("--texture-cache",
+        help=f"Directory to cache user textures in. Default is '{DEFAULT_TEXTURE_CACHE}'. Can be set with {ENV_TEXTURE_CACHE} env var.",
+        default=os.environ.get(ENV_TEXTURE_CACHE, DEFAULT_TEXTURE_CACHE))
+    parser.add_argument("--texture-cache-size",
+        type=int,
+        help=f"Maximum size of the texture cache in MiB. Default is {DEFAULT_TEXTURE_CACHE_SIZE}. Can be set with {ENV_TEXTURE_CACHE_SIZE} env var.",
+        default=int(os.environ.get(ENV_TEXTURE_CACHE_SIZE, DEFAULT_TEXTURE_CACHE_SIZE)))
+    parser.add_argument("--texture-ttl",
+        type=float,
+        help=f"Seconds before a cached texture is checked with Murmur again. Default is {DEFAULT_TEXTURE_TTL}. Can be set with {ENV_TEXTURE_TTL} env var.",
+        default=float(os.environ.get(ENV_TEXTURE_TTL, DEFAULT_TEXTURE_TTL)))
+    parser.add_argument("--search-interval",
+        type=float,
+        help=f"Seconds between refreshes of the /search index. Default is {DEFAULT_SEARCH_INTERVAL}. Can be set with {ENV_SEARCH_INTERVAL} env var.",
+        default=float(os.environ.get(ENV_SEARCH_INTERVAL, DEFAULT_SEARCH_INTERVAL)))
+    parser.add_argument("--breaker-threshold",
+        type=int,
+        help=f"Consecutive failed tree fetches after which a server is not called for a while. Default is {DEFAULT_BREAKER_THRESHOLD}. Can be set with {ENV_BREAKER_THRESHOLD} env var.",
+        default=int(os.environ.get(ENV_BREAKER_THRESHOLD, DEFAULT_BREAKER_THRESHOLD)))
+    parser.add_argument("--breaker-reset",
+        type=float,
+        help=f"Seconds before a failing server is tried again. Default is {DEFAULT_BREAKER_RESET}. Can be set with {ENV_BREAKER_RESET} env var.",
+        default=float(os.environ.get(ENV_BREAKER_RESET, DEFAULT_BREAKER_RESET)))
+    parser.add_argument("--ice-timeouts",
+        type=parseTimeouts,
+        help=f"Ice invocation timeouts in seconds by operation, 'default' applies to all others. Default is '{DEFAULT_ICE_TIMEOUTS}'. Can be set with {ENV_ICE_TIMEOUTS} env var.",
+        default=parseTimeouts(os.environ.get(ENV_ICE_TIMEOUTS, DEFAULT_ICE_TIMEOUTS)))
+    parser.add_argument("--request-deadline",
+        type=float,
+        help=f"Seconds a request may spend on Ice calls in total, 0 for no limit. Default is {DEFAULT_REQUEST_DEADLINE}. Can be set with {ENV_REQUEST_DEADLINE} env var.",
+        default=float(os.environ.get(ENV_REQUEST_DEADLINE, DEFAULT_REQUEST_DEADLINE)))
+    parser.add_argument("--server-timing",
+        help=f"Send a Server-Timing header breaking each request down into Ice calls, serialization, JSONP wrapping and compression. Can be set with {ENV_SERVER_TIMING} env var.",
+        action="store_true", default=envFlag(ENV_SERVER_TIMING))
+    parser.add_argument("--trace-log",
+        help=f"File to append the same breakdown of slow requests to, as JSON lines. Can be set with {ENV_TRACE_LOG} env var.",
+        default=os.environ.get(ENV_TRACE_LOG, DEFAULT_TRACE_LOG))
+    parser.add_argument("--trace-threshold",
+        type=float,
+        help=f"Seconds after which a request counts as slow. Default is {DEFAULT_TRACE_THRESHOLD}. Can be set with {ENV_TRACE_THRESHOLD} env var.",
+        default=float(os.environ.get(ENV_TRACE_THRESHOLD, DEFAULT_TRACE_THRESHOLD)))
+    parser.add_argument("--trace-sample",
+        type=float,
+        help=f"Share of slow requests to log, between 0 and 1. Default is {DEFAULT_TRACE_SAMPLE}. Can be set with {ENV_TRACE_SAMPLE} env var.",
+        default=float(os.environ.get(ENV_TRACE_SAMPLE, DEFAULT_TRACE_SAMPLE)))
 
     args = parser.parse_args()
     options = args
@@ -82,30 +243,78 @@ else:
         icesecret = os.environ.get(ENV_ICESECRET, DEFAULT_ICESECRET)
         host = os.environ.get(ENV_HOST, DEFAULT_HOST)
         port = int(os.environ.get(ENV_PORT, DEFAULT_PORT))
+        callback_endpoint = os.environ.get(ENV_CALLBACK_ENDPOINT, DEFAULT_CALLBACK_ENDPOINT)
+        cache_ttl = float(os.environ.get(ENV_CACHE_TTL, DEFAULT_CACHE_TTL))
+        stale_while_revalidate = envFlag(ENV_STALE_WHILE_REVALIDATE)
+        max_stale = float(os.environ.get(ENV_MAX_STALE, DEFAULT_MAX_STALE))
+        fetch_concurrency = int(os.environ.get(ENV_FETCH_CONCURRENCY, DEFAULT_FETCH_CONCURRENCY))
+        fetch_timeout = float(os.environ.get(ENV_FETCH_TIMEOUT, DEFAULT_FETCH_TIMEOUT))
+        events_interval = float(os.environ.get(ENV_EVENTS_INTERVAL, DEFAULT_EVENTS_INTERVAL))
+        events_queue = int(os.environ.get(ENV_EVENTS_QUEUE, DEFAULT_EVENTS_QUEUE))
+        history = int(os.environ.get(ENV_HISTORY, DEFAULT_HISTORY))
+        texture_cache = os.environ.get(ENV_TEXTURE_CACHE, DEFAULT_TEXTURE_CACHE)
+        texture_cache_size = int(os.environ.get(ENV_TEXTURE_CACHE_SIZE, DEFAULT_TEXTURE_CACHE_SIZE))
+        texture_ttl = float(os.environ.get(ENV_TEXTURE_TTL, DEFAULT_TEXTURE_TTL))
+        search_interval = float(os.environ.get(ENV_SEARCH_INTERVAL, DEFAULT_SEARCH_INTERVAL))
+        breaker_threshold = int(os.environ.get(ENV_BREAKER_THRESHOLD, DEFAULT_BREAKER_THRESHOLD))
+        breaker_reset = float(os.environ.get(ENV_BREAKER_RESET, DEFAULT_BREAKER_RESET))
+        ice_timeouts = parseTimeouts(os.environ.get(ENV_ICE_TIMEOUTS, DEFAULT_ICE_TIMEOUTS))
+        request_deadline = float(os.environ.get(ENV_REQUEST_DEADLINE, DEFAULT_REQUEST_DEADLINE))
+        server_timing = envFlag(ENV_SERVER_TIMING)
+        trace_log = os.environ.get(ENV_TRACE_LOG, DEFAULT_TRACE_LOG)
+        trace_threshold = float(os.environ.get(ENV_TRACE_THRESHOLD, DEFAULT_TRACE_THRESHOLD))
+        trace_sample = float(os.environ.get(ENV_TRACE_SAMPLE, DEFAULT_TRACE_SAMPLE))
 
 print("Using connection string: ", options.connstring)
 print("Using slice file: ", options.slice)
 print("Using Ice secret: ", options.icesecret)
 print("Using host: ", options.host)
 print("Using port: ", options.port)
+print("Using callback endpoint: ", options.callback_endpoint)
+print("Using cache TTL: ", options.cache_ttl)
+
+textures = TextureCache(options.texture_cache, options.texture_cache_size * 1024 * 1024, options.texture_ttl)
+
+def onTreeEvent(srv_id, event, state):
+    """ Called by the tree mirror for every change Murmur reports. """
+    # textures changes are only reported as some state change of the user
+    if event == "userStateChanged" and state.userid >= 0:
+        textures.invalidate(srv_id, state.userid)
+
+def setupMirror(newctl):
+    newctl.enableTreeMirror( options.callback_endpoint )
+    newctl.addTreeListener( onTreeEvent )
+
+# Connects on first use and reconnects after Murmur restarts.
+ctl = MumbleCtlBase.newInstance( options.connstring, options.slice, options.icesecret, options.ice_timeouts )
+if options.callback_endpoint:
+    ctl.addSetup(setupMirror)
 
-ctl = MumbleCtlBase.newInstance( options.connstring, options.slice, options.icesecret )
+def connectInBackground():
+    """ Connect to Murmur without making the import wait for it. """
+    try:
+        ctl.getCtl()
+    except Exception as err:
+        print("Connecting to Murmur failed: ", err)
+
+threading.Thread(target=connectInBackground, daemon=True).start()
 
 
 app = Flask(__name__)
 
-def getUser(user):
-    fields = ["channel", "deaf", "mute", "name", "selfDeaf", "selfMute",
-        "session", "suppress", "userid", "idlesecs", "recording", "comment",
-        "prioritySpeaker"]
-    return dict(zip(fields, [getattr(user, field) for field in fields]))
+metrics = Registry()
+ctl_calls = metrics.counter('cvp_ctl_calls_total', 'Calls of ctl methods.', ('method', 'result'))
+ctl_seconds = metrics.histogram('cvp_ctl_call_seconds', 'Duration of ctl method calls.', ('method',))
+http_requests = metrics.counter('cvp_http_requests_total', 'HTTP requests answered.', ('endpoint', 'status'))
+http_seconds = metrics.histogram('cvp_http_request_seconds', 'Time taken to answer HTTP requests.', ('endpoint',))
+http_bytes = metrics.histogram('cvp_http_response_bytes', 'Size of HTTP response bodies.', ('endpoint',), SIZE_BUCKETS)
+
+def observeCtlCall(method, seconds, error):
+    ctl_calls.inc((method, 'ok' if error is None else 'error'))
+    ctl_seconds.observe((method,), seconds)
+    record("ice-" + method, seconds)
 
-def getChannel(channel):
-    fields = ["id", "name", "parent", "links", "description", "temporary", "position"]
-    data = dict(zip(fields, [getattr(channel.c, field) for field in fields]))
-    data['channels'] = [ getChannel(subchan) for subchan in channel.children ]
-    data['users']    = [ getUser(user) for user in channel.users ]
-    return data
+addCallObserver(observeCtlCall)
 
 def support_jsonp(f):
     """Wraps output to JSONP"""
@@ -113,33 +322,469 @@ def support_jsonp(f):
     def decorated_function(*args, **kwargs):
         result = f(*args, **kwargs)
         callback = request.args.get('callback', False)
-        if callback:
-            # Python3: decode response data as text
-            data = result.get_data(as_text=True)
-            content = f"{callback}({data})"
-            return current_app.response_class(content,
-                                              mimetype='application/json')
-        else:
-            return result
+        if callback and result.status_code != 304:
+            # keep the headers and the body's buffers, only wrap them
+            with timed("jsonp"):
+                chunks = [callback.encode("utf-8") + b"("]
+                chunks.extend(result.iter_encoded())
+                chunks.append(b")")
+                result.response = chunks
+                result.headers['Content-Length'] = str(sum(len(chunk) for chunk in chunks))
+                result.mimetype = 'application/json'
+        return result
     return decorated_function
 
+def snapshotResponse(snap):
+    """ Serve a snapshot's cached body in the best encoding the client accepts,
+        or an empty 304 if the client's copy is current.
+
+        The weak ETag ignores users' idle times, so pollers get a 304 until
+        something else changes.
+    """
+    # JSONP bodies get wrapped by support_jsonp, so they must stay uncompressed,
+    # and they differ by callback, so they get no ETag of the plain body.
+    if request.args.get('callback'):
+        return current_app.response_class(snap.body, mimetype='application/json')
+
+    encoding = request.accept_encodings.best_match(ENCODINGS)
+    if request.if_none_match.contains_weak(snap.weaketag):
+        response = current_app.response_class(status=304)
+    else:
+        response = current_app.response_class(snap.encoded(encoding), mimetype='application/json')
+        if encoding is not None:
+            response.content_encoding = encoding
+    response.set_etag(snap.weaketag, weak=True)
+    response.vary.add('Accept-Encoding')
+    return response
+
+def fetchTree(srv_id):
+    # issue both calls before waiting, so they share one round trip
+    name = ctl.getConfAsync(srv_id, "registername")
+    tree = ctl.getTreeAsync(srv_id)
+    name, tree = name.result(), tree.result()
+
+    return history.record(srv_id, TreeSnapshot(srv_id, name, tree, os.environ.get('MURMUR_CONNECT_URL')))
+
+def fetchServers(key):
+    return Snapshot({'servers': ctl.getBootedServers()})
+
+# breaker key for calls to Meta rather than to one server
+META = 'Meta'
+
+def probeCircuit(key):
+    # probes go through the caches, so a successful one is cached as well
+    if key == META:
+        servers.get(None)
+    else:
+        trees.get(key)
+
+def isServerFailure(err):
+    """ Errors that say Murmur is unwell, rather than that the request was wrong
+        or that we aren't connected yet.
+    """
+    return not (isMissingServer(err) or isinstance(err, (ValueError, LookupError, NotConnected)))
+
+def cacheCounters():
+    counters = {}
+    for name, cache in (('trees', trees), ('servers', servers)):
+        stats = cache.stats()
+        for result in ('hits', 'misses', 'stale', 'coalesced', 'errors'):
+            counters[(name, result)] = stats[result]
+    return counters
+
+def cacheHitRatios():
+    """ Share of lookups per cache that did not start a fetch of their own. """
+    ratios = {}
+    for name, cache in (('trees', trees), ('servers', servers)):
+        stats = cache.stats()
+        served = stats['hits'] + stats['stale'] + stats['coalesced']
+        ratios[(name,)] = served / float(max(1, served + stats['misses']))
+    return ratios
+
+metrics.collected('cvp_cache_lookups_total', 'Snapshot cache lookups by result.', ('cache', 'result'), 'counter', cacheCounters)
+metrics.collected('cvp_cache_hit_ratio', 'Share of snapshot cache lookups that did not fetch from Murmur.', ('cache',), 'gauge', cacheHitRatios)
+metrics.collected('cvp_breaker_rejected_total', 'Calls rejected by open circuits.', (), 'counter',
+    lambda: {(): breaker.stats()['rejected']})
+metrics.collected('cvp_event_subscribers', 'Connected event stream clients.', (), 'gauge',
+    lambda: {(): sum(events.stats().values())})
+metrics.collected('cvp_texture_cache_bytes', 'Size of the texture cache on disk.', (), 'gauge',
+    lambda: {(): textures.stats()['bytes']})
+
+history = SnapshotHistory(options.history)
+breaker = CircuitBreaker(options.breaker_threshold, options.breaker_reset, probe=probeCircuit, isFailure=isServerFailure)
+trees = SnapshotCache(breaker.wrap(fetchTree), options.cache_ttl, options.stale_while_revalidate,
+                      options.max_stale, isGone=isMissingServer)
+servers = SnapshotCache(lambda key: breaker.call(META, fetchServers, key), options.cache_ttl,
+                        options.stale_while_revalidate, options.max_stale)
+
+events = EventHub(trees, options.events_interval, options.events_queue)
+
+search = UserSearch(lambda: servers.get(None).data['servers'], trees.get, options.search_interval)
+
+# shared by all requests, so this bounds the number of concurrent tree fetches
+fetcher = ThreadPoolExecutor(max_workers=options.fetch_concurrency)
+
+aggregate = {'tag': None, 'snapshot': None}
+aggregate_lock = threading.Lock()
+
+def joinSnapshots(snaps, unavailable):
+    """ Combine server snapshots into one document by splicing their bodies.
+
+        The result is reused for as long as its parts stay the same, so its
+        compressed variants are computed only once as well.
+    """
+    tag = blake2b(json.dumps([[snap.etag for snap in snaps], unavailable]).encode("utf-8"),
+                  digest_size=16).hexdigest()
+    with aggregate_lock:
+        if aggregate['tag'] == tag:
+            return aggregate['snapshot']
+
+    body = b"".join([
+        b'{"servers":[', b",".join(snap.body for snap in snaps),
+        b'],"unavailable":', json.dumps(unavailable).encode("utf-8"), b'}'])
+    snap = Snapshot(None, body)
+    with aggregate_lock:
+        aggregate['tag'] = tag
+        aggregate['snapshot'] = snap
+    return snap
+
+slowlog = SlowLog(options.trace_log, options.trace_threshold, options.trace_sample) if options.trace_log else None
+
+@app.before_request
+def startTimer():
+    g.started = monotonic()
+    if options.server_timing or slowlog is not None:
+        g.trace, g.trace_token = startTrace()
+
+@app.after_request
+def finishTrace(response):
+    trace = g.get('trace')
+    if trace is not None:
+        if options.server_timing:
+            response.headers['Server-Timing'] = trace.serverTiming()
+        if slowlog is not None:
+            slowlog.maybeLog(trace, endpoint=request.endpoint, path=request.full_path, status=response.status_code)
+    return response
+
+@app.teardown_request
+def endRequestTrace(err):
+    token = g.pop('trace_token', None)
+    if token is not None:
+        endTrace(token)
+
+@app.after_request
+def observeRequest(response):
+    endpoint = request.endpoint or 'none'
+    http_requests.inc((endpoint, response.status_code))
+    http_seconds.observe((endpoint,), monotonic() - g.started)
+    if response.content_length is not None:
+        http_bytes.observe((endpoint,), response.content_length)
+    return response
+
+@app.before_request
+def startDeadline():
+    # event streams run for as long as the client stays
+    if options.request_deadline > 0 and request.endpoint != 'getEvents':
+        g.deadline = setDeadline(options.request_deadline)
+
+@app.teardown_request
+def endDeadline(err):
+    token = g.pop('deadline', None)
+    if token is not None:
+        resetDeadline(token)
+
+@app.errorhandler(DeadlineExceeded)
+def gatewayTimeout(err):
+    response = jsonify(error=str(err))
+    response.status_code = 504
+    return response
+
+def getTreeSnapshot(srv_id):
+    """ The server's current tree, or the last good one if it can't be fetched.
+
+        Stale trees, including expired ones served while a fresh one is being
+        fetched, are marked with Age and Warning headers by markStale.
+    """
+    try:
+        snap = trees.get(srv_id)
+    except Exception as err:
+        if isMissingServer(err):
+            # stopped or deleted, so its last tree must not be served anymore
+            trees.invalidate(srv_id)
+            raise UnknownServer(str(err)) from err
+        snap = trees.peek(srv_id)
+        if snap is not None:
+            g.stale = snap
+            return snap
+        if isTimeoutError(err):
+            raise DeadlineExceeded(str(err)) from err
+        raise
+    if snap.age > trees.ttl:
+        g.stale = snap
+    return snap
+
+@app.after_request
+def markStale(response):
+    snap = g.get('stale')
+    if snap is not None:
+        response.headers['Age'] = str(int(snap.age))
+        response.headers['Warning'] = '110 - "Response is Stale"'
+    return response
+
+@app.errorhandler(UnknownServer)
+def unknownServer(err):
+    response = jsonify(error=str(err))
+    response.status_code = 404
+    return response
+
+@app.errorhandler(Exception)
+def ctlError(err):
+    """ Errors from Murmur that escaped a route: timed out calls (e.g. ones
+        shortened to the request's remaining budget) get a 504, missing
+        servers a 404, anything else the usual 500.
+    """
+    if isinstance(err, HTTPException):
+        return err
+    if isTimeoutError(err):
+        return gatewayTimeout(err)
+    if isMissingServer(err):
+        return unknownServer(err)
+    raise err
+
+@app.errorhandler(CircuitOpen)
+@app.errorhandler(NotConnected)
+def circuitOpen(err):
+    response = jsonify(error=str(err))
+    response.status_code = 503
+    response.headers['Retry-After'] = str(int(err.retry_after) + 1)
+    return response
+
+def getFields(name, known):
+    """ Parse a comma separated field list from the query string. """
+    value = request.args.get(name)
+    if value is None:
+        return known
+    return [field for field in value.split(',') if field]
+
 @app.route('/<int:srv_id>', methods=['GET'])
 @support_jsonp
 def getTree(srv_id):
-    name = ctl.getConf(srv_id, "registername")
-    tree = ctl.getTree(srv_id)
+    """ The server's tree. ?channel_fields= and ?user_fields= select the fields
+        to include, ?depth= limits how many levels of subchannels are included
+        and ?root= starts the tree at another channel.
+    """
+    try:
+        encoder = getEncoder(getFields('channel_fields', CHANNEL_FIELDS),
+                             getFields('user_fields', USER_FIELDS),
+                             request.args.get('depth', type=int))
+    except ValueError as err:
+        abort(400, str(err))
 
-    serv = {
-        'x_connecturl': os.environ.get('MURMUR_CONNECT_URL'),
-        'id':   srv_id,
-        'name': name,
-        'root': getChannel(tree)
-        }
-    return jsonify(serv)
+    snap = getTreeSnapshot(srv_id)
+    try:
+        return snapshotResponse(snap.projection(encoder, request.args.get('root', type=int)))
+    except KeyError:
+        abort(404)
 
 @app.route('/')
 def getServers():
-    return jsonify(servers=ctl.getBootedServers())
+    return snapshotResponse(servers.get(None))
+
+@app.route('/<int:srv_id>/events')
+def getEvents(srv_id):
+    """ Server-Sent Events: the full tree first, then one event per change to
+        a channel or user, named after Murmur's ServerCallback methods.
+    """
+    sub = events.subscribe(srv_id)
+
+    def stream():
+        try:
+            while True:
+                try:
+                    message = sub.next(SSE_KEEPALIVE)
+                except EOFError:
+                    yield sseMessage("evicted", b"{}")
+                    return
+                if message is None:
+                    message = b": keepalive\n\n"
+                yield message
+        finally:
+            events.unsubscribe(srv_id, sub)
+
+    response = current_app.response_class(stream(), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+@app.route('/<int:srv_id>/delta')
+@support_jsonp
+def getDelta(srv_id):
+    """ Changes since the tree version given in ?since=, or the full tree
+        (with "full": true) if that version is unknown or no longer kept.
+    """
+    snap = getTreeSnapshot(srv_id)
+    since = request.args.get('since', type=int)
+
+    if since not in snap.deltas:
+        delta = history.since(srv_id, since, snap) if since is not None else None
+        if delta is not None:
+            delta.update(full=False, since=since, version=snap.version)
+            body = json.dumps(delta, sort_keys=True, separators=(',', ':')).encode("utf-8")
+            snap.deltas[since] = Snapshot(None, body)
+        else:
+            # all full answers share one entry, so unknown versions can't pile up
+            since = None
+            if since not in snap.deltas:
+                body = b"".join([b'{"full":true,"tree":', snap.body,
+                                 b',"version":', str(snap.version).encode("ascii"), b'}'])
+                snap.deltas[since] = Snapshot(None, body)
+
+    return snapshotResponse(snap.deltas[since])
+
+def lookupResponse(data):
+    """ Serve a small document built from a tree's indexes. """
+    return snapshotResponse(Snapshot(data))
+
+def getUserInfo(snap, user):
+    return {'user': snap.encoder.user.asDict(user), 'path': snap.index.pathNames(user.channel)}
+
+@app.route('/<int:srv_id>/channel/<int:channel_id>')
+@support_jsonp
+def getChannelInfo(srv_id, channel_id):
+    """ One channel with its users, the IDs of its subchannels and the path to it. """
+    snap = getTreeSnapshot(srv_id)
+    node = snap.index.channels.get(channel_id)
+    if node is None:
+        abort(404)
+    return lookupResponse({
+        'channel':     snap.encoder.channel.asDict(node.c),
+        'path':        snap.index.pathNames(channel_id),
+        'subchannels': [child.c.id for child in node.children],
+        'users':       [snap.encoder.user.asDict(user) for user in node.users],
+        'x_version':   snap.version,
+        })
+
+@app.route('/<int:srv_id>/user/<int:session>')
+@support_jsonp
+def getUserBySession(srv_id, session):
+    """ One online user and the path to their channel. """
+    snap = getTreeSnapshot(srv_id)
+    user = snap.index.users.get(session)
+    if user is None:
+        abort(404)
+    info = getUserInfo(snap, user)
+    info['x_version'] = snap.version
+    return lookupResponse(info)
+
+@app.route('/<int:srv_id>/user')
+@support_jsonp
+def getUsersByName(srv_id):
+    """ Online users named ?name=, ignoring case. """
+    name = request.args.get('name')
+    if not name:
+        abort(400, "The name parameter is required.")
+    snap = getTreeSnapshot(srv_id)
+    return lookupResponse({
+        'users':     [getUserInfo(snap, user) for user in snap.index.usersNamed(name)],
+        'x_version': snap.version,
+        })
+
+def fetchTexture(srv_id, userid):
+    try:
+        # 1.2.3+ hand out the image file as stored; older versions a PIL image.
+        # Ask the connected ctl, as the managed one connects on any attribute.
+        if hasattr(ctl.getCtl(), 'getRawTexture'):
+            return ctl.getRawTexture(srv_id, userid)
+        return ctl.getTexture(srv_id, userid)
+    except Exception as err:
+        # unknown or unregistered users are cached as having no texture
+        if type(err).__name__ == 'InvalidUserException':
+            raise ValueError(err)
+        raise
+
+def loadTexture(srv_id, userid):
+    return breaker.call(srv_id, fetchTexture, srv_id, userid)
+
+@app.route('/<int:srv_id>/texture/<int:userid>')
+def getTexture(srv_id, userid):
+    """ A registered user's texture (avatar) as PNG, or as WebP if the client prefers it. """
+    accept = request.accept_mimetypes
+    if accept.quality('image/webp') > accept.quality('image/png') and canEncode('webp'):
+        fmt = 'webp'
+    else:
+        fmt = 'png'
+
+    for attempt in range(2):
+        try:
+            path, etag = textures.get(srv_id, userid, fmt, lambda: loadTexture(srv_id, userid))
+        except ValueError:
+            abort(404)
+        try:
+            response = send_file(path, mimetype=MIMETYPES[fmt], etag=etag, max_age=TEXTURE_MAX_AGE, conditional=True)
+        except FileNotFoundError:
+            # evicted in the meantime, fetch it once more
+            textures.invalidate(srv_id, userid)
+            continue
+        response.vary.add('Accept')
+        return response
+    abort(404)
+
+@app.route('/all')
+@support_jsonp
+def getAllTrees():
+    """ Trees of all booted servers in one document. Servers whose tree could
+        not be fetched in time are listed in "unavailable" instead.
+    """
+    srv_ids = servers.get(None).data['servers']
+    # the workers inherit the request's deadline
+    pending = [(srv_id, fetcher.submit(contextvars.copy_context().run, trees.get, srv_id)) for srv_id in srv_ids]
+    left = timeLeft()
+    wait([future for (srv_id, future) in pending],
+         timeout=options.fetch_timeout if left is None else min(options.fetch_timeout, left))
+
+    snaps = []
+    unavailable = []
+    for srv_id, future in pending:
+        if future.done() and future.exception() is None:
+            snaps.append(future.result())
+        else:
+            future.cancel()
+            unavailable.append(srv_id)
+
+    return snapshotResponse(joinSnapshots(snaps, unavailable))
+
+@app.route('/search')
+@support_jsonp
+def searchUsers():
+    """ Online users on all booted servers whose name starts with ?q=, ignoring case. """
+    query = request.args.get('q')
+    if not query:
+        abort(400, "The q parameter is required.")
+    limit = min(request.args.get('limit', SEARCH_MAX_RESULTS, type=int), SEARCH_MAX_RESULTS)
+    results = search.search(query, limit)
+    return lookupResponse({
+        'users': [{'server': srv_id, 'session': session, 'name': name, 'userid': userid, 'path': list(path)}
+                  for (lowername, srv_id, session, name, userid, path) in results],
+        })
+
+@app.route('/ready')
+def getReady():
+    """ Readiness check: 200 once connected to Murmur, 503 until then. """
+    if ctl.connected:
+        return jsonify(ready=True)
+    response = jsonify(ready=False, error=str(ctl.error) if ctl.error is not None else None)
+    response.status_code = 503
+    return response
+
+@app.route('/metrics')
+def getMetrics():
+    """ Metrics in the Prometheus text format. """
+    return current_app.response_class(metrics.render(), content_type=CONTENT_TYPE)
+
+@app.route('/stats')
+def getStats():
+    return jsonify(cache=trees.stats(), servers_cache=servers.stats(), subscribers=events.stats(),
+                   textures=textures.stats(), search=search.stats(), breaker=breaker.stats())
 
 if __name__ == '__main__':
     app.run(host=options.host, port=options.port, debug=options.debug)
@@ -16,12 +16,8 @@
  *  GNU General Public License for more details.
 """
 
-from PIL    import Image
-from struct    import pack, unpack
-from zlib    import compress, decompress
-
 from .mctl import MumbleCtlBase
-from .utils import ObjectInfo
+from .utils import ObjectInfo, ChannelInfo, PlayerInfo, RegistrationInfo, ACLInfo
 
 import dbus
 from dbus.exceptions import DBusException
@@ -47,6 +43,13 @@ class MumbleCtlDbus_118(MumbleCtlBase):
         self.dbus_base = connstring
         self.meta = meta
 
+    def isConnectionError( self, err ):
+        return isinstance( err, DBusException ) and err.get_dbus_name() in (
+            'org.freedesktop.DBus.Error.ServiceUnknown',
+            'org.freedesktop.DBus.Error.NoReply',
+            'org.freedesktop.DBus.Error.Disconnected',
+            )
+
     def _getDbusMeta( self ):
         return self.meta
 
@@ -126,7 +129,7 @@ class MumbleCtlDbus_118(MumbleCtlBase):
         ret = {}
 
         for channel in chans:
-            ret[channel[0]] = ObjectInfo(
+            ret[channel[0]] = ChannelInfo(
                 id=int(channel[0]),
                 name=str(channel[1]),
                 parent=int(channel[2]),
@@ -141,7 +144,7 @@ class MumbleCtlDbus_118(MumbleCtlBase):
         ret = {}
 
         for playerObj in players:
-            ret[int(playerObj[0])] = ObjectInfo(
+            ret[int(playerObj[0])] = PlayerInfo(
                 session=int(playerObj[0]),
                 mute=bool(playerObj[1]),
                 deaf=bool(playerObj[2]),
@@ -162,7 +165,7 @@ class MumbleCtlDbus_118(MumbleCtlBase):
         ret = {}
 
         for user in users:
-            ret[int(user[0])] = ObjectInfo(
+            ret[int(user[0])] = RegistrationInfo(
                 userid=int(user[0]),
                 name=str(user[1]),
                 email=str(user[2]),
@@ -174,7 +177,7 @@ class MumbleCtlDbus_118(MumbleCtlBase):
     def getACL(self, srvid, channelid):
         raw_acls, raw_groups, raw_inherit = self._getDbusServerObject(srvid).getACL(channelid)
 
-        acls = [ObjectInfo(
+        acls = [ACLInfo(
                 applyHere=bool(rule[0]),
                 applySubs=bool(rule[1]),
                 inherited=bool(rule[2]),
@@ -201,7 +204,7 @@ class MumbleCtlDbus_118(MumbleCtlBase):
         return acls, groups, bool(raw_inherit)
 
     def setACL(self, srvid, channelid, acls, groups, inherit):
-        # Pack acl ObjectInfo into a tuple and send that over dbus
+        # Pack acl rules into a tuple and send that over dbus
         dbus_acls = [
             ( rule.applyHere, rule.applySubs, rule.inherited, rule.userid, rule.group, rule.allow, rule.deny )
             for rule in acls
@@ -225,7 +228,7 @@ class MumbleCtlDbus_118(MumbleCtlBase):
 
     def getRegistration(self, srvid, mumbleid):
         user = self._getDbusServerObject(srvid).getRegistration(dbus.Int32(mumbleid))
-        return ObjectInfo(
+        return RegistrationInfo(
             userid=mumbleid,
             name=str(user[1]),
             email=str(user[2]),
@@ -238,41 +241,21 @@ class MumbleCtlDbus_118(MumbleCtlBase):
             )
 
     def getTexture(self, srvid, mumbleid):
+        from .texture import decodeTexture, qUncompress
         texture = self._getDbusServerObject(srvid).getTexture(dbus.Int32(mumbleid))
 
         if len(texture) == 0:
             raise ValueError( "No Texture has been set." )
         # this returns a list of bytes.
         # first 4 bytes: Length of uncompressed string, rest: compressed data
-        orig_len = ( texture[0] << 24 ) | ( texture[1] << 16 ) | ( texture[2] << 8 ) | ( texture[3] )
-        # convert rest to bytes and run decompress
-        bytestr = b""
-        for byte in texture[4:]:
-            bytestr += pack( "B", int(byte) )
-        decompressed = decompress( bytestr )
-        # iterate over 4 byte chunks of the decompressed data
-        imgdata = b""
-        for idx in range( 0, orig_len, 4 ):
-            # read 4 bytes = BGRA and convert to RGBA
-            bgra = unpack( "4B", decompressed[idx:idx+4] )
-            imgdata += pack( "4B", bgra[2], bgra[1], bgra[0], bgra[3] )
-        # return an 600x60 RGBA image object created from the data
-        return Image.frombytes("RGBA", (600, 60), imgdata)
+        decompressed = qUncompress( bytes( texture ) )
+        # return an 600x60 RGBA image object created from the BGRA data
+        return decodeTexture( decompressed )
 
     def setTexture(self, srvid, mumbleid, infile):
-        # open image, convert to RGBA, and resize to 600x60
-        img = infile.convert("RGBA").transform((600, 60), Image.EXTENT, (0, 0, 600, 60))
-        # iterate over the list and pack everything into bytes
-        bgrastring = b""
-        for ent in img.getdata():
-            # ent is in RGBA format, but Murmur wants BGRA (ARGB inverse), so stuff needs
-            # to be reordered when passed to pack()
-            bgrastring += pack("4B", ent[2], ent[1], ent[0], ent[3])
-        # compress using zlib
-        compressed = compress( bgrastring )
-        # pack the original length in 4 byte big endian, and concat the compressed
-        # data to it to emulate qCompress().
-        texture = pack(">L", len(bgrastring)) + compressed
+        from .texture import encodeTexture, qCompress
+        # convert to 600x60 BGRA and compress like qCompress().
+        texture = qCompress( encodeTexture( infile ) )
         # finally call murmur and set the texture
         self._getDbusServerObject(srvid).setTexture(dbus.Int32(mumbleid), texture)
 
@@ -16,24 +16,21 @@
  *  GNU General Public License for more details.
 """
 
-from time        import time
+from time        import time, monotonic
 from functools   import wraps
 from io          import BytesIO
 from os.path     import exists, join
 from os          import unlink, name as os_name
-from PIL         import Image
-from struct      import pack, unpack
-from zlib        import compress, decompress, error
 
-from .mctl import MumbleCtlBase
+from .mctl import MumbleCtlBase, UnknownServer, timeLeft, callObservers, observeCall
 
-from .utils import ObjectInfo
+from .utils import PlayerInfo, RegistrationInfo, ACLInfo
 
-import Ice, IcePy, tempfile
+import Ice, IcePy, threading, contextvars
 
 
-def loadSlice( slicefile ):
-    """ Load the slice file with the correct include dir set, if possible. """
+def getSliceIncludePath():
+    """ Find the directory containing Ice's own slice files, or return None. """
     if hasattr( Ice, "getSliceDir" ):
         icepath = Ice.getSliceDir()
     else:
@@ -51,6 +48,22 @@ def loadSlice( slicefile ):
             if not exists( join( icepath, "Ice", "SliceChecksumDict.ice" ) ):
                 icepath = None
 
+    return icepath or None
+
+
+def loadSlice( slicefile ):
+    """ Load the slice file with the correct include dir set, if possible.
+
+        Code generated earlier for the same slice is loaded from the slice
+        cache instead of compiling the slice again.
+    """
+    from . import slicecache
+
+    icepath = getSliceIncludePath()
+
+    if slicecache.load( slicefile, icepath ):
+        return
+
     if not icepath:
         # last resort when getSliceDir fails AND settings are wrong/unavailable, won't work for >=1.2.3
         Ice.loadSlice( slicefile )
@@ -58,6 +71,15 @@ def loadSlice( slicefile ):
         Ice.loadSlice( '', ['-I' + icepath, slicefile ] )
 
 
+def isStaleProxyError( err ):
+    """ Check if an error means that cached Server proxies may be outdated. """
+    return type(err).__name__ in ( "ServerBootedException", "ObjectNotExistException" )
+
+
+# set while an observed ctl call runs
+_inCall = contextvars.ContextVar( "mumble_in_ctl_call", default=False )
+
+
 def protectDjangoErrPage( func ):
     """ Catch and reraise Ice exceptions to prevent the Django page from failing.
 
@@ -67,25 +89,129 @@ def protectDjangoErrPage( func ):
         non-existant files and borking.
     """
 
+    # only public methods called from outside of the ctl are observed, so a
+    # call is counted once, not once more for every decorated method it uses
+    observed = not func.__name__.startswith( "_" )
+
     @wraps(func)
     def protection_wrapper(self, *args, **kwargs):
         """ Call the original function and catch Ice exceptions. """
+        started = None
+        if observed and callObservers and not _inCall.get():
+            started = monotonic()
+            token = _inCall.set( True )
         try:
-            return func( self, *args, **kwargs )
-        except Ice.Exception as err:
+            result = func( self, *args, **kwargs )
+        except Exception as err:
+            if started is not None:
+                observeCall( func.__name__, monotonic() - started, err )
+            # the first argument of server operations is the server ID
+            if args and isinstance( err, Ice.Exception ) and isStaleProxyError( err ) and hasattr( self, "_forgetIceServerObjects" ):
+                self._forgetIceServerObjects( args[0] )
             raise err
+        finally:
+            if started is not None:
+                _inCall.reset( token )
+        if started is not None:
+            if hasattr( result, "add_done_callback" ):
+                ctx = contextvars.copy_context()
+                result.add_done_callback( lambda fut: ctx.run( _observeFuture, func.__name__, started, fut ) )
+            else:
+                observeCall( func.__name__, monotonic() - started, None )
+        return result
     protection_wrapper.innerfunc = func
 
     return protection_wrapper
 
 
+def _observeFuture( method, started, future ):
+    try:
+        future.result()
+    except Exception as err:
+        observeCall( method, monotonic() - started, err )
+    else:
+        observeCall( method, monotonic() - started, None )
+
+
+def _completed( func, *args ):
+    """ Call func right away and return its outcome as a finished Ice.Future. """
+    future = Ice.Future()
+    try:
+        future.set_result( func( *args ) )
+    except Exception as err:
+        future.set_exception( err )
+    return future
+
+
+def _forward( source, target ):
+    """ Copy the outcome of the finished future `source` to `target`. """
+    try:
+        target.set_result( source.result() )
+    except Exception as err:
+        target.set_exception( err )
+
+
+def _chain( future, func ):
+    """ Return an Ice.Future for func(result of `future`).
+
+        func may return a plain value or another future, in which case the
+        returned future completes when that one does.
+    """
+    chained = Ice.Future()
+
+    def on_done( fut ):
+        try:
+            result = func( fut.result() )
+        except Exception as err:
+            chained.set_exception( err )
+            return
+        if hasattr( result, "add_done_callback" ):
+            result.add_done_callback( lambda nxt: _forward( nxt, chained ) )
+        else:
+            chained.set_result( result )
+
+    future.add_done_callback( on_done )
+    return chained
+
+
+def _gather( futures ):
+    """ Return an Ice.Future for the list of results of all `futures`. """
+    futures  = list(futures)
+    gathered = Ice.Future()
+    if not futures:
+        gathered.set_result( [] )
+        return gathered
+
+    results   = [None] * len(futures)
+    remaining = [len(futures)]
+    lock      = threading.Lock()
+
+    def on_done( idx, fut ):
+        try:
+            results[idx] = fut.result()
+        except Exception as err:
+            if not gathered.done():
+                gathered.set_exception( err )
+            return
+        with lock:
+            remaining[0] -= 1
+            finished = remaining[0] == 0
+        if finished:
+            gathered.set_result( results )
+
+    for idx, fut in enumerate(futures):
+        fut.add_done_callback( lambda fut, idx=idx: on_done( idx, fut ) )
+    return gathered
+
+
 @protectDjangoErrPage
-def MumbleCtlIce( connstring, slicefile=None, icesecret=None ):
+def MumbleCtlIce( connstring, slicefile=None, icesecret=None, timeouts=None ):
     """ Choose the correct Ice handler to use (1.1.8 or 1.2.x), and make sure the
         Murmur version matches the slice Version.
 
-        Optional parameters are the path to the slice file and the Ice secret
-        necessary to authenticate to Murmur.
+        Optional parameters are the path to the slice file, the Ice secret
+        necessary to authenticate to Murmur and the invocation timeouts in
+        seconds by operation name, see MumbleCtlIce_118._timeout.
 
         The path can be omitted only if running Murmur 1.2.3 or later, which
         exports a getSlice method to retrieve the Slice from.
@@ -94,6 +220,8 @@ def MumbleCtlIce( connstring, slicefile=None, icesecret=None ):
     prop = Ice.createProperties([])
     prop.setProperty("Ice.ImplicitContext", "Shared")
     prop.setProperty("Ice.MessageSizeMax",  "65535")
+    if timeouts and timeouts.get("default"):
+        prop.setProperty("Ice.Default.InvocationTimeout", str(int(timeouts["default"] * 1000)))
 
     idd = Ice.InitializationData()
     idd.properties = prop
@@ -112,6 +240,12 @@ def MumbleCtlIce( connstring, slicefile=None, icesecret=None ):
     except Ice.Exception:
         raise EnvironmentError( "Murmur does not appear to be listening on this address (Ice ping failed)." )
 
+    if slicefile:
+        # code compiled ahead of time for the configured slice (see slicecache)
+        # spares us the getSlice round trip and compiling Murmur's copy.
+        from . import slicecache
+        slicecache.lookup( slicefile )
+
     try:
         import MumbleServer
     except ImportError:
@@ -140,6 +274,7 @@ def MumbleCtlIce( connstring, slicefile=None, icesecret=None ):
             except RuntimeError:
                 raise RuntimeError( "Slice preprocessing failed. Please check your server's error log." )
         else:
+            import tempfile
             if os_name == "nt":
                 # It weren't Windows if it didn't need to be treated differently. *sigh*
                 temppath = join( tempfile.gettempdir(), "MumbleServer.ice" )
@@ -172,31 +307,98 @@ def MumbleCtlIce( connstring, slicefile=None, icesecret=None ):
     murmurversion = meta.getVersion()[:3]
 
     if murmurversion >= (1, 5, 0):
-        return MumbleCtlIce_150(connstring, meta)
+        return MumbleCtlIce_150(connstring, meta, timeouts)
     elif murmurversion == (1, 1, 8):
-        return MumbleCtlIce_118( connstring, meta )
+        return MumbleCtlIce_118( connstring, meta, timeouts )
     elif ((murmurversion[0] == 1) and (murmurversion[1] >= 3)):
-        return MumbleCtlIce_123( connstring, meta )
+        return MumbleCtlIce_123( connstring, meta, timeouts )
     raise NotImplementedError( "No ctl object available for Murmur version %d.%d.%d" % tuple(murmurversion) )
 
 
 class MumbleCtlIce_118(MumbleCtlBase):
     method = "ICE"
 
-    def __init__( self, connstring, meta ):
+    def __init__( self, connstring, meta, timeouts=None ):
         self.proxy  = connstring
         self.meta   = meta
+        self.timeouts = timeouts or {}
+        self._servers = {}
+
+    def isConnectionError(self, err):
+        # an invocation timeout only means Murmur was slow to answer that call
+        if isinstance( err, Ice.InvocationTimeoutException ):
+            return False
+        return isinstance( err, ( Ice.SocketException, Ice.TimeoutException, Ice.CommunicatorDestroyedException ) )
+
+    def _timeout(self, operation):
+        """ The invocation timeout for `operation` in milliseconds (-1 for none),
+            shortened to what is left of the current deadline (see mctl.setDeadline).
+
+            Async callbacks run outside of the request's context, so this has to
+            be called before the call is chained.
+        """
+        timeout = self.timeouts.get( operation, self.timeouts.get( "default" ) )
+        left = timeLeft()
+        if left is not None:
+            timeout = left if timeout is None else min( timeout, left )
+        if timeout is None:
+            return -1
+        return max( 1, int( timeout * 1000 ) )
+
+    def _timed(self, prx, operation):
+        """ Return the proxy with the invocation timeout for `operation`. """
+        return prx.ice_invocationTimeout( self._timeout( operation ) )
+
+    def close(self):
+        self.meta.ice_getCommunicator().destroy()
 
     @protectDjangoErrPage
     def _getIceServerObject(self, srvid):
-        return self.meta.getServer(srvid)
+        srv = self._servers.get(srvid)
+        if srv is None:
+            srv = self._cacheIceServerObject( srvid, self._timed( self.meta, "getServer" ).getServer(srvid) )
+        return srv
+
+    def _getIceServerObjectAsync(self, srvid):
+        if srvid in self._servers:
+            return _completed( self._getIceServerObject, srvid )
+        return _chain( self._timed( self.meta, "getServer" ).getServerAsync(srvid),
+                       lambda srv: self._cacheIceServerObject( srvid, srv ) )
+
+    def _cacheIceServerObject(self, srvid, srv):
+        if srv is None:
+            raise UnknownServer( "Murmur has no server with ID %s." % srvid )
+        self._servers[srvid] = srv
+        return srv
+
+    def _forgetIceServerObjects(self, srvid=None):
+        """ Drop cached Server proxies, so the next call asks Meta again. """
+        if srvid is None:
+            self._servers = {}
+        else:
+            self._servers.pop(srvid, None)
+
+    def _watch(self, srvid, future):
+        """ Forget the server's cached proxy if an asynchronous call fails because of it. """
+        def on_done(fut):
+            try:
+                fut.result()
+            except Ice.Exception as err:
+                if isStaleProxyError( err ):
+                    self._forgetIceServerObjects( srvid )
+        future.add_done_callback( on_done )
+        return future
 
     @protectDjangoErrPage
     def getBootedServers(self):
-        ret = []
-        for x in self.meta.getBootedServers():
-            ret.append(x.id())
-        return ret
+        return self.getBootedServersAsync().result()
+
+    @protectDjangoErrPage
+    def getBootedServersAsync(self):
+        """ Fetch the IDs of all booted servers, asking each of them in parallel. """
+        timeout = self._timeout( "getBootedServers" )
+        return _chain( self.meta.ice_invocationTimeout( timeout ).getBootedServersAsync(),
+            lambda servers: _gather( [ x.ice_invocationTimeout( timeout ).idAsync() for x in servers ] ) )
 
     @protectDjangoErrPage
     def getVersion( self ):
@@ -204,10 +406,8 @@ class MumbleCtlIce_118(MumbleCtlBase):
 
     @protectDjangoErrPage
     def getAllServers(self):
-        ret = []
-        for x in self.meta.getAllServers():
-            ret.append(x.id())
-        return ret
+        return _chain( self.meta.getAllServersAsync(),
+            lambda servers: _gather( [ x.idAsync() for x in servers ] ) ).result()
 
     @protectDjangoErrPage
     def getRegisteredPlayers(self, srvid, filter = ''):
@@ -215,7 +415,7 @@ class MumbleCtlIce_118(MumbleCtlBase):
         ret = {}
 
         for user in users:
-            ret[user.playerid] = ObjectInfo(
+            ret[user.playerid] = RegistrationInfo(
                 userid =     int( user.playerid ),
                 name   = user.name.decode( "utf8" ),
                 email  = user.email.decode( "utf8" ),
@@ -230,7 +430,13 @@ class MumbleCtlIce_118(MumbleCtlBase):
 
     @protectDjangoErrPage
     def getTree(self, srvid):
-        return self._getIceServerObject(srvid).getTree()
+        return self._timed( self._getIceServerObject(srvid), "getTree" ).getTree()
+
+    @protectDjangoErrPage
+    def getTreeAsync(self, srvid):
+        timeout = self._timeout( "getTree" )
+        return self._watch( srvid, _chain( self._getIceServerObjectAsync(srvid),
+                                    lambda srv: srv.ice_invocationTimeout( timeout ).getTreeAsync() ) )
 
     @protectDjangoErrPage
     def getPlayers(self, srvid):
@@ -240,7 +446,7 @@ class MumbleCtlIce_118(MumbleCtlBase):
 
         for useridx in users:
             user = users[useridx]
-            ret[ user.session ] = ObjectInfo(
+            ret[ user.session ] = PlayerInfo(
                 session      = user.session,
                 userid       = user.playerid,
                 mute         = user.mute,
@@ -293,6 +499,7 @@ class MumbleCtlIce_118(MumbleCtlBase):
         if self._getIceServerObject(srvid).isRunning():
             self._getIceServerObject(srvid).stop()
         self._getIceServerObject(srvid).delete()
+        self._forgetIceServerObjects(srvid)
 
     @protectDjangoErrPage
     def setSuperUserPassword(self, srvid, value):
@@ -303,7 +510,16 @@ class MumbleCtlIce_118(MumbleCtlBase):
         if key == "username":
             key = "playername"
 
-        return self._getIceServerObject(srvid).getConf( key )
+        return self._timed( self._getIceServerObject(srvid), "getConf" ).getConf( key )
+
+    @protectDjangoErrPage
+    def getConfAsync(self, srvid, key):
+        if key == "username":
+            key = "playername"
+
+        timeout = self._timeout( "getConf" )
+        return self._watch( srvid, _chain( self._getIceServerObjectAsync(srvid),
+                                    lambda srv: srv.ice_invocationTimeout( timeout ).getConfAsync( key ) ) )
 
     @protectDjangoErrPage
     def setConf(self, srvid, key, value):
@@ -326,7 +542,7 @@ class MumbleCtlIce_118(MumbleCtlBase):
     @protectDjangoErrPage
     def getRegistration(self, srvid, mumbleid):
         user = self._getIceServerObject(srvid).getRegistration(mumbleid)
-        return ObjectInfo(
+        return RegistrationInfo(
             userid = mumbleid,
             name   = user.name,
             email  = user.email,
@@ -349,7 +565,7 @@ class MumbleCtlIce_118(MumbleCtlBase):
         # need to convert acls to say "userid" instead of "playerid". meh.
         raw_acls, raw_groups, raw_inherit = self._getIceServerObject(srvid).getACL(channelid)
 
-        acls =  [ ObjectInfo(
+        acls =  [ ACLInfo(
                 applyHere = rule.applyHere,
                 applySubs = rule.applySubs,
                 inherited = rule.inherited,
@@ -384,7 +600,9 @@ class MumbleCtlIce_118(MumbleCtlBase):
 
     @protectDjangoErrPage
     def getTexture(self, srvid, mumbleid):
-        texture = self._getIceServerObject(srvid).getTexture(mumbleid)
+        from zlib     import decompress, error
+        from .texture import decodeTexture
+        texture = self._timed( self._getIceServerObject(srvid), "getTexture" ).getTexture(mumbleid)
         if len(texture) == 0:
             raise ValueError( "No Texture has been set." )
         # this returns a list of bytes.
@@ -392,33 +610,16 @@ class MumbleCtlIce_118(MumbleCtlBase):
             decompressed = decompress(texture)
         except error as err:
             raise ValueError(err)
-        # iterate over 4 byte chunks of the string
-        imgdata = ""
-        for idx in range( 0, len(decompressed), 4 ):
-            # read 4 bytes = BGRA and convert to RGBA
-            # manual wrote getTexture returns "Textures are stored as zlib compress()ed 600x60 32-bit RGBA data."
-            # http://mumble.sourceforge.net/slice/Murmur/Server.html#getTexture
-            # but return values BGRA X(
-            bgra = unpack( "4B", decompressed[idx:idx+4] )
-            imgdata += pack( "4B",  bgra[2], bgra[1], bgra[0], bgra[3] )
-
-        # return a 600x60 RGBA image object created from the data
-        return Image.frombytes("RGBA", (600, 60), imgdata)
+        # manual wrote getTexture returns "Textures are stored as zlib compress()ed 600x60 32-bit RGBA data."
+        # http://mumble.sourceforge.net/slice/Murmur/Server.html#getTexture
+        # but return values BGRA X(
+        return decodeTexture( decompressed )
 
     @protectDjangoErrPage
     def setTexture(self, srvid, mumbleid, infile):
-        # open image, convert to RGBA, and resize to 600x60
-        img = infile.convert( "RGBA" ).transform( ( 600, 60 ), Image.EXTENT, ( 0, 0, 600, 60 ) )
-        # iterate over the list and pack everything into a string
-        # Python 3: use bytes for binary data
-        bgrastring = b""
-        for ent in img.getdata():
-            bgrastring += pack("4B", ent[2], ent[1], ent[0], ent[3])
-        # compress using zlib
-        compressed = compress( bgrastring )
-        # pack the original length in 4 byte big endian, and concat the compressed
-        # data to it to emulate qCompress().
-        texture = pack( ">L", len(bgrastring) ) + compressed
+        from .texture import encodeTexture, qCompress
+        # convert to 600x60 BGRA and compress like qCompress().
+        texture = qCompress( encodeTexture( infile ) )
         # finally call murmur and set the texture
         self._getIceServerObject(srvid).setTexture(mumbleid, texture)
 
@@ -509,13 +710,49 @@ class MumbleCtlIce_118(MumbleCtlBase):
 
 
 class MumbleCtlIce_120(MumbleCtlIce_118):
+    mirror = None
+
+    def _getSliceModule(self):
+        import Murmur
+        return Murmur
+
+    @protectDjangoErrPage
+    def enableTreeMirror(self, endpoint):
+        """ Answer getTree (and getConf) from an in-memory copy of each server's
+            tree, which Murmur keeps current through ServerCallback notifications.
+
+            `endpoint` is the Ice endpoint Murmur uses to reach us, e.g.
+            "tcp -h 172.17.0.3 -p 6503".
+        """
+        from .treemirror import TreeMirror
+        self.mirror = TreeMirror( self.meta, self._getSliceModule(), endpoint,
+                                  self._getIceServerObject, self._forgetIceServerObjects, self._timed )
+
+    def addTreeListener(self, func):
+        """ Call func(srvid, event, state) for every change the tree mirror is told about. """
+        if self.mirror is None:
+            raise NotImplementedError( "Tree listeners require enableTreeMirror()." )
+        self.mirror.addListener(func)
+
+    @protectDjangoErrPage
+    def getTree(self, srvid):
+        if self.mirror is not None:
+            return self.mirror.getTree(srvid)
+        return self._timed( self._getIceServerObject(srvid), "getTree" ).getTree()
+
+    @protectDjangoErrPage
+    def getTreeAsync(self, srvid):
+        if self.mirror is not None:
+            return _completed( self.mirror.getTree, srvid )
+        return MumbleCtlIce_118.getTreeAsync( self, srvid )
+
     @protectDjangoErrPage
     def getRegisteredPlayers(self, srvid, filter = ''):
         users = self._getIceServerObject( srvid ).getRegisteredUsers( filter.encode( "UTF-8" ) )
         ret = {}
 
         for id in users:
-            ret[id] = ObjectInfo(
+            ret[id] = RegistrationInfo(
                 userid = id,
                 name   = users[id].decode( "utf8" ),
                 email  = '',
@@ -560,7 +797,7 @@ class MumbleCtlIce_120(MumbleCtlIce_118):
     @protectDjangoErrPage
     def getRegistration(self, srvid, mumbleid):
         reg = self._getIceServerObject( srvid ).getRegistration( mumbleid )
-        user = ObjectInfo( userid=mumbleid, name="", email="", comment="", hash="", pw="" )
+        user = RegistrationInfo( userid=mumbleid, name="", email="", comment="", hash="", pw="" )
         import Murmur
         if Murmur.UserInfo.UserName    in reg: user.name    = reg[Murmur.UserInfo.UserName]
         if Murmur.UserInfo.UserEmail   in reg: user.email   = reg[Murmur.UserInfo.UserEmail]
@@ -597,13 +834,25 @@ class MumbleCtlIce_120(MumbleCtlIce_118):
 
     @protectDjangoErrPage
     def getConf(self, srvid, key):
-        return self._getIceServerObject(srvid).getConf( key )
+        if self.mirror is not None:
+            return self.mirror.getConf(srvid, key)
+        return self._timed( self._getIceServerObject(srvid), "getConf" ).getConf( key )
+
+    @protectDjangoErrPage
+    def getConfAsync(self, srvid, key):
+        if self.mirror is not None:
+            return _completed( self.mirror.getConf, srvid, key )
+        timeout = self._timeout( "getConf" )
+        return self._watch( srvid, _chain( self._getIceServerObjectAsync(srvid),
+                                    lambda srv: srv.ice_invocationTimeout( timeout ).getConfAsync( key ) ) )
 
     @protectDjangoErrPage
     def setConf(self, srvid, key, value):
         if value is None:
             value = ''
         self._getIceServerObject(srvid).setConf( key, value.encode( "UTF-8" ) )
+        if self.mirror is not None:
+            self.mirror.forgetConf(srvid)
 
     @protectDjangoErrPage
     def getACL(self, srvid, channelid):
@@ -690,14 +939,14 @@ class MumbleCtlIce_123(MumbleCtlIce_120):
 
     @protectDjangoErrPage
     def getRawTexture(self, srvid, mumbleid):
-        return self._getIceServerObject(srvid).getTexture(mumbleid)
+        return self._timed( self._getIceServerObject(srvid), "getTexture" ).getTexture(mumbleid)
 
     @protectDjangoErrPage
     def getTexture(self, srvid, mumbleid):
         texture = self.getRawTexture(srvid, mumbleid)
         if len(texture) == 0:
             raise ValueError("No Texture has been set.")
-        from io import BytesIO
+        from PIL import Image
         try:
             return Image.open(BytesIO(texture))
         except IOError as err:
@@ -717,15 +966,19 @@ class MumbleCtlIce_123(MumbleCtlIce_120):
 
 class MumbleCtlIce_150(MumbleCtlIce_120):
     """Mumble 1.5+ Ice interface support using MumbleServer slice."""
-    def __init__(self, connstring, meta):
-        super().__init__(connstring, meta)
+    def __init__(self, connstring, meta, timeouts=None):
+        super().__init__(connstring, meta, timeouts)
+
+    def _getSliceModule(self):
+        import MumbleServer
+        return MumbleServer
 
     @protectDjangoErrPage
     def getRegisteredPlayers(self, srvid, filter = ''):
         users = self._getIceServerObject(srvid).getRegisteredUsers(filter)
         ret = {}
         for id, name in users.items():
-            ret[id] = ObjectInfo(userid=id, name=name, email='', pw='')
+            ret[id] = RegistrationInfo(userid=id, name=name, email='', pw='')
         return ret
 
     @protectDjangoErrPage
@@ -733,7 +986,7 @@ class MumbleCtlIce_150(MumbleCtlIce_120):
         users = self._getIceServerObject(srvid).getUsers()
         ret = {}
         for session, user in users.items():
-            ret[session] = ObjectInfo(
+            ret[session] = PlayerInfo(
                 session=user.session,
                 userid=user.userid,
                 mute=user.mute,
@@ -766,7 +1019,7 @@ class MumbleCtlIce_150(MumbleCtlIce_120):
     def getRegistration(self, srvid, userid):
         import MumbleServer
         reg = self._getIceServerObject(srvid).getRegistration(userid)
-        user = ObjectInfo(userid=userid, name="", email="", comment="", hash="", pw="")
+        user = RegistrationInfo(userid=userid, name="", email="", comment="", hash="", pw="")
         if MumbleServer.UserInfo.UserName in reg:
             user.name = reg[MumbleServer.UserInfo.UserName]
         if MumbleServer.UserInfo.UserEmail in reg:
@@ -803,9 +1056,13 @@ class MumbleCtlIce_150(MumbleCtlIce_120):
     def setBans(self, srvid, bans):
         return self._getIceServerObject(srvid).setBans(bans)
 
+    @protectDjangoErrPage
+    def getRawTexture(self, srvid, userid):
+        return self._timed( self._getIceServerObject(srvid), "getTexture" ).getTexture(userid)
+
     @protectDjangoErrPage
     def getTexture(self, srvid, userid):
-        return self._getIceServerObject(srvid).getTexture(userid)
+        return self._timed( self._getIceServerObject(srvid), "getTexture" ).getTexture(userid)
 
     @protectDjangoErrPage
     def setTexture(self, srvid, userid, infile):
@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+# kate: space-indent on; indent-width 4; replace-tabs on;
+
+"""
+ *  Copyright © 2009-2010, Michael "Svedrin" Ziegler <diese-addy@funzt-halt.net>
+ *
+ *  Mumble-Django is free software; you can redistribute it and/or modify
+ *  it under the terms of the GNU General Public License as published by
+ *  the Free Software Foundation; either version 2 of the License, or
+ *  (at your option) any later version.
+ *
+ *  This package is distributed in the hope that it will be useful,
+ *  but WITHOUT ANY WARRANTY; without even the implied warranty of
+ *  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ *  GNU General Public License for more details.
+
+ Records what a live Murmur answers to getBootedServers, getTree and getConf
+ into a file, and plays it back without any I/O, so the HTTP and
+ serialization side of a CVP provider can be measured on its own.
+
+ Recordings are zlib-compressed pickles of plain dicts, lists and tuples, so
+ they can be loaded without Ice or DBus. Trees are stored as flat lists, see
+ plainTree. Use "replay:<path>" as connstring
+ to play one back.
+"""
+
+import pickle
+import zlib
+
+from .mctl  import MumbleCtlBase, UnknownServer
+from .utils import ObjectInfo
+
+FORMAT_VERSION = 2
+
+RECORDED_CONF = ( "registername", "host", "port", "welcometext", "users" )
+
+
+def plainRecord( obj ):
+    """ The fields of an Ice struct, ObjectInfo or SlottedInfo as a dict. """
+    if hasattr( obj, "_asdict" ):
+        return obj._asdict()
+    return dict( ( name, value ) for ( name, value ) in vars( obj ).items() if not name.startswith( "_" ) )
+
+
+def plainTree( tree ):
+    """ Turn a Tree (c, children, users) into a flat list of (channel, users,
+        position of the parent in the list) tuples, parents before children.
+
+        Flat, so neither walking the tree nor pickling it hits the recursion
+        limit for deep trees.
+    """
+    plain = []
+    stack = [ ( tree, -1 ) ]
+    while stack:
+        node, parent = stack.pop()
+        plain.append( ( plainRecord( node.c ), [ plainRecord( user ) for user in node.users ], parent ) )
+        position = len(plain) - 1
+        stack.extend( ( child, position ) for child in reversed( node.children ) )
+    return plain
+
+
+def buildTree( plain ):
+    """ Turn a list made by plainTree back into a Tree-like object. """
+    nodes = []
+    for channel, users, parent in plain:
+        node = ObjectInfo( c=ObjectInfo( **channel ), children=[], users=[ ObjectInfo( **user ) for user in users ] )
+        if parent >= 0:
+            nodes[parent].children.append( node )
+        nodes.append( node )
+    return nodes[0]
+
+
+def save( path, recording ):
+    with open( path, "wb" ) as fd:
+        fd.write( zlib.compress( pickle.dumps( recording, pickle.HIGHEST_PROTOCOL ), 9 ) )
+
+
+def load( path ):
+    with open( path, "rb" ) as fd:
+        recording = pickle.loads( zlib.decompress( fd.read() ) )
+    if recording.get( "format" ) != FORMAT_VERSION:
+        raise ValueError( "%s is not a recording this version can replay." % path )
+    return recording
+
+
+def record( ctl, path, conf=RECORDED_CONF ):
+    """ Record the booted servers of `ctl` with their trees and the given config keys. """
+    recording = { "format": FORMAT_VERSION, "servers": [], "trees": {}, "conf": {} }
+    for srvid in ctl.getBootedServers():
+        recording["servers"].append( srvid )
+        recording["trees"][srvid] = plainTree( ctl.getTree( srvid ) )
+        recording["conf"][srvid]  = dict( ( key, ctl.getConf( srvid, key ) ) for key in conf )
+    save( path, recording )
+    return recording
+
+
+class MumbleCtlReplay( MumbleCtlBase ):
+    """ Answers getBootedServers, getTree and getConf from a recording.
+
+        The trees are built once when the recording is loaded, and every
+        getTree call returns the same objects, so replaying costs nothing
+        but a dict lookup.
+    """
+
+    def __init__( self, path ):
+        recording    = load( path )
+        self.path    = path
+        self.servers = list( recording["servers"] )
+        self.conf    = recording["conf"]
+        self.trees   = dict( ( srvid, buildTree( tree ) ) for ( srvid, tree ) in recording["trees"].items() )
+
+    def getBootedServers( self ):
+        return list( self.servers )
+
+    def getAllServers( self ):
+        return list( self.servers )
+
+    def getTree( self, srvid ):
+        try:
+            return self.trees[srvid]
+        except KeyError:
+            raise UnknownServer( "Server %s is not in recording %s." % ( srvid, self.path ) )
+
+    def getConf( self, srvid, key ):
+        if srvid not in self.trees:
+            raise UnknownServer( "Server %s is not in recording %s." % ( srvid, self.path ) )
+        # Murmur answers unset keys with an empty string
+        return self.conf.get( srvid, {} ).get( key, "" )
+
+    def getTexture( self, srvid, mumbleid ):
+        raise ValueError( "Recordings have no textures." )
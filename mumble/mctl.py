@@ -17,43 +17,337 @@
 """
 
 import re
+import threading
+import contextvars
+
+from concurrent.futures import Future
+from functools          import wraps
+from time               import monotonic
+
+
+_deadline = contextvars.ContextVar( "mumble_deadline", default=None )
+
+
+class DeadlineExceeded( TimeoutError ):
+    """ Raised when the time budget set with setDeadline() has run out. """
+
+
+def setDeadline( seconds ):
+    """ Limit the Ice calls made in the current context to `seconds` from now.
+
+        An earlier deadline that is already in effect is kept. Returns a token
+        for resetDeadline(). To hand the deadline to another thread, run the
+        function there with contextvars.copy_context().run.
+    """
+    deadline = monotonic() + seconds
+    current  = _deadline.get()
+    if current is not None:
+        deadline = min( deadline, current )
+    return _deadline.set( deadline )
+
+
+def resetDeadline( token ):
+    _deadline.reset( token )
+
+
+def timeLeft():
+    """ Seconds left until the current deadline, or None if there is none.
+
+        Raises DeadlineExceeded if it has passed already.
+    """
+    deadline = _deadline.get()
+    if deadline is None:
+        return None
+    left = deadline - monotonic()
+    if left <= 0:
+        raise DeadlineExceeded( "The time budget for this request has run out." )
+    return left
+
+
+class NotConnected( EnvironmentError ):
+    """ Raised while there is no connection to Murmur, because it is being
+        set up or a failed attempt is waiting to be retried.
+
+        `retry_after` is the number of seconds after which trying again is
+        worthwhile.
+    """
+
+    def __init__( self, message, retry_after ):
+        EnvironmentError.__init__( self, message )
+        self.retry_after = retry_after
+
+
+class UnknownServer( LookupError ):
+    """ Raised for a server ID Murmur doesn't know. """
+
+
+def isMissingServer( err ):
+    """ Check if `err` means the server asked for doesn't exist or isn't running. """
+    return isinstance( err, UnknownServer ) or type(err).__name__ in ( "ServerBootedException", "InvalidServerException" )
+
+
+def isTimeoutError( err ):
+    """ Check if `err` means a call took longer than it was allowed to. """
+    return isinstance( err, DeadlineExceeded ) or type(err).__name__ == "InvocationTimeoutException"
+
+
+callObservers = []
+
+
+def addCallObserver( func ):
+    """ Call func(method, seconds, error) after every ctl call made through
+        protectDjangoErrPage. `error` is None if the call succeeded.
+
+        For calls returning a future, func is called when the future is done,
+        in a copy of the caller's context.
+    """
+    callObservers.append( func )
+
+
+def observeCall( method, seconds, error ):
+    for func in callObservers:
+        try:
+            func( method, seconds, error )
+        except Exception:
+            pass
+
+
+def completedFuture( func, *args ):
+    """ Call func right away and return its outcome as a finished Future. """
+    future = Future()
+    try:
+        future.set_result( func( *args ) )
+    except Exception as err:
+        future.set_exception( err )
+    return future
+
+
+class ManagedCtl(object):
+    """ Stands in for the ctl object of one connstring and (re)creates it as needed.
+
+        The ctl is created on first use. When a call fails with an error the
+        ctl considers a lost connection, it is closed and rebuilt on the next
+        call, so version-specific handlers, slices and callbacks are set up
+        afresh after a Murmur restart. Failed attempts are retried with
+        exponential backoff; calls made in between fail right away with
+        NotConnected, as does the call whose attempt failed.
+
+        Functions registered with addSetup() are run on every new ctl.
+    """
+
+    def __init__( self, factory, backoff=1.0, max_backoff=60.0, connect_wait=2.0 ):
+        self.factory     = factory
+        self.backoff     = backoff
+        self.max_backoff = max_backoff
+        self.connect_wait = connect_wait
+        self.lock        = threading.Lock()
+        self.connected_cond = threading.Condition( self.lock )
+        self.connecting  = False
+        self.setups      = []
+        self.ctl         = None
+        self.error       = None
+        self.failures    = 0
+        self.retry_at    = 0
+
+    @property
+    def connected( self ):
+        return self.ctl is not None
+
+    def addSetup( self, func ):
+        """ Run func(ctl) for the current and every future ctl object. """
+        with self.lock:
+            self.setups.append( func )
+            ctl = self.ctl
+        if ctl is not None:
+            func( ctl )
+
+    def getCtl( self ):
+        """ Return the current ctl object, connecting if necessary.
+
+            Only one thread connects at a time, without holding the lock;
+            others wait for it at most `connect_wait` seconds (or what is
+            left of their deadline) and then fail.
+        """
+        with self.lock:
+            if self.ctl is None and self.connecting:
+                wait = self.connect_wait
+                left = timeLeft()
+                if left is not None:
+                    wait = min( wait, left )
+                self.connected_cond.wait_for( lambda: not self.connecting, wait )
+                if self.connecting:
+                    raise NotConnected( "Still connecting to Murmur. Last error: %s" % self.error, self.connect_wait )
+
+            if self.ctl is not None:
+                return self.ctl
+
+            if monotonic() < self.retry_at:
+                retry_after = self.retry_at - monotonic()
+                raise NotConnected( "Not connected to Murmur, retrying in %.1f seconds. Last error: %s" % (
+                    retry_after, self.error ), retry_after )
+
+            self.connecting = True
+            setups = list( self.setups )
+
+        ctl = None
+        try:
+            ctl = self.factory()
+            for setup in setups:
+                setup( ctl )
+        except Exception as err:
+            with self.lock:
+                self.error      = err
+                self.failures  += 1
+                retry_after     = min( self.max_backoff, self.backoff * 2 ** ( self.failures - 1 ) )
+                self.retry_at   = monotonic() + retry_after
+                self.connecting = False
+                self.connected_cond.notify_all()
+            if ctl is not None:
+                try:
+                    ctl.close()
+                except Exception:
+                    pass
+            raise NotConnected( "Could not connect to Murmur: %s" % err, retry_after ) from err
+
+        with self.lock:
+            self.ctl        = ctl
+            self.error      = None
+            self.failures   = 0
+            self.connecting = False
+            self.connected_cond.notify_all()
+            # setups added while connecting have not seen this ctl yet
+            late = self.setups[len(setups):]
+        for setup in late:
+            setup( ctl )
+        return ctl
+
+    def connectionLost( self, ctl, err ):
+        """ Discard `ctl` (if it is still the current one) after `err`. """
+        with self.lock:
+            if self.ctl is not ctl:
+                return
+            self.ctl   = None
+            self.error = err
+        try:
+            ctl.close()
+        except Exception:
+            pass
+
+    def _checkFuture( self, ctl, future ):
+        try:
+            future.result()
+        except Exception as err:
+            if ctl.isConnectionError( err ):
+                self.connectionLost( ctl, err )
+
+    def __getattr__( self, name ):
+        ctl  = self.getCtl()
+        attr = getattr( ctl, name )
+        if not callable( attr ):
+            return attr
+
+        @wraps( attr )
+        def managed_call( *args, **kwargs ):
+            try:
+                result = attr( *args, **kwargs )
+            except Exception as err:
+                if ctl.isConnectionError( err ):
+                    self.connectionLost( ctl, err )
+                raise
+            if hasattr( result, "add_done_callback" ):
+                result.add_done_callback( lambda future: self._checkFuture( ctl, future ) )
+            return result
+
+        return managed_call
+
+    def close( self ):
+        with self.lock:
+            ctl, self.ctl = self.ctl, None
+        if ctl is not None:
+            ctl.close()
+
 
 class MumbleCtlBase(object):
     """ This class defines the base interface that the Mumble model expects. """
 
     cache = {}
+    cache_lock = threading.Lock()
 
     @staticmethod
-    def newInstance( connstring, slicefile=None, icesecret=None ):
-        """ Create a new CTL object for the given connstring.
+    def newInstance( connstring, slicefile=None, icesecret=None, timeouts=None ):
+        """ Return the managed CTL object for the given connstring.
 
-            Optional parameters are the path to the slice file and the
-            Ice secret necessary to authenticate to Murmur.
+            Optional parameters are the path to the slice file, the
+            Ice secret necessary to authenticate to Murmur and the Ice
+            invocation timeouts in seconds, by operation name ("default"
+            applies to all others).
 
             The path can be omitted only if using DBus or running Murmur
             1.2.3 or later, which exports a getSlice method to retrieve
             the Slice from.
+
+            The returned ManagedCtl connects on first use and reconnects
+            after the connection to Murmur was lost; see ManagedCtl.
         """
 
-        # check cache
-        if connstring in MumbleCtlBase.cache:
+        with MumbleCtlBase.cache_lock:
+            if connstring not in MumbleCtlBase.cache:
+                MumbleCtlBase.cache[connstring] = ManagedCtl(
+                    lambda: MumbleCtlBase.connect( connstring, slicefile, icesecret, timeouts ) )
             return MumbleCtlBase.cache[connstring]
 
+    @staticmethod
+    def connect( connstring, slicefile=None, icesecret=None, timeouts=None ):
+        """ Connect to Murmur and create the CTL object for its version. """
+
         # connstring defines whether to connect via ICE or DBus.
         # Dbus service names: some.words.divided.by.periods
         # ICE specs are WAY more complex, so if DBus doesn't match, use ICE.
+        # "replay:<path>" plays back a recording made with MumbleCtlReplay.record.
         rd = re.compile( r'^(\w+\.)*\w+$' )
 
-        if rd.match( connstring ):
+        if connstring.startswith( "replay:" ):
+            from .MumbleCtlReplay import MumbleCtlReplay
+            return MumbleCtlReplay( connstring[len("replay:"):] )
+        elif rd.match( connstring ):
             from .MumbleCtlDbus import MumbleCtlDbus
-            ctl = MumbleCtlDbus( connstring )
+            return MumbleCtlDbus( connstring )
         else:
             from .MumbleCtlIce import MumbleCtlIce
-            ctl = MumbleCtlIce( connstring, slicefile, icesecret )
+            return MumbleCtlIce( connstring, slicefile, icesecret, timeouts )
 
-        MumbleCtlBase.cache[connstring] = ctl
-        return ctl
+    # Backends without asynchronous invocation run these synchronously; the
+    # returned futures are already finished.
+
+    def getConfAsync( self, srvid, key ):
+        return completedFuture( self.getConf, srvid, key )
+
+    def getTreeAsync( self, srvid ):
+        return completedFuture( self.getTree, srvid )
+
+    def getBootedServersAsync( self ):
+        return completedFuture( self.getBootedServers )
+
+    def enableTreeMirror( self, endpoint ):
+        """ Keep an in-memory copy of each server's tree, updated via callbacks. """
+        raise NotImplementedError( "Tree mirroring requires the Ice interface of Murmur 1.2 or later." )
+
+    def addTreeListener( self, func ):
+        """ Call func(srvid, event, state) for every change the tree mirror is told about. """
+        raise NotImplementedError( "Tree listeners require the Ice interface of Murmur 1.2 or later." )
+
+    def isConnectionError( self, err ):
+        """ Check if `err` means the connection to Murmur is gone. """
+        return False
+
+    def close( self ):
+        """ Release the connection and anything set up on it. """
+        pass
 
     @staticmethod
     def clearCache():
-        MumbleCtlBase.cache = {}
+        with MumbleCtlBase.cache_lock:
+            managed = list(MumbleCtlBase.cache.values())
+            MumbleCtlBase.cache = {}
+        for ctl in managed:
+            ctl.close()
@@ -0,0 +1,151 @@
+# -*- coding: utf-8 -*-
+# kate: space-indent on; indent-width 4; replace-tabs on;
+
+"""
+ *  Copyright © 2009-2010, Michael "Svedrin" Ziegler <diese-addy@funzt-halt.net>
+ *
+ *  Mumble-Django is free software; you can redistribute it and/or modify
+ *  it under the terms of the GNU General Public License as published by
+ *  the Free Software Foundation; either version 2 of the License, or
+ *  (at your option) any later version.
+ *
+ *  This package is distributed in the hope that it will be useful,
+ *  but WITHOUT ANY WARRANTY; without even the implied warranty of
+ *  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ *  GNU General Public License for more details.
+
+ On-disk cache of Python modules generated from Slice files.
+
+ Compiling a Slice takes seconds, so the generated code is kept in a
+ directory named after a hash of the Slice text and the Ice version, and
+ later starts only need to add that directory to sys.path. Slices can be
+ compiled ahead of time, e.g. while building an image:
+
+    python -m mumble.slicecache slices/MumbleServerv1.5.735.ice
+
+ If the configured slice file is cached, MumbleCtlIce imports its code right
+ away, without asking Murmur for its Slice or compiling anything.
+"""
+
+import os
+import sys
+import shutil
+import tempfile
+
+from hashlib import sha256
+from os.path import exists, expanduser, join
+
+import Ice, IcePy
+
+ENV_CACHEDIR = 'MUMBLE_SLICE_CACHE'
+DEFAULT_CACHEDIR = join( expanduser( "~" ), ".cache", "mumble-slices" )
+
+
+def getCacheDir():
+    return os.environ.get( ENV_CACHEDIR, DEFAULT_CACHEDIR )
+
+
+def cacheKey( slicetext ):
+    """ Identify generated code by the Slice text and the Ice version it was compiled with. """
+    digest = sha256( slicetext )
+    digest.update( Ice.stringVersion().encode( "ascii" ) )
+    return digest.hexdigest()[:32]
+
+
+def compileSlice( slicefile, target, icepath=None ):
+    """ Run slice2py for the slice file, writing the modules to `target`.
+
+        The code is generated into a temporary directory first and then
+        renamed, so concurrent workers never see half-written modules.
+    """
+    if not hasattr( IcePy, "compile" ):
+        raise RuntimeError( "This Ice installation does not include the Slice compiler." )
+
+    parent = os.path.dirname( target )
+    os.makedirs( parent, exist_ok=True )
+    tempdir = tempfile.mkdtemp( dir=parent )
+    try:
+        args = [ "slice2py", "--output-dir", tempdir ]
+        if icepath:
+            args.append( "-I" + icepath )
+        args.append( slicefile )
+        if IcePy.compile( args ) != 0:
+            raise RuntimeError( "Slice preprocessing failed for '%s'." % slicefile )
+        try:
+            os.rename( tempdir, target )
+        except OSError:
+            # someone else was faster, which is fine.
+            if not exists( target ):
+                raise
+    finally:
+        if exists( tempdir ):
+            shutil.rmtree( tempdir, ignore_errors=True )
+
+
+def cachePath( slicefile, cachedir ):
+    with open( slicefile, "rb" ) as fd:
+        return join( cachedir, cacheKey( fd.read() ) )
+
+
+def addToPath( target ):
+    if target not in sys.path:
+        sys.path.insert( 0, target )
+
+
+def lookup( slicefile, cachedir=None ):
+    """ Make the modules for the slice file importable if they are cached,
+        without compiling anything. Returns whether they were.
+    """
+    if cachedir is None:
+        cachedir = getCacheDir()
+    if not cachedir or not exists( slicefile ):
+        return False
+
+    target = cachePath( slicefile, cachedir )
+    if not exists( target ):
+        return False
+    addToPath( target )
+    return True
+
+
+def load( slicefile, icepath=None, cachedir=None ):
+    """ Make the modules for the slice file importable from the cache,
+        compiling them first if they are not cached yet.
+
+        Returns False if that is not possible, so the caller can fall back to
+        Ice.loadSlice.
+    """
+    if cachedir is None:
+        cachedir = getCacheDir()
+    if not cachedir:
+        return False
+
+    target = cachePath( slicefile, cachedir )
+    if not exists( target ):
+        try:
+            compileSlice( slicefile, target, icepath )
+        except (RuntimeError, OSError):
+            return False
+
+    addToPath( target )
+    return True
+
+
+if __name__ == '__main__':
+    import argparse
+    from .MumbleCtlIce import getSliceIncludePath
+
+    parser = argparse.ArgumentParser( description="Compile Slice files into the slice cache." )
+    parser.add_argument( "-d", "--cachedir",
+        help="cache directory. Default is '%s'. Can be set with %s env var." % ( DEFAULT_CACHEDIR, ENV_CACHEDIR ),
+        default=getCacheDir() )
+    parser.add_argument( "slicefiles", nargs="+" )
+    args = parser.parse_args()
+
+    for slicefile in args.slicefiles:
+        target = cachePath( slicefile, args.cachedir )
+        if exists( target ):
+            print( "%s: already cached in %s" % ( slicefile, target ) )
+        else:
+            compileSlice( slicefile, target, getSliceIncludePath() )
+            print( "%s: compiled to %s" % ( slicefile, target ) )
@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+# kate: space-indent on; indent-width 4; replace-tabs on;
+
+"""
+ *  Copyright © 2009-2010, Michael "Svedrin" Ziegler <diese-addy@funzt-halt.net>
+ *
+ *  Mumble-Django is free software; you can redistribute it and/or modify
+ *  it under the terms of the GNU General Public License as published by
+ *  the Free Software Foundation; either version 2 of the License, or
+ *  (at your option) any later version.
+ *
+ *  This package is distributed in the hope that it will be useful,
+ *  but WITHOUT ANY WARRANTY; without even the implied warranty of
+ *  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ *  GNU General Public License for more details.
+
+ Codec for the 600x60 32-bit textures of Murmur 1.1.x, shared by the Ice
+ and DBus backends. Murmur stores them as BGRA (although the docs say RGBA),
+ compressed in the framing of Qt's qCompress().
+"""
+
+from struct import pack
+from zlib   import compress, decompress
+
+TEXTURE_SIZE = ( 600, 60 )
+
+
+def swapRedBlue( data ):
+    """ Convert BGRA pixel data to RGBA or the other way round.
+
+        Swaps bytes 0 and 2 of every pixel with two slice assignments instead
+        of touching each pixel in Python.
+    """
+    data = memoryview( data )
+    out  = bytearray( data )
+    out[0::4] = data[2::4]
+    out[2::4] = data[0::4]
+    return bytes( out )
+
+
+def qCompress( data ):
+    """ Compress like qCompress(): big endian uncompressed length, then zlib data. """
+    return pack( ">L", len(data) ) + compress( data )
+
+
+def qUncompress( data ):
+    """ Reverse qCompress(). """
+    return decompress( memoryview( data )[4:] )
+
+
+def decodeTexture( bgra ):
+    """ Create a 600x60 RGBA image from raw BGRA pixel data. """
+    from PIL import Image
+    return Image.frombytes( "RGBA", TEXTURE_SIZE, swapRedBlue( bgra ) )
+
+
+def encodeTexture( img ):
+    """ Convert an image to raw BGRA pixel data, cropped/padded to 600x60. """
+    from PIL import Image
+    img = img.convert( "RGBA" ).transform( TEXTURE_SIZE, Image.EXTENT, ( 0, 0 ) + TEXTURE_SIZE )
+    return swapRedBlue( img.tobytes() )
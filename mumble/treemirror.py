@@ -0,0 +1,366 @@
+# -*- coding: utf-8 -*-
+# kate: space-indent on; indent-width 4; replace-tabs on;
+
+"""
+ *  Copyright © 2009-2010, Michael "Svedrin" Ziegler <diese-addy@funzt-halt.net>
+ *
+ *  Mumble-Django is free software; you can redistribute it and/or modify
+ *  it under the terms of the GNU General Public License as published by
+ *  the Free Software Foundation; either version 2 of the License, or
+ *  (at your option) any later version.
+ *
+ *  This package is distributed in the hope that it will be useful,
+ *  but WITHOUT ANY WARRANTY; without even the implied warranty of
+ *  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ *  GNU General Public License for more details.
+"""
+
+import threading
+
+from time import monotonic
+
+from .utils import ObjectInfo
+
+# Seconds between checks whether Murmur is still the one the mirror attached to
+WATCH_INTERVAL = 10.0
+
+# Murmur reports its uptime in whole seconds, so boot times derived from it
+# may differ by this much without Murmur having restarted
+BOOT_TOLERANCE = 2.0
+
+
+class ServerTree(object):
+    """ In-memory copy of one virtual server's channels and users.
+
+        The copy is loaded with a full getTree() and then kept current by the
+        ServerCallback notifications Murmur sends for this server.
+    """
+
+    def __init__( self, srvid ):
+        self.srvid    = srvid
+        self.lock     = threading.Lock()
+        self.channels = {}
+        self.users    = {}
+        self.conf     = {}
+        self.synced   = False
+        self.callback = None
+        # changes that arrive while a full tree is being fetched
+        self.pending  = None
+        self.attachlock = threading.Lock()
+
+    def beginLoad( self ):
+        """ Start buffering changes until load() or reset() is called. """
+        with self.lock:
+            self.pending = []
+
+    def load( self, tree ):
+        """ Replace the current state with the contents of an Ice Tree.
+
+            Changes buffered since beginLoad() are applied on top, in the
+            order they arrived, so none that came in while the tree was being
+            fetched are lost to the older state. If the tree was reset since
+            beginLoad(), it is left to the next attach.
+        """
+        channels = {}
+        users    = {}
+        stack    = [tree]
+        while stack:
+            node = stack.pop()
+            channels[node.c.id] = node.c
+            for user in node.users:
+                users[user.session] = user
+            stack.extend( node.children )
+
+        with self.lock:
+            if self.pending is None:
+                return
+            self.channels = channels
+            self.users    = users
+            self.conf     = {}
+            for func, state in self.pending:
+                func( state )
+            self.pending  = None
+            self.synced   = True
+
+    def reset( self ):
+        """ Forget everything, forcing a resync on the next access. """
+        with self.lock:
+            self.channels = {}
+            self.users    = {}
+            self.conf     = {}
+            self.pending  = None
+            self.synced   = False
+
+    def _change( self, func, state ):
+        with self.lock:
+            if self.pending is not None:
+                self.pending.append( ( func, state ) )
+            else:
+                func( state )
+
+    def _updateUser( self, user ):
+        self.users[user.session] = user
+
+    def _removeUser( self, user ):
+        self.users.pop( user.session, None )
+
+    def _updateChannel( self, channel ):
+        self.channels[channel.id] = channel
+
+    def _removeChannel( self, channel ):
+        self.channels.pop( channel.id, None )
+
+    def updateUser( self, user ):
+        self._change( self._updateUser, user )
+
+    def removeUser( self, user ):
+        self._change( self._removeUser, user )
+
+    def updateChannel( self, channel ):
+        self._change( self._updateChannel, channel )
+
+    def removeChannel( self, channel ):
+        self._change( self._removeChannel, channel )
+
+    def getTree( self ):
+        """ Build a Tree-like object (c, children, users) from the current state.
+
+            Children are ordered by channel ID and users by session, so equal
+            states always produce equal trees.
+        """
+        with self.lock:
+            channels = sorted( self.channels.values(), key=lambda chan: chan.id )
+            users    = sorted( self.users.values(),    key=lambda user: user.session )
+
+        nodes = dict( ( chan.id, ObjectInfo( c=chan, children=[], users=[] ) ) for chan in channels )
+        for chan in channels:
+            if chan.parent in nodes and chan.id != chan.parent:
+                nodes[chan.parent].children.append( nodes[chan.id] )
+        for user in users:
+            if user.channel in nodes:
+                nodes[user.channel].users.append( user )
+
+        if 0 not in nodes:
+            raise KeyError( "Server %d has no root channel." % self.srvid )
+        return nodes[0]
+
+
+def serverId( srv ):
+    """ The ID of a server proxy, read from its identity ("s/<id>") so callback
+        handlers need not call back into Murmur.
+    """
+    identity = srv.ice_getIdentity()
+    try:
+        return int( identity.name )
+    except ValueError:
+        return srv.id()
+
+
+def makeServants( slicemod ):
+    """ Create the callback servant classes for the given slice module
+        (MumbleServer for 1.5+, Murmur for older versions).
+    """
+
+    class ServerCallbackI( slicemod.ServerCallback ):
+        def __init__( self, mirror, tree ):
+            self.mirror = mirror
+            self.tree   = tree
+
+        def userConnected( self, state, current=None ):
+            self.tree.updateUser( state )
+            self.mirror.notify( self.tree.srvid, "userConnected", state )
+
+        def userDisconnected( self, state, current=None ):
+            self.tree.removeUser( state )
+            self.mirror.notify( self.tree.srvid, "userDisconnected", state )
+
+        def userStateChanged( self, state, current=None ):
+            self.tree.updateUser( state )
+            self.mirror.notify( self.tree.srvid, "userStateChanged", state )
+
+        def userTextMessage( self, state, message, current=None ):
+            pass
+
+        def channelCreated( self, state, current=None ):
+            self.tree.updateChannel( state )
+            self.mirror.notify( self.tree.srvid, "channelCreated", state )
+
+        def channelRemoved( self, state, current=None ):
+            self.tree.removeChannel( state )
+            self.mirror.notify( self.tree.srvid, "channelRemoved", state )
+
+        def channelStateChanged( self, state, current=None ):
+            self.tree.updateChannel( state )
+            self.mirror.notify( self.tree.srvid, "channelStateChanged", state )
+
+    class MetaCallbackI( slicemod.MetaCallback ):
+        def __init__( self, mirror ):
+            self.mirror = mirror
+
+        def started( self, srv, current=None ):
+            self.mirror.serverStarted( serverId( srv ) )
+
+        def stopped( self, srv, current=None ):
+            self.mirror.serverStopped( serverId( srv ) )
+
+    return ServerCallbackI, MetaCallbackI
+
+
+class TreeMirror(object):
+    """ Keeps a ServerTree for every virtual server that has been asked for.
+
+        A server is attached lazily on first access: a ServerCallback is
+        registered and the tree is loaded with a full getTree(). When Murmur
+        reports that a server was (re)started or stopped, its tree is reset and
+        attached again on the next access, so callback handlers never wait for
+        Murmur. Started and stopped servers are also reported to
+        `forgetServer`, so the ctl can drop its cached proxy for them.
+
+        `timed(proxy, operation)` returns the proxy with the invocation
+        timeout for that operation, shortened to the caller's deadline.
+
+        Murmur forgets all callbacks when it restarts, and can't deliver them
+        while the connection is down, neither of which it tells us about. So
+        every `interval` seconds, Murmur's uptime is checked: if that fails
+        or says Murmur booted again since, all trees are reset and the Meta
+        callback is registered again.
+    """
+
+    def __init__( self, meta, slicemod, endpoint, getServer, forgetServer, timed, interval=WATCH_INTERVAL ):
+        self.meta      = meta
+        self.slicemod  = slicemod
+        self.getServer = getServer
+        self.forgetServer = forgetServer
+        self.timed     = timed
+        self.interval  = interval
+        self.lock      = threading.Lock()
+        self.servers   = {}
+        self.listeners = []
+        self.closed    = threading.Event()
+
+        self.ServerCallbackI, MetaCallbackI = makeServants( slicemod )
+
+        self.adapter = meta.ice_getCommunicator().createObjectAdapterWithEndpoints( "FlaskCVP.Callback", endpoint )
+        self.adapter.activate()
+
+        self.metacb = slicemod.MetaCallbackPrx.uncheckedCast( self.adapter.addWithUUID( MetaCallbackI( self ) ) )
+        timed( meta, "addCallback" ).addCallback( self.metacb )
+        self.booted = monotonic() - timed( meta, "getUptime" ).getUptime()
+
+        threading.Thread( target=self._watch, daemon=True ).start()
+
+    def _getServerTree( self, srvid ):
+        with self.lock:
+            if srvid not in self.servers:
+                self.servers[srvid] = ServerTree( srvid )
+            tree = self.servers[srvid]
+
+        if not tree.synced:
+            with tree.attachlock:
+                if not tree.synced:
+                    self.attach( srvid, tree )
+        return tree
+
+    def attach( self, srvid, tree ):
+        """ Register a ServerCallback for the server and load its full tree. """
+        srv = self.getServer( srvid )
+        if tree.callback is None:
+            tree.callback = self.slicemod.ServerCallbackPrx.uncheckedCast(
+                self.adapter.addWithUUID( self.ServerCallbackI( self, tree ) ) )
+        else:
+            # it may still be registered if Murmur didn't restart, and
+            # registering it twice would report every change twice
+            try:
+                self.timed( srv, "removeCallback" ).removeCallback( tree.callback )
+            except Exception:
+                pass
+        # register first, so no change between getTree and addCallback is lost,
+        # and buffer what arrives until the tree is loaded
+        tree.beginLoad()
+        try:
+            self.timed( srv, "addCallback" ).addCallback( tree.callback )
+            tree.load( self.timed( srv, "getTree" ).getTree() )
+        except Exception:
+            tree.reset()
+            raise
+
+    def getTree( self, srvid ):
+        return self._getServerTree( srvid ).getTree()
+
+    def addListener( self, func ):
+        """ Call func(srvid, event, state) for every callback Murmur sends. """
+        self.listeners.append( func )
+
+    def notify( self, srvid, event, state ):
+        for func in self.listeners:
+            try:
+                func( srvid, event, state )
+            except Exception:
+                # a broken listener must not keep the tree from being updated.
+                pass
+
+    def getConf( self, srvid, key ):
+        """ Return a config value, fetching it from Murmur only once per sync. """
+        tree = self._getServerTree( srvid )
+        if key not in tree.conf:
+            tree.conf[key] = self.timed( self.getServer( srvid ), "getConf" ).getConf( key )
+        return tree.conf[key]
+
+    def forgetConf( self, srvid ):
+        with self.lock:
+            tree = self.servers.get( srvid )
+        if tree is not None:
+            tree.conf = {}
+
+    def serverStarted( self, srvid ):
+        self.forgetServer( srvid )
+        with self.lock:
+            tree = self.servers.get( srvid )
+        if tree is not None:
+            # attached again on next access, not from Murmur's callback thread
+            tree.reset()
+
+    def serverStopped( self, srvid ):
+        self.forgetServer( srvid )
+        with self.lock:
+            tree = self.servers.get( srvid )
+        if tree is not None:
+            # Murmur drops callbacks when a server stops, so attach again on next access.
+            tree.reset()
+
+    def resetAll( self ):
+        """ Reset all trees and forget all server proxies. """
+        self.forgetServer( None )
+        with self.lock:
+            trees = list( self.servers.values() )
+        for tree in trees:
+            tree.reset()
+
+    def _watch( self ):
+        while not self.closed.wait( self.interval ):
+            try:
+                booted = monotonic() - self.timed( self.meta, "getUptime" ).getUptime()
+            except Exception:
+                booted = None
+
+            if booted is None:
+                if self.booted is not None:
+                    # callbacks sent in the meantime are lost
+                    self.resetAll()
+                    self.booted = None
+            elif self.booted is None or booted > self.booted + BOOT_TOLERANCE:
+                # back again, or restarted and our callbacks are gone
+                self.resetAll()
+                try:
+                    try:
+                        self.timed( self.meta, "removeCallback" ).removeCallback( self.metacb )
+                    except Exception:
+                        pass
+                    self.timed( self.meta, "addCallback" ).addCallback( self.metacb )
+                except Exception:
+                    continue
+                self.booted = booted
+
+    def close( self ):
+        self.closed.set()
+        self.adapter.destroy()
@@ -47,3 +47,99 @@ class ObjectInfo( object ):
 
     def __getitem__( self, name ):
         return self.__dict__[name]
+
+
+class SlottedInfo( object ):
+    """ Base for record types with a fixed set of fields.
+
+        Behaves like ObjectInfo (attribute, `in` and [] access), but stores
+        the fields in __slots__ instead of a per-instance dict, which makes
+        the thousands of records created for big servers much smaller.
+        Fields that were never set are not `in` the record.
+    """
+
+    __slots__ = ()
+
+    def _asdict( self ):
+        return dict( ( name, getattr( self, name ) ) for name in self.__slots__ if hasattr( self, name ) )
+
+    def __str__( self ):
+        return str(self._asdict())
+
+    def __repr__( self ):
+        return str(self._asdict())
+
+    def __contains__( self, name ):
+        return name in self.__slots__ and hasattr( self, name )
+
+    def __getitem__( self, name ):
+        if name not in self.__slots__:
+            raise KeyError( name )
+        try:
+            return getattr( self, name )
+        except AttributeError:
+            raise KeyError( name )
+
+
+class PlayerInfo( SlottedInfo ):
+    """ A connected user as returned by getPlayers. """
+
+    __slots__ = ( 'session', 'userid', 'mute', 'deaf', 'suppress', 'selfMute', 'selfDeaf',
+                  'channel', 'name', 'onlinesecs', 'bytespersec' )
+
+    def __init__( self, session, userid, mute, deaf, suppress, selfMute, selfDeaf,
+                  channel, name, onlinesecs, bytespersec ):
+        self.session     = session
+        self.userid      = userid
+        self.mute        = mute
+        self.deaf        = deaf
+        self.suppress    = suppress
+        self.selfMute    = selfMute
+        self.selfDeaf    = selfDeaf
+        self.channel     = channel
+        self.name        = name
+        self.onlinesecs  = onlinesecs
+        self.bytespersec = bytespersec
+
+
+class RegistrationInfo( SlottedInfo ):
+    """ A registered user as returned by getRegisteredPlayers and getRegistration. """
+
+    __slots__ = ( 'userid', 'name', 'email', 'pw', 'comment', 'hash' )
+
+    def __init__( self, userid, name, email, pw, comment=None, hash=None ):
+        self.userid = userid
+        self.name   = name
+        self.email  = email
+        self.pw     = pw
+        if comment is not None:
+            self.comment = comment
+        if hash is not None:
+            self.hash = hash
+
+
+class ChannelInfo( SlottedInfo ):
+    """ A channel as returned by getChannels. """
+
+    __slots__ = ( 'id', 'name', 'parent', 'links' )
+
+    def __init__( self, id, name, parent, links ):
+        self.id     = id
+        self.name   = name
+        self.parent = parent
+        self.links  = links
+
+
+class ACLInfo( SlottedInfo ):
+    """ One ACL rule as returned by getACL. """
+
+    __slots__ = ( 'applyHere', 'applySubs', 'inherited', 'userid', 'group', 'allow', 'deny' )
+
+    def __init__( self, applyHere, applySubs, inherited, userid, group, allow, deny ):
+        self.applyHere = applyHere
+        self.applySubs = applySubs
+        self.inherited = inherited
+        self.userid    = userid
+        self.group     = group
+        self.allow     = allow
+        self.deny      = deny
@@ -23,5 +23,6 @@ setup(name='flaskcvp',
       author="Michael Ziegler",
       author_email='diese-addy@funzt-halt.net',
       url='http://www.mumble-django.org',
-      py_modules=['flaskcvp', 'mumble.mctl', 'mumble.MumbleCtlDbus', 'mumble.MumbleCtlIce', 'mumble.utils'],
+      py_modules=['flaskcvp', 'mumble.mctl', 'mumble.MumbleCtlDbus', 'mumble.MumbleCtlIce', 'mumble.MumbleCtlReplay', 'mumble.utils',
+                  'mumble.slicecache', 'mumble.texture', 'mumble.treemirror', 'cvp.breaker', 'cvp.cache', 'cvp.delta', 'cvp.events', 'cvp.index', 'cvp.metrics', 'cvp.search', 'cvp.serialize', 'cvp.snapshot', 'cvp.textures', 'cvp.timing'],
      )
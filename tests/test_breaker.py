@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+# kate: space-indent on; indent-width 4; replace-tabs on;
+
+"""
+ *  Copyright © 2009-2010, Michael "Svedrin" Ziegler <diese-addy@funzt-halt.net>
+ *
+ *  Mumble-Django is free software; you can redistribute it and/or modify
+ *  it under the terms of the GNU General Public License as published by
+ *  the Free Software Foundation; either version 2 of the License, or
+ *  (at your option) any later version.
+ *
+ *  This package is distributed in the hope that it will be useful,
+ *  but WITHOUT ANY WARRANTY; without even the implied warranty of
+ *  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ *  GNU General Public License for more details.
+"""
+
+import threading
+
+from time import sleep
+
+import pytest
+
+from cvp.breaker import CircuitBreaker, CircuitOpen, OPEN, HALF_OPEN
+
+
+class Server(object):
+    def __init__( self ):
+        self.healthy = False
+        self.calls   = 0
+
+    def __call__( self, key ):
+        self.calls += 1
+        if not self.healthy:
+            raise OSError( "down" )
+        return key
+
+
+def fail( breaker, server, key, times ):
+    for _ in range( times ):
+        with pytest.raises( OSError ):
+            breaker.call( key, server, key )
+
+
+def test_opens_after_threshold_failures():
+    breaker = CircuitBreaker( 3, reset_timeout=10 )
+    server  = Server()
+    fail( breaker, server, 1, 3 )
+    assert breaker.circuits[1].state == OPEN
+
+    with pytest.raises( CircuitOpen ) as info:
+        breaker.call( 1, server, 1 )
+    assert info.value.retry_after > 0
+    assert server.calls == 3
+    assert breaker.stats() == { 'rejected': 1, 'open': { '1': 3 } }
+
+
+def test_ignored_errors_leave_the_circuit_alone():
+    breaker = CircuitBreaker( 1, reset_timeout=10, isFailure=lambda err: not isinstance( err, LookupError ) )
+
+    def missing( key ):
+        raise LookupError( key )
+
+    for _ in range( 3 ):
+        with pytest.raises( LookupError ):
+            breaker.call( 1, missing, 1 )
+    assert breaker.circuits == {}
+
+
+def test_probe_closes_the_circuit():
+    server  = Server()
+    probed  = threading.Event()
+    breaker = None
+
+    def probe( key ):
+        try:
+            breaker.call( key, server, key )
+        finally:
+            probed.set()
+
+    breaker = CircuitBreaker( 2, reset_timeout=.05, probe=probe )
+    fail( breaker, server, 1, 2 )
+    with pytest.raises( CircuitOpen ):
+        breaker.call( 1, server, 1 )
+
+    # the first probe fails and opens the circuit again
+    assert probed.wait( 1 )
+    assert breaker.circuits[1].state == OPEN
+
+    server.healthy = True
+    probed.clear()
+    with pytest.raises( CircuitOpen ):
+        breaker.call( 1, server, 1 )
+    assert probed.wait( 1 )
+    sleep( .01 )
+    assert breaker.circuits == {}
+    assert breaker.call( 1, server, 1 ) == 1
+
+
+def test_without_probe_the_next_call_is_the_trial():
+    breaker = CircuitBreaker( 1, reset_timeout=.05 )
+    server  = Server()
+    fail( breaker, server, 1, 1 )
+    sleep( .1 )
+    assert breaker.circuits[1].state == HALF_OPEN
+
+    # a failed trial opens the circuit again right away
+    fail( breaker, server, 1, 1 )
+    assert breaker.circuits[1].state == OPEN
+
+    sleep( .1 )
+    server.healthy = True
+    assert breaker.call( 1, server, 1 ) == 1
+    assert breaker.circuits == {}
@@ -0,0 +1,150 @@
+# -*- coding: utf-8 -*-
+# kate: space-indent on; indent-width 4; replace-tabs on;
+
+"""
+ *  Copyright © 2009-2010, Michael "Svedrin" Ziegler <diese-addy@funzt-halt.net>
+ *
+ *  Mumble-Django is free software; you can redistribute it and/or modify
+ *  it under the terms of the GNU General Public License as published by
+ *  the Free Software Foundation; either version 2 of the License, or
+ *  (at your option) any later version.
+ *
+ *  This package is distributed in the hope that it will be useful,
+ *  but WITHOUT ANY WARRANTY; without even the implied warranty of
+ *  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ *  GNU General Public License for more details.
+"""
+
+import threading
+
+from time import monotonic, sleep
+
+import pytest
+
+from cvp.cache import SnapshotCache
+
+
+class FakeSnapshot(object):
+    def __init__( self, value ):
+        self.value   = value
+        self.created = monotonic()
+
+    @property
+    def age( self ):
+        return monotonic() - self.created
+
+
+class Gone(LookupError):
+    pass
+
+
+class Fetcher(object):
+    """ Counts fetches and fails while `error` is set. """
+
+    def __init__( self, delay=0 ):
+        self.delay = delay
+        self.calls = 0
+        self.error = None
+        self.lock  = threading.Lock()
+
+    def __call__( self, key ):
+        with self.lock:
+            self.calls += 1
+            calls = self.calls
+        sleep( self.delay )
+        if self.error is not None:
+            raise self.error
+        return FakeSnapshot( calls )
+
+
+def waitIdle( cache ):
+    """ Wait for background fetches to finish. """
+    for _ in range( 200 ):
+        with cache.lock:
+            if not cache.inflight:
+                return
+        sleep( .005 )
+    raise AssertionError( "fetch did not finish" )
+
+
+def test_concurrent_misses_share_one_fetch():
+    fetch = Fetcher( delay=.1 )
+    cache = SnapshotCache( fetch, ttl=10 )
+    results = []
+    threads = [ threading.Thread( target=lambda: results.append( cache.get( 1 ) ) ) for _ in range( 8 ) ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert fetch.calls == 1
+    assert len( set( map( id, results ) ) ) == 1
+    stats = cache.stats()
+    assert stats['misses'] == 1 and stats['coalesced'] == 7
+
+
+def test_errors_reach_all_waiters_and_are_not_cached():
+    fetch = Fetcher( delay=.05 )
+    fetch.error = OSError( "down" )
+    cache = SnapshotCache( fetch, ttl=10 )
+    errors = []
+
+    def get():
+        try:
+            cache.get( 1 )
+        except OSError as err:
+            errors.append( err )
+
+    threads = [ threading.Thread( target=get ) for _ in range( 4 ) ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len( errors ) == 4 and fetch.calls == 1
+
+    fetch.error = None
+    assert cache.get( 1 ).value == 2
+
+
+def test_stale_while_revalidate_serves_old_snapshot_on_errors():
+    fetch = Fetcher()
+    cache = SnapshotCache( fetch, ttl=.01, stale_while_revalidate=True, max_stale=10 )
+    first = cache.get( 1 )
+    sleep( .02 )
+
+    fetch.error = OSError( "down" )
+    assert cache.get( 1 ) is first
+    waitIdle( cache )
+    assert cache.get( 1 ) is first
+    waitIdle( cache )
+    assert cache.stats()['errors'] == 2
+
+    fetch.error = None
+    cache.get( 1 )
+    waitIdle( cache )
+    assert cache.get( 1 ).value > first.value
+
+
+def test_stale_snapshots_expire_after_max_stale():
+    fetch = Fetcher()
+    cache = SnapshotCache( fetch, ttl=.01, stale_while_revalidate=True, max_stale=.05 )
+    cache.get( 1 )
+    fetch.error = OSError( "down" )
+    sleep( .06 )
+    with pytest.raises( OSError ):
+        cache.get( 1 )
+    assert cache.peek( 1 ) is None
+
+
+def test_gone_errors_drop_the_snapshot():
+    fetch = Fetcher()
+    cache = SnapshotCache( fetch, ttl=.01, stale_while_revalidate=True, max_stale=10,
+                           isGone=lambda err: isinstance( err, Gone ) )
+    first = cache.get( 1 )
+    sleep( .02 )
+    fetch.error = Gone( 1 )
+    assert cache.get( 1 ) is first
+    waitIdle( cache )
+    assert cache.peek( 1 ) is None
+    with pytest.raises( Gone ):
+        cache.get( 1 )
@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+# kate: space-indent on; indent-width 4; replace-tabs on;
+
+"""
+ *  Copyright © 2009-2010, Michael "Svedrin" Ziegler <diese-addy@funzt-halt.net>
+ *
+ *  Mumble-Django is free software; you can redistribute it and/or modify
+ *  it under the terms of the GNU General Public License as published by
+ *  the Free Software Foundation; either version 2 of the License, or
+ *  (at your option) any later version.
+ *
+ *  This package is distributed in the hope that it will be useful,
+ *  but WITHOUT ANY WARRANTY; without even the implied warranty of
+ *  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ *  GNU General Public License for more details.
+"""
+
+from cvp.delta import SnapshotHistory, changes, diff
+
+
+def user( session, channel=0, idlesecs=0, **state ):
+    state.update( session=session, channel=channel, idlesecs=idlesecs, name="user%d" % session )
+    return state
+
+
+def channel( cid, parent=-1, **state ):
+    state.update( id=cid, parent=parent, name="Channel %d" % cid )
+    return state
+
+
+def flat( channels, users ):
+    return ( dict( ( chan['id'], chan ) for chan in channels ),
+             dict( ( usr['session'], usr ) for usr in users ) )
+
+
+class FakeSnapshot(object):
+    """ Stands in for a TreeSnapshot, with the flattened tree given. """
+
+    def __init__( self, channels, users, name="Server" ):
+        self.name    = name
+        self.flat    = flat( channels, users )
+        self.root    = repr( self.flat ).encode( "utf-8" )
+        self.created = 0
+        self.version = None
+
+
+ROOT = channel( 0 )
+
+
+def test_diff_reports_callback_events():
+    old = flat( [ ROOT, channel( 1, 0 ) ], [ user( 1 ), user( 2 ) ] )
+    new = flat( [ ROOT, channel( 2, 0 ) ], [ user( 1, channel=2 ), user( 3 ) ] )
+    assert sorted( ( event, state.get( 'session', state.get( 'id' ) ) ) for ( event, state ) in diff( old, new ) ) == [
+        ( "channelCreated", 2 ), ( "channelRemoved", 1 ),
+        ( "userConnected", 3 ), ( "userDisconnected", 2 ), ( "userStateChanged", 1 ) ]
+
+
+def test_diff_ignores_growing_idle_times():
+    old = flat( [ ROOT ], [ user( 1, idlesecs=5 ) ] )
+    assert diff( old, flat( [ ROOT ], [ user( 1, idlesecs=50 ) ] ) ) == []
+    assert diff( old, flat( [ ROOT ], [ user( 1, idlesecs=0 ) ] ) ) == [ ( "userStateChanged", user( 1 ) ) ]
+
+
+def test_changes_groups_events():
+    old = flat( [ ROOT, channel( 1, 0 ) ], [ user( 1 ) ] )
+    new = flat( [ ROOT ], [ user( 2 ) ] )
+    result = changes( old, new )
+    assert result['channels'] == { 'added': [], 'removed': [ 1 ], 'changed': [] }
+    assert result['users']    == { 'added': [ user( 2 ) ], 'removed': [ 1 ], 'changed': [] }
+
+
+def test_history_keeps_version_while_only_idle_times_grow():
+    history = SnapshotHistory( 8 )
+    first  = history.record( 1, FakeSnapshot( [ ROOT ], [ user( 1, idlesecs=1 ) ] ) )
+    second = history.record( 1, FakeSnapshot( [ ROOT ], [ user( 1, idlesecs=9 ) ] ) )
+    assert second is not first
+    assert second.version == first.version
+    assert len( history.rings[1] ) == 1
+
+    same = history.record( 1, FakeSnapshot( [ ROOT ], [ user( 1, idlesecs=9 ) ] ) )
+    assert same is second
+
+
+def test_history_since_matches_changes():
+    history = SnapshotHistory( 8 )
+    trees = [
+        ( [ ROOT, channel( 1, 0 ) ], [ user( 1 ), user( 2 ) ] ),
+        ( [ ROOT, channel( 1, 0 ) ], [ user( 1, channel=1 ), user( 2 ), user( 3 ) ] ),
+        ( [ ROOT ],                  [ user( 1 ), user( 3 ), user( 4 ) ] ),
+        ( [ ROOT, channel( 5, 0 ) ], [ user( 1 ), user( 4, channel=5 ) ] ),
+        ]
+    snaps = [ history.record( 1, FakeSnapshot( *tree ) ) for tree in trees ]
+    assert [ snap.version for snap in snaps ] == list( range( snaps[0].version, snaps[0].version + 4 ) )
+
+    latest = snaps[-1]
+    for snap in snaps[1:-1]:
+        assert history.since( 1, snap.version, latest ) == changes( snap.flat, latest.flat )
+
+    # user 1 moved away and back, which is reported as a change
+    delta = history.since( 1, snaps[0].version, latest )
+    expected = changes( snaps[0].flat, latest.flat )
+    assert delta['channels'] == expected['channels']
+    assert delta['users']['removed'] == expected['users']['removed']
+    assert delta['users']['added'] == expected['users']['added']
+    assert delta['users']['changed'] == [ user( 1 ) ]
+
+    assert history.since( 1, latest.version, latest ) == changes( latest.flat, latest.flat )
+
+
+def test_history_forgets_old_versions():
+    history = SnapshotHistory( 2 )
+    snaps = [ history.record( 1, FakeSnapshot( [ ROOT ], [ user( session ) ] ) ) for session in range( 1, 4 ) ]
+    assert history.since( 1, snaps[0].version, snaps[-1] ) is None
+    assert history.since( 1, snaps[1].version, snaps[-1] ) is not None
+    assert history.since( 1, 12345, snaps[-1] ) is None
+    assert history.since( 2, snaps[1].version, snaps[-1] ) is None
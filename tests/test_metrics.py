@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+# kate: space-indent on; indent-width 4; replace-tabs on;
+
+"""
+ *  Copyright © 2009-2010, Michael "Svedrin" Ziegler <diese-addy@funzt-halt.net>
+ *
+ *  Mumble-Django is free software; you can redistribute it and/or modify
+ *  it under the terms of the GNU General Public License as published by
+ *  the Free Software Foundation; either version 2 of the License, or
+ *  (at your option) any later version.
+ *
+ *  This package is distributed in the hope that it will be useful,
+ *  but WITHOUT ANY WARRANTY; without even the implied warranty of
+ *  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ *  GNU General Public License for more details.
+
+"""
+
+import gc
+import threading
+
+from cvp.metrics import Counter, Histogram
+
+
+def runThread( func ):
+    thread = threading.Thread( target=func )
+    thread.start()
+    thread.join()
+    gc.collect()
+
+
+def test_counter_sums_threads():
+    counter = Counter( "test_total", "help", ( "kind", ) )
+    for _ in range( 5 ):
+        runThread( lambda: counter.inc( ( "a", ) ) )
+    counter.inc( ( "b", ), 2 )
+    assert counter.collect() == { ( "a", ): 5, ( "b", ): 2 }
+    # only the main thread's shard is still alive
+    assert len( counter.shards ) == 1
+
+
+def test_thread_exit_retires_its_own_shard():
+    # Two threads holding equal values: the one that exits must be retired,
+    # not the first equal shard found.
+    counter = Counter( "test_total", "help", () )
+    counted = threading.Event()
+    finish  = threading.Event()
+
+    def longLived():
+        counter.inc()
+        counted.set()
+        finish.wait()
+        counter.inc()
+        counter.inc()
+
+    thread = threading.Thread( target=longLived )
+    thread.start()
+    counted.wait()
+    runThread( counter.inc )
+    assert counter.collect() == { (): 2 }
+
+    finish.set()
+    thread.join()
+    assert counter.collect() == { (): 4 }
+    del thread
+    gc.collect()
+    assert counter.collect() == { (): 4 }
+    assert counter.shards == {}
+
+
+def test_histogram_merges_retired_shards():
+    histogram = Histogram( "test_seconds", "help", (), buckets=( 1, 2 ) )
+    runThread( lambda: histogram.observe( (), .5 ) )
+    runThread( lambda: histogram.observe( (), 3 ) )
+    assert histogram.collect() == { (): [ 1, 0, 1, 3.5 ] }